@@ -0,0 +1,73 @@
+"""
+Benchmark for the catalog loader used by the inventory page and the sale/purchase dialogs.
+Compares the old per-product variant lookup with the batched Product.get_all.
+
+Usage: python -m bench.bench_catalog --products 10000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from bench.generator import populate_catalog
+
+
+def get_all_per_product(active=1):
+    """Previous implementation of Product.get_all: one variant query per product."""
+    from db.db import get_connection
+    from models.product_variant import ProductVariant
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+               SELECT product.id, product.name, category.name AS category, product.unit, product.price, product.stock, product.stock_low
+               FROM product JOIN category ON product.category_id = category.id WHERE product.active= ? 
+               GROUP BY product.name, category.name
+           """, (active,))
+        products = [{"id": row[0], "name": row[1], "category": row[2], "unit": row[3], "price": row[4], "stock": row[5], "stock_low": row[6]} for row in cursor.fetchall()]
+        for product in products:
+            product["variants"] = ProductVariant.get_by_product_id(product["id"])
+    return products
+
+
+def timed(func, repeat):
+    """Run func `repeat` times and return the best time in seconds and the last result."""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the catalog loader.")
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--variant-ratio", type=float, default=0.3)
+    parser.add_argument("--variants", type=int, default=4, help="Variants per product with variants")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # The database lives in %APPDATA%/LaChapitaManager, point it to a throwaway folder
+        os.environ["APPDATA"] = tmp
+        from db.db import initialize_db
+        from models.product import Product
+
+        initialize_db()
+        n_products, n_variants = populate_catalog(args.products, args.variant_ratio, args.variants)
+        print(f"Database: {n_products} products, {n_variants} variants")
+
+        before, old = timed(get_all_per_product, args.repeat)
+        after, new = timed(lambda: Product.get_all(active=1), args.repeat)
+
+        assert sorted(old, key=lambda p: p["id"]) == sorted(new, key=lambda p: p["id"]), "Loaders returned different catalogs"
+        print(f"Per-product variants: {before * 1000:9.1f} ms")
+        print(f"Batched get_all:      {after * 1000:9.1f} ms")
+        print(f"Speedup:              {before / after:9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
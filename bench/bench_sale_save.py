@@ -0,0 +1,74 @@
+"""
+Micro-benchmark for Sale.save: how many sale lines per second it writes, and how many SQL statements each line costs.
+
+Usage: python -m bench.bench_sale_save --sales 500 --lines 5
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from bench.generator import populate_catalog
+
+
+def build_sales(sales, lines, seed=2):
+    """Random sales: each one has `lines` different products, picking a variant when the product has them."""
+    from db.db import get_connection
+
+    rnd = random.Random(seed)
+    conn = get_connection()
+    products = [row[0] for row in conn.execute("SELECT id FROM product")]
+    variants = {}
+    for variant_id, product_id in conn.execute("SELECT id, product_id FROM product_variant"):
+        variants.setdefault(product_id, []).append(variant_id)
+
+    result = []
+    for _ in range(sales):
+        items = {}
+        for product_id in rnd.sample(products, lines):
+            variant_id = rnd.choice(variants[product_id]) if product_id in variants else None
+            items[(product_id, variant_id)] = {"quantity": rnd.randint(1, 3), "unit_price": rnd.uniform(100, 5000)}
+        result.append(items)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Sale.save.")
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--sales", type=int, default=500)
+    parser.add_argument("--lines", type=int, default=5, help="Lines (products) per sale")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # The database lives in %APPDATA%/LaChapitaManager, point it to a throwaway folder
+        os.environ["APPDATA"] = tmp
+        from db.db import initialize_db, get_connection
+        from models.sale import Sale
+
+        initialize_db()
+        populate_catalog(args.products, variant_ratio=0.3, variants_per_product=4)
+        conn = get_connection()
+        with conn:
+            # Enough stock for every sale
+            conn.execute("UPDATE product_variant SET stock = 1000000")
+            conn.execute("UPDATE product SET stock = 1000000")
+        sales = build_sales(args.sales, args.lines)
+
+        statements = []
+        conn.set_trace_callback(statements.append)
+        start = time.perf_counter()
+        for items in sales:
+            Sale(items=items, client_id=None, date="2025-01-01").save()
+        elapsed = time.perf_counter() - start
+        conn.set_trace_callback(None)
+
+        lines = args.sales * args.lines
+        print(f"Sales saved:          {args.sales} ({lines} lines)")
+        print(f"Time:                 {elapsed * 1000:9.1f} ms")
+        print(f"Lines per second:     {lines / elapsed:9.0f}")
+        print(f"Statements per line:  {len(statements) / lines:9.1f}")
+
+
+if __name__ == "__main__":
+    main()
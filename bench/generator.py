@@ -0,0 +1,189 @@
+"""
+Synthetic LaChapita databases for the benchmarks: categories, products with and without variants, clients,
+suppliers and years of sales and purchases with their details and stock transactions.
+Rows are written straight into the tables created by initialize_db (db/schema.sql and the migrations), in one
+transaction, and the rollups are rebuilt at the end, so the result looks like a database used for years.
+
+Usage: python -m bench.generator --scale medium --output lachapita_medium.db
+"""
+import argparse
+import os
+import random
+import time
+from datetime import date, timedelta
+
+# Sizes of each scale. Sales and purchases are spread over `years` up to today
+SCALES = {
+    "small": {"categories": 10, "products": 300, "variant_ratio": 0.3, "variants_per_product": 3,
+              "clients": 50, "suppliers": 10, "years": 1, "sales_per_day": 10, "purchases_per_week": 3},
+    "medium": {"categories": 20, "products": 2000, "variant_ratio": 0.3, "variants_per_product": 4,
+               "clients": 500, "suppliers": 30, "years": 2, "sales_per_day": 30, "purchases_per_week": 10},
+    "large": {"categories": 40, "products": 10000, "variant_ratio": 0.3, "variants_per_product": 4,
+              "clients": 2000, "suppliers": 80, "years": 3, "sales_per_day": 80, "purchases_per_week": 25},
+}
+
+PRODUCTS = ["Yerba", "Azúcar", "Harina", "Arroz", "Fideos", "Aceite", "Leche", "Galletitas", "Café", "Té",
+            "Gaseosa", "Agua", "Jugo", "Cerveza", "Vino", "Queso", "Manteca", "Dulce de leche", "Mermelada", "Pan",
+            "Jabón", "Detergente", "Lavandina", "Shampoo", "Papel higiénico", "Alfajor", "Chocolate", "Caramelos"]
+BRANDS = ["La Serenísima", "Arcor", "Molinos", "Marolio", "Taragüí", "Ledesma", "Cañuelas", "Knorr", "Quilmes",
+          "Fargo", "Bagley", "Terrabusi", "Natura", "Cif", "Ayudín", "Elegante"]
+VARIANTS = ["Chico", "Mediano", "Grande", "Familiar", "Light", "Clásico", "Sin TACC", "Naranja", "Limón", "Pomelo"]
+NAMES = ["Juan", "María", "José", "Ana", "Carlos", "Lucía", "Jorge", "Sofía", "Martín", "Valentina", "Diego",
+         "Camila", "Pablo", "Florencia", "Andrés", "Micaela"]
+SURNAMES = ["González", "Rodríguez", "Gómez", "Fernández", "López", "Díaz", "Martínez", "Pérez", "Romero",
+            "Sánchez", "García", "Sosa", "Torres", "Ruiz", "Ramírez", "Álvarez"]
+UNITS = ["unidad", "kg", "g", "l", "ml", "bolsa", "botella", "caja", "lata"]
+
+
+def populate_catalog(products, variant_ratio, variants_per_product, categories=20, seed=1, conn=None):
+    """
+    Fills the database with categories, products and variants.
+    About 10% of the products and variants are left at or below their minimum stock.
+    :return: Tuple (number of products, number of variants).
+    """
+    from db.db import get_connection
+
+    rnd = random.Random(seed)
+    if conn is None:
+        conn = get_connection()
+    with conn:
+        cursor = conn.cursor()
+        cursor.executemany("INSERT INTO category (name) VALUES (?)", [(f"Categoría {i}",) for i in range(1, categories + 1)])
+        category_ids = [row[0] for row in cursor.execute("SELECT id FROM category")]
+
+        def stock():
+            return rnd.randint(0, 5) if rnd.random() < 0.1 else rnd.randint(6, 200)
+
+        product_rows = []
+        variant_rows = []
+        for i in range(1, products + 1):
+            has_variants = rnd.random() < variant_ratio
+            name = f"{rnd.choice(PRODUCTS)} {rnd.choice(BRANDS)} {i:05d}"
+            variant_stocks = [stock() for _ in range(variants_per_product)] if has_variants else []
+            product_rows.append((i, name, rnd.choice(category_ids), rnd.choice(UNITS),
+                                 -1 if has_variants else round(rnd.uniform(100, 5000), 2),
+                                 sum(variant_stocks) if has_variants else stock(), -1 if has_variants else 5))
+            for v, variant_stock in enumerate(variant_stocks):
+                variant_rows.append((i, VARIANTS[v % len(VARIANTS)], variant_stock, 5, round(rnd.uniform(100, 5000), 2)))
+        cursor.executemany("INSERT INTO product (id, name, category_id, unit, price, stock, stock_low) VALUES (?, ?, ?, ?, ?, ?, ?)", product_rows)
+        cursor.executemany("INSERT INTO product_variant (product_id, variant_name, stock, stock_low, price) VALUES (?, ?, ?, ?, ?)", variant_rows)
+    return len(product_rows), len(variant_rows)
+
+
+def _people(rnd, count):
+    rows = []
+    for i in range(count):
+        name, surname = rnd.choice(NAMES), rnd.choice(SURNAMES)
+        phone = f"11{rnd.randint(10000000, 99999999)}" if rnd.random() < 0.7 else ""
+        mail = f"{name.lower()}.{surname.lower()}{i}@mail.com" if rnd.random() < 0.5 else ""
+        rows.append((name, surname, phone, mail))
+    return rows
+
+
+def _documents(conn, kind, rnd, items, days, per_day, party_ids, first_day):
+    """
+    Writes sales or purchases with their details and stock transactions.
+    :param items: List of (product_id, variant_id, price) to pick the lines from.
+    :param per_day: Average number of documents per day.
+    :return: Number of documents and of detail lines written.
+    """
+    party = "client_id" if kind == "sale" else "supplier_id"
+    type = "out" if kind == "sale" else "in"
+    headers, details, transactions = [], [], []
+    record_id = 0
+    for day in range(days):
+        iso = (first_day + timedelta(days=day)).isoformat()
+        # Rounded at random, so rates below one a day (purchases) still give documents
+        count = max(0.0, rnd.gauss(per_day, per_day / 4))
+        for _ in range(int(count) + (rnd.random() < count % 1)):
+            record_id += 1
+            total = 0
+            for product_id, variant_id, price in rnd.sample(items, rnd.randint(1, 4 if kind == "sale" else 8)):
+                quantity = rnd.randint(1, 3) if kind == "sale" else rnd.randint(5, 50)
+                unit_price = price if kind == "sale" else round(price * 0.6, 2)
+                total += quantity * unit_price
+                details.append((record_id, product_id, variant_id, quantity, unit_price))
+                transactions.append((product_id, variant_id, iso, type, quantity, record_id))
+            # A fifth of the sales have no client
+            party_id = rnd.choice(party_ids) if party_ids and (kind == "purchase" or rnd.random() < 0.8) else None
+            headers.append((record_id, iso, party_id, round(total, 2)))
+
+    cursor = conn.cursor()
+    cursor.executemany(f"INSERT INTO {kind} (id, date, {party}, total) VALUES (?, ?, ?, ?)", headers)
+    cursor.executemany(f"INSERT INTO {kind}_detail ({kind}_id, product_id, variant_id, quantity, unit_price) VALUES (?, ?, ?, ?, ?)", details)
+    cursor.executemany(f"INSERT INTO transaction_stock (product_id, variant_id, date, type, quantity, {kind}_id) VALUES (?, ?, ?, ?, ?, ?)", transactions)
+    return len(headers), len(details)
+
+
+def generate(scale="small", seed=1, **overrides):
+    """
+    Fills the database of the current APPDATA (which must be empty and initialized) with a synthetic dataset.
+    :param scale: Name of a scale in SCALES.
+    :param seed: Seed of the random generator, so the same scale always gives the same data.
+    :param overrides: Values that replace the ones of the scale (for example products=500).
+    :return: Dictionary with the number of rows of each kind and the seconds it took.
+    """
+    from db.db import get_connection
+    from models import rollup
+
+    params = dict(SCALES[scale], **overrides)
+    rnd = random.Random(seed)
+    start = time.perf_counter()
+    conn = get_connection()
+
+    products, variants = populate_catalog(params["products"], params["variant_ratio"], params["variants_per_product"],
+                                          categories=params["categories"], seed=seed, conn=conn)
+    with conn:
+        cursor = conn.cursor()
+        cursor.executemany("INSERT INTO client (name, surname, phone, mail) VALUES (?, ?, ?, ?)", _people(rnd, params["clients"]))
+        cursor.executemany("INSERT INTO supplier (name, surname, phone, mail) VALUES (?, ?, ?, ?)", _people(rnd, params["suppliers"]))
+        client_ids = [row[0] for row in cursor.execute("SELECT id FROM client")]
+        supplier_ids = [row[0] for row in cursor.execute("SELECT id FROM supplier")]
+
+        # Lines are picked among the products without variants and the variants
+        cursor.execute("""
+            SELECT p.id, pv.id, COALESCE(pv.price, p.price)
+            FROM product p LEFT JOIN product_variant pv ON pv.product_id = p.id
+        """)
+        items = cursor.fetchall()
+
+        days = 365 * params["years"]
+        first_day = date.today() - timedelta(days=days - 1)
+        sales, sale_lines = _documents(conn, "sale", rnd, items, days, params["sales_per_day"], client_ids, first_day)
+        purchases, purchase_lines = _documents(conn, "purchase", rnd, items, days, params["purchases_per_week"] / 7,
+                                               supplier_ids, first_day)
+    rollup.rebuild(conn)
+    conn.execute("ANALYZE")
+
+    return {"scale": scale, "products": products, "variants": variants, "clients": len(client_ids),
+            "suppliers": len(supplier_ids), "sales": sales, "sale_lines": sale_lines, "purchases": purchases,
+            "purchase_lines": purchase_lines, "seconds": round(time.perf_counter() - start, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic LaChapita database.")
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", required=True, help="Path of the database file to create")
+    args = parser.parse_args()
+
+    if os.path.exists(args.output):
+        parser.error(f"{args.output} already exists")
+
+    import shutil
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        # The database lives in %APPDATA%/LaChapitaManager, point it to a throwaway folder
+        os.environ["APPDATA"] = tmp
+        from db.db import initialize_db, get_writable_db_path, checkpoint, close_all
+
+        initialize_db()
+        sizes = generate(args.scale, seed=args.seed)
+        checkpoint()
+        close_all()
+        shutil.copy(get_writable_db_path(), args.output)
+    print(sizes)
+
+
+if __name__ == "__main__":
+    main()
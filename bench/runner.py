@@ -0,0 +1,168 @@
+"""
+Benchmark suite of the models layer over synthetic databases (see bench.generator).
+For each scale it generates a database in a throwaway folder, times the queries behind the pages and writes the
+results to a JSON file, which can be compared with the one of a previous run to catch regressions.
+
+Usage: python -m bench.runner --scales small medium --output results.json [--compare previous.json]
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from bench.bench_sale_save import build_sales
+from bench.generator import SCALES, generate
+
+SALES_TO_SAVE = 200
+LINES_PER_SALE = 5
+
+
+def measure(func, repeat):
+    """
+    Runs func `repeat` times.
+    :return: Dictionary with the best and median time in milliseconds and every run.
+    """
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        runs.append((time.perf_counter() - start) * 1000)
+    return {"best_ms": round(min(runs), 3), "median_ms": round(statistics.median(runs), 3),
+            "runs": [round(run, 3) for run in runs]}
+
+
+def benchmarks():
+    """
+    The timed functions, in the order they run. The ones that write go last, so they don't change the data
+    the queries read.
+    :return: List of (name, function).
+    """
+    from models.product import Product
+    from models.sale import Sale
+    from services.dashboard_services import DashboardService
+    from utils.periods import get_period_range
+
+    month = get_period_range("Ultimo mes")
+    month_iso = tuple(datetime.strptime(day, "%d-%m-%Y").strftime("%Y-%m-%d") for day in month)
+
+    return [
+        ("product.get_all", lambda: Product.get_all(1)),
+        ("product.get_low_stock", lambda: Product.get_low_stock(5)),
+        ("sale.get_all.month", lambda: Sale.get_all(*month_iso)),
+        ("sale.get_all.all_time", lambda: Sale.get_all(None, None)),
+        ("sale.get_top5_products.month", lambda: Sale.get_top5_products(*month_iso)),
+        ("sale.get_top5_products.all_time", lambda: Sale.get_top5_products(None, None)),
+        # What the home page loads for each period
+        ("home.get_data.month", lambda: DashboardService.get_dashboard(*month)),
+        ("home.get_data.all_time", lambda: DashboardService.get_dashboard()),
+    ]
+
+
+def bench_sale_save(repeat):
+    """
+    Times saving SALES_TO_SAVE sales of LINES_PER_SALE lines each, on fresh sales every run.
+    The stock is raised first so no sale is rejected.
+    """
+    from db.db import get_connection
+    from models.sale import Sale
+
+    conn = get_connection()
+    with conn:
+        conn.execute("UPDATE product_variant SET stock = 1000000")
+        conn.execute("UPDATE product SET stock = 1000000")
+    batches = [build_sales(SALES_TO_SAVE, LINES_PER_SALE, seed=run) for run in range(repeat)]
+    date = datetime.now().strftime("%Y-%m-%d")
+
+    def save():
+        for items in batches.pop():
+            Sale(items=items, client_id=None, date=date).save()
+
+    result = measure(save, repeat)
+    result["lines_per_second"] = round(SALES_TO_SAVE * LINES_PER_SALE / (result["best_ms"] / 1000))
+    return result
+
+
+def run_scale(scale, repeat, seed):
+    """Generates a database of the given scale and runs every benchmark on it."""
+    with tempfile.TemporaryDirectory() as tmp:
+        # The database lives in %APPDATA%/LaChapitaManager, point it to a throwaway folder
+        os.environ["APPDATA"] = tmp
+        from db.db import initialize_db, close_all
+
+        close_all()  # The next connection opens the database of the new folder
+        initialize_db()
+        sizes = generate(scale, seed=seed)
+        print(f"[{scale}] {sizes}")
+
+        results = {}
+        for name, func in benchmarks():
+            results[name] = measure(func, repeat)
+            print(f"[{scale}] {name:34} best {results[name]['best_ms']:9.1f} ms  median {results[name]['median_ms']:9.1f} ms")
+        results["sale.save"] = bench_sale_save(repeat)
+        print(f"[{scale}] {'sale.save':34} best {results['sale.save']['best_ms']:9.1f} ms  "
+              f"({results['sale.save']['lines_per_second']} lines/s)")
+        close_all()  # Release the files before the folder is removed
+    return {"sizes": sizes, "results": results}
+
+
+def compare(current, previous, threshold):
+    """
+    Prints the change of the median of every benchmark found in both runs.
+    :param threshold: Ratio (current / previous) above which a benchmark counts as a regression.
+    :return: List of (scale, benchmark, ratio) of the regressions.
+    """
+    regressions = []
+    for scale, data in current["scales"].items():
+        old = previous.get("scales", {}).get(scale)
+        if old is None:
+            continue
+        for name, result in data["results"].items():
+            if name not in old["results"]:
+                continue
+            before, after = old["results"][name]["median_ms"], result["median_ms"]
+            ratio = after / before if before else 1.0
+            mark = "  REGRESSION" if ratio > threshold else ""
+            print(f"[{scale}] {name:34} {before:9.1f} -> {after:9.1f} ms  x{ratio:.2f}{mark}")
+            if ratio > threshold:
+                regressions.append((scale, name, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the models layer over synthetic databases.")
+    parser.add_argument("--scales", nargs="+", choices=SCALES, default=["small"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="JSON file to write the results to")
+    parser.add_argument("--compare", help="JSON file of a previous run to compare with")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="Slowdown ratio of the median that counts as a regression")
+    args = parser.parse_args()
+
+    report = {
+        "meta": {"date": datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+                 "sqlite": sqlite3.sqlite_version, "platform": platform.platform(), "seed": args.seed,
+                 "repeat": args.repeat},
+        "scales": {scale: run_scale(scale, args.repeat, args.seed) for scale in args.scales},
+    }
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            previous = json.load(file)
+        if compare(report, previous, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,183 @@
 import sqlite3
 import os
-from utils.path_utils import resource_path
+import threading
+from contextlib import contextmanager
+
+from db import profiler
+from db.migrations import migrate
 from utils.path_utils import get_writable_path
 
+# PRAGMAs applied once to every new connection. Can be changed with set_pragma_profile.
+# foreign_keys stays off: the ON DELETE CASCADE clauses of schema.sql would erase the sale and purchase lines of
+# deleted categories and variants. The models delete the dependent rows themselves.
+PRAGMA_PROFILE = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -16000,  # Negative values are KiB, so ~16 MB of page cache
+    "mmap_size": 134217728,  # 128 MB
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,  # ms to wait for a lock held by another connection
+}
+
+_local = threading.local()  # Connection of the current thread
+_lock = threading.Lock()
+_connections = []  # Every connection opened by the pool, so they can be closed together
+_generation = 0  # Bumped by close_all so threads drop their old connection
+_stats = {"opened": 0, "reused": 0, "closed": 0}
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    Connection handed out by the pool.
+    Nested `with conn:` blocks share the outermost transaction: only the outermost block commits or rolls back,
+    so a model method called from inside another one doesn't commit its caller's half-done work.
+    While query profiling is enabled (see db.profiler), its cursors record every statement they run.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.depth = 0
+
+    def __enter__(self):
+        self.depth += 1
+        return super().__enter__()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.depth -= 1
+        if self.depth > 0:
+            return False
+        return super().__exit__(exc_type, exc_value, traceback)
+
+    def cursor(self, factory=None):
+        if factory is None:
+            factory = profiler.InstrumentedCursor if profiler.enabled else sqlite3.Cursor
+        return super().cursor(factory)
+
+    # The shortcuts of sqlite3.Connection run the statement in C, so they go through an instrumented cursor
+    def execute(self, sql, parameters=()):
+        if profiler.enabled:
+            return self.cursor().execute(sql, parameters)
+        return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        if profiler.enabled:
+            return self.cursor().executemany(sql, seq_of_parameters)
+        return super().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        if profiler.enabled:
+            return self.cursor().executescript(sql_script)
+        return super().executescript(sql_script)
+
+
 # Get the writable database path based on the operating system. For the executable, it will be in the AppData folder on Windows.
 def get_writable_db_path():
     app_folder = get_writable_path()
     return os.path.join(app_folder, 'lachapita.db')
 
+def apply_pragmas(conn, pragmas=None):
+    """Apply a PRAGMA profile to a connection."""
+    for name, value in (pragmas or PRAGMA_PROFILE).items():
+        conn.execute(f"PRAGMA {name}={value}").fetchall()
+
+def _open_connection(path):
+    conn = sqlite3.connect(path, factory=PooledConnection, check_same_thread=False)
+    apply_pragmas(conn)
+    with _lock:
+        _connections.append(conn)
+        _stats["opened"] += 1
+    return conn
+
 def get_connection():
-    writable_db = get_writable_db_path()
-    return sqlite3.connect(writable_db)
+    """
+    Returns the connection of the current thread, opening it the first time.
+    Each thread gets its own connection, which is reused on every call.
+    """
+    path = get_writable_db_path()
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.path == path and _local.generation == _generation:
+        with _lock:
+            _stats["reused"] += 1
+        return conn
 
-def initialize_db():
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        schema_path = resource_path("db/schema.sql")
-        with open(schema_path, "r", encoding="utf-8") as f:
-            schema = f.read()
-            cursor.executescript(schema)
+    if conn is not None:
+        _close(conn)
+    _local.conn = _open_connection(path)
+    _local.path = path
+    _local.generation = _generation
+    return _local.conn
+
+@contextmanager
+def transaction(immediate=False):
+    """
+    Context manager with the connection of the current thread. Commits when the outermost block ends and
+    rolls back if it raises.
+    :param immediate: If True, takes the write lock at the start (BEGIN IMMEDIATE) instead of on the first write.
+    """
+    conn = get_connection()
+    with conn:
+        if immediate and not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        yield conn
+
+@contextmanager
+def read_transaction():
+    """
+    Context manager for several reads that must see the same snapshot of the database, even if another
+    connection writes in between. Inside an open transaction it just reuses it.
+    """
+    conn = get_connection()
+    with conn:  # Counts as the outermost block, so the model methods called inside don't end the snapshot
+        if not conn.in_transaction:
+            conn.execute("BEGIN")
+        yield conn
+
+def _close(conn):
+    with _lock:
+        if conn in _connections:
+            _connections.remove(conn)
+            _stats["closed"] += 1
+    try:
+        conn.close()
+    except sqlite3.Error:
+        pass
 
+def close_all():
+    """
+    Closes every pooled connection, checkpointing the WAL into the database file.
+    Threads open a new connection the next time they call get_connection.
+    Other threads must not be running statements meanwhile: their connections are closed from this thread, so
+    nothing keeps the file open (a restore replaces it). The backup dialog waits for the page loads first.
+    """
+    global _generation
+    with _lock:
+        connections = list(_connections)
+        _generation += 1
+    for conn in connections:
+        _close(conn)
+    _local.conn = None
 
+def checkpoint():
+    """Copies the WAL content into the database file, so the file alone holds all the data."""
+    get_connection().execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+
+def set_pragma_profile(**pragmas):
+    """
+    Changes the PRAGMA profile. Open connections are closed so the new values apply to every connection.
+    Example: set_pragma_profile(synchronous="FULL", cache_size=-64000)
+    """
+    PRAGMA_PROFILE.update(pragmas)
+    close_all()
+
+def get_pool_stats():
+    """Returns how many connections were opened, reused and closed, and how many are open now."""
+    with _lock:
+        return dict(_stats, open=len(_connections))
+
+def reset_pool_stats():
+    with _lock:
+        for key in _stats:
+            _stats[key] = 0
+
+def initialize_db():
+    """Brings the database schema up to date. Does nothing if it already is."""
+    return migrate(get_connection())
@@ -0,0 +1,373 @@
+"""
+Versioned schema migrations.
+PRAGMA user_version holds the number of the last migration applied, so each step runs exactly once
+and a database that is already up to date does no schema work at start.
+"""
+from utils.path_utils import resource_path
+
+
+def _baseline(conn):
+    """Tables from schema.sql. Uses CREATE IF NOT EXISTS, so it is safe on databases created before migrations."""
+    with open(resource_path("db/schema.sql"), "r", encoding="utf-8") as f:
+        return f.read()
+
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_sale_date ON sale(date);
+CREATE INDEX IF NOT EXISTS idx_purchase_date ON purchase(date);
+CREATE INDEX IF NOT EXISTS idx_sale_detail_sale ON sale_detail(sale_id);
+CREATE INDEX IF NOT EXISTS idx_sale_detail_product ON sale_detail(product_id, variant_id);
+CREATE INDEX IF NOT EXISTS idx_purchase_detail_purchase ON purchase_detail(purchase_id);
+CREATE INDEX IF NOT EXISTS idx_purchase_detail_product ON purchase_detail(product_id, variant_id);
+CREATE INDEX IF NOT EXISTS idx_product_variant_product ON product_variant(product_id, variant_name);
+CREATE INDEX IF NOT EXISTS idx_product_category ON product(category_id);
+CREATE INDEX IF NOT EXISTS idx_product_name ON product(name);
+CREATE INDEX IF NOT EXISTS idx_transaction_stock_product ON transaction_stock(product_id, variant_id, sale_id, purchase_id);
+CREATE INDEX IF NOT EXISTS idx_transaction_stock_sale ON transaction_stock(sale_id);
+CREATE INDEX IF NOT EXISTS idx_transaction_stock_purchase ON transaction_stock(purchase_id);
+CREATE INDEX IF NOT EXISTS idx_transaction_stock_date ON transaction_stock(date);
+ANALYZE;
+"""
+
+PAGINATION_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_sale_client_date ON sale(client_id, date);
+CREATE INDEX IF NOT EXISTS idx_sale_total ON sale(total);
+CREATE INDEX IF NOT EXISTS idx_purchase_supplier_date ON purchase(supplier_id, date);
+CREATE INDEX IF NOT EXISTS idx_purchase_total ON purchase(total);
+ANALYZE;
+"""
+
+ROLLUPS = """
+CREATE TABLE IF NOT EXISTS sale_daily (
+    day TEXT NOT NULL,
+    product_id INTEGER NOT NULL,
+    variant_id INTEGER NOT NULL DEFAULT 0,  -- 0 when the product has no variants
+    quantity INTEGER NOT NULL,
+    amount REAL NOT NULL,
+    PRIMARY KEY (day, product_id, variant_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS sale_daily_total (
+    day TEXT PRIMARY KEY,
+    count INTEGER NOT NULL,
+    total REAL NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS purchase_daily (
+    day TEXT NOT NULL,
+    product_id INTEGER NOT NULL,
+    variant_id INTEGER NOT NULL DEFAULT 0,
+    quantity INTEGER NOT NULL,
+    amount REAL NOT NULL,
+    PRIMARY KEY (day, product_id, variant_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS purchase_daily_total (
+    day TEXT PRIMARY KEY,
+    count INTEGER NOT NULL,
+    total REAL NOT NULL
+) WITHOUT ROWID;
+
+-- Fill them with the existing sales and purchases. Kept here as it was shipped: models.rollup may change later
+DELETE FROM sale_daily;
+INSERT INTO sale_daily (day, product_id, variant_id, quantity, amount)
+SELECT h.date, d.product_id, COALESCE(d.variant_id, 0), SUM(d.quantity), SUM(d.quantity * d.unit_price)
+FROM sale h
+JOIN sale_detail d ON d.sale_id = h.id
+WHERE d.product_id IS NOT NULL
+GROUP BY h.date, d.product_id, COALESCE(d.variant_id, 0);
+
+DELETE FROM sale_daily_total;
+INSERT INTO sale_daily_total (day, count, total)
+SELECT date, COUNT(*), SUM(total) FROM sale GROUP BY date;
+
+DELETE FROM purchase_daily;
+INSERT INTO purchase_daily (day, product_id, variant_id, quantity, amount)
+SELECT h.date, d.product_id, COALESCE(d.variant_id, 0), SUM(d.quantity), SUM(d.quantity * d.unit_price)
+FROM purchase h
+JOIN purchase_detail d ON d.purchase_id = h.id
+WHERE d.product_id IS NOT NULL
+GROUP BY h.date, d.product_id, COALESCE(d.variant_id, 0);
+
+DELETE FROM purchase_daily_total;
+INSERT INTO purchase_daily_total (day, count, total)
+SELECT date, COUNT(*), SUM(total) FROM purchase GROUP BY date;
+"""
+
+
+PRICE_HISTORY = """
+CREATE TABLE IF NOT EXISTS price_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_id INTEGER NOT NULL,
+    variant_id INTEGER NOT NULL DEFAULT 0,  -- 0 for the price of the product itself
+    price REAL NOT NULL,
+    changed_at TEXT NOT NULL  -- YYYY-MM-DD HH:MM:SS, local time
+);
+CREATE INDEX IF NOT EXISTS idx_price_history_item ON price_history(product_id, variant_id, changed_at);
+
+-- Every price written to product/product_variant is recorded, whatever code changes it.
+-- Products with variants have price -1, that is not a price and is not recorded
+CREATE TRIGGER IF NOT EXISTS trg_product_price_insert AFTER INSERT ON product
+WHEN NEW.price IS NOT NULL AND NEW.price >= 0
+BEGIN
+    INSERT INTO price_history (product_id, variant_id, price, changed_at)
+    VALUES (NEW.id, 0, NEW.price, datetime('now', 'localtime'));
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_product_price_update AFTER UPDATE OF price ON product
+WHEN NEW.price IS NOT OLD.price AND NEW.price IS NOT NULL AND NEW.price >= 0
+BEGIN
+    INSERT INTO price_history (product_id, variant_id, price, changed_at)
+    VALUES (NEW.id, 0, NEW.price, datetime('now', 'localtime'));
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_variant_price_insert AFTER INSERT ON product_variant
+WHEN NEW.price IS NOT NULL
+BEGIN
+    INSERT INTO price_history (product_id, variant_id, price, changed_at)
+    VALUES (NEW.product_id, NEW.id, NEW.price, datetime('now', 'localtime'));
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_variant_price_update AFTER UPDATE OF price ON product_variant
+WHEN NEW.price IS NOT OLD.price AND NEW.price IS NOT NULL
+BEGIN
+    INSERT INTO price_history (product_id, variant_id, price, changed_at)
+    VALUES (NEW.product_id, NEW.id, NEW.price, datetime('now', 'localtime'));
+END;
+
+-- The current prices have no known start, they are in effect since always
+INSERT INTO price_history (product_id, variant_id, price, changed_at)
+SELECT id, 0, price, '0001-01-01 00:00:00' FROM product WHERE price IS NOT NULL AND price >= 0;
+INSERT INTO price_history (product_id, variant_id, price, changed_at)
+SELECT product_id, id, price, '0001-01-01 00:00:00' FROM product_variant WHERE price IS NOT NULL;
+"""
+
+def _product_fts_refresh(condition):
+    """SQL that rewrites the search row of the products matching condition (over product p)."""
+    return f"""
+    DELETE FROM product_fts WHERE rowid IN (SELECT p.id FROM product p WHERE {condition});
+    INSERT INTO product_fts (rowid, name, variants, category)
+    SELECT p.id, p.name,
+           COALESCE((SELECT group_concat(variant_name, ' ') FROM product_variant WHERE product_id = p.id), ''),
+           COALESCE((SELECT name FROM category WHERE id = p.category_id), '')
+    FROM product p WHERE {condition};"""
+
+
+def _agenda_fts(table):
+    """Search table over the names and contact data of clients/suppliers, with the triggers that keep it in sync."""
+    return f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5(
+    name, surname, phone, mail,
+    content='{table}', content_rowid='id', tokenize="unicode61 remove_diacritics 2", prefix='2 3'
+);
+CREATE TRIGGER IF NOT EXISTS trg_{table}_fts_insert AFTER INSERT ON {table} BEGIN
+    INSERT INTO {table}_fts (rowid, name, surname, phone, mail) VALUES (NEW.id, NEW.name, NEW.surname, NEW.phone, NEW.mail);
+END;
+CREATE TRIGGER IF NOT EXISTS trg_{table}_fts_delete AFTER DELETE ON {table} BEGIN
+    INSERT INTO {table}_fts ({table}_fts, rowid, name, surname, phone, mail) VALUES ('delete', OLD.id, OLD.name, OLD.surname, OLD.phone, OLD.mail);
+END;
+CREATE TRIGGER IF NOT EXISTS trg_{table}_fts_update AFTER UPDATE ON {table} BEGIN
+    INSERT INTO {table}_fts ({table}_fts, rowid, name, surname, phone, mail) VALUES ('delete', OLD.id, OLD.name, OLD.surname, OLD.phone, OLD.mail);
+    INSERT INTO {table}_fts (rowid, name, surname, phone, mail) VALUES (NEW.id, NEW.name, NEW.surname, NEW.phone, NEW.mail);
+END;
+INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild');
+"""
+
+
+def _search(conn):
+    """
+    Full-text search tables (FTS5). Accents are ignored and the prefix indexes make the search-as-you-type
+    queries cheap. Products are indexed with the names of their variants and category, so the row is rewritten
+    by triggers whenever any of them changes.
+    """
+    return f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5(
+    name, variants, category,
+    tokenize="unicode61 remove_diacritics 2", prefix='2 3'
+);
+CREATE TRIGGER IF NOT EXISTS trg_product_fts_insert AFTER INSERT ON product BEGIN
+    {_product_fts_refresh("p.id = NEW.id")}
+END;
+CREATE TRIGGER IF NOT EXISTS trg_product_fts_update AFTER UPDATE OF name, category_id ON product BEGIN
+    {_product_fts_refresh("p.id = NEW.id")}
+END;
+CREATE TRIGGER IF NOT EXISTS trg_product_fts_delete AFTER DELETE ON product BEGIN
+    DELETE FROM product_fts WHERE rowid = OLD.id;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_variant_fts_insert AFTER INSERT ON product_variant BEGIN
+    {_product_fts_refresh("p.id = NEW.product_id")}
+END;
+CREATE TRIGGER IF NOT EXISTS trg_variant_fts_update AFTER UPDATE OF variant_name, product_id ON product_variant BEGIN
+    {_product_fts_refresh("p.id IN (OLD.product_id, NEW.product_id)")}
+END;
+CREATE TRIGGER IF NOT EXISTS trg_variant_fts_delete AFTER DELETE ON product_variant BEGIN
+    {_product_fts_refresh("p.id = OLD.product_id")}
+END;
+CREATE TRIGGER IF NOT EXISTS trg_category_fts_update AFTER UPDATE OF name ON category BEGIN
+    {_product_fts_refresh("p.category_id = NEW.id")}
+END;
+{_product_fts_refresh("1")}
+{_agenda_fts("client")}
+{_agenda_fts("supplier")}
+"""
+
+
+def _generations(conn):
+    """
+    Counters that triggers move on every write to a group of tables, so the pages can tell with a one-row read
+    whether the data they loaded is still current, whatever code (or program) changed it.
+    """
+    groups = {"catalog": ("product", "product_variant", "category")}
+    script = """
+CREATE TABLE IF NOT EXISTS data_generation (
+    name TEXT PRIMARY KEY,
+    generation INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+"""
+    for name, tables in groups.items():
+        script += f"INSERT OR IGNORE INTO data_generation (name) VALUES ('{name}');\n"
+        for table in tables:
+            for event in ("INSERT", "UPDATE", "DELETE"):
+                script += f"""
+CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_generation AFTER {event} ON {table} BEGIN
+    UPDATE data_generation SET generation = generation + 1 WHERE name = '{name}';
+END;"""
+    return script
+
+
+def _low_stock_refresh(product_condition, variant_condition):
+    """
+    SQL that brings low_stock up to date for the products (over product p) and variants (over product_variant pv)
+    matching the conditions. Rows are upserted or deleted, never rewritten, so the event triggers of low_stock
+    only fire when an item really enters or leaves the list.
+    """
+    product_low = "p.active = 1 AND p.stock <= p.stock_low AND NOT EXISTS (SELECT 1 FROM product_variant WHERE product_id = p.id)"
+    variant_low = "p.active = 1 AND pv.stock <= pv.stock_low"
+    return f"""
+    DELETE FROM low_stock WHERE variant_id = 0 AND product_id IN (
+        SELECT p.id FROM product p WHERE {product_condition} AND NOT ({product_low}));
+    INSERT INTO low_stock (product_id, variant_id, stock, stock_low, severity)
+    SELECT p.id, 0, p.stock, p.stock_low, CASE WHEN p.stock <= 0 THEN 2 ELSE 1 END
+    FROM product p WHERE {product_condition} AND {product_low}
+    ON CONFLICT (product_id, variant_id) DO UPDATE SET
+        stock = excluded.stock, stock_low = excluded.stock_low, severity = excluded.severity;
+    DELETE FROM low_stock WHERE variant_id IN (
+        SELECT pv.id FROM product_variant pv JOIN product p ON p.id = pv.product_id
+        WHERE {variant_condition} AND NOT ({variant_low}));
+    INSERT INTO low_stock (product_id, variant_id, stock, stock_low, severity)
+    SELECT p.id, pv.id, pv.stock, pv.stock_low, CASE WHEN pv.stock <= 0 THEN 2 ELSE 1 END
+    FROM product_variant pv JOIN product p ON p.id = pv.product_id
+    WHERE {variant_condition} AND {variant_low}
+    ON CONFLICT (product_id, variant_id) DO UPDATE SET
+        stock = excluded.stock, stock_low = excluded.stock_low, severity = excluded.severity;"""
+
+
+def _low_stock(conn):
+    """
+    Products (without variants) and variants at or below their minimum stock, kept by triggers so the home page
+    reads an indexed table instead of scanning the catalog. Entering or leaving the table is recorded in
+    low_stock_event, which the app drains to notify the user (see models.low_stock).
+    """
+    return f"""
+CREATE TABLE IF NOT EXISTS low_stock (
+    product_id INTEGER NOT NULL,
+    variant_id INTEGER NOT NULL DEFAULT 0,  -- 0 for a product without variants
+    stock INTEGER NOT NULL,
+    stock_low INTEGER NOT NULL,
+    severity INTEGER NOT NULL,  -- 2 without stock, 1 low stock
+    PRIMARY KEY (product_id, variant_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_low_stock_severity ON low_stock(severity DESC, stock);
+
+CREATE TABLE IF NOT EXISTS low_stock_event (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_id INTEGER NOT NULL,
+    variant_id INTEGER NOT NULL,
+    type TEXT CHECK(type IN ('low', 'ok')) NOT NULL,  -- low: went below the minimum, ok: back above it
+    stock INTEGER NOT NULL,
+    stock_low INTEGER NOT NULL,
+    created_at TEXT NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_low_stock_insert_event AFTER INSERT ON low_stock BEGIN
+    INSERT INTO low_stock_event (product_id, variant_id, type, stock, stock_low, created_at)
+    VALUES (NEW.product_id, NEW.variant_id, 'low', NEW.stock, NEW.stock_low, datetime('now', 'localtime'));
+END;
+CREATE TRIGGER IF NOT EXISTS trg_low_stock_delete_event AFTER DELETE ON low_stock BEGIN
+    INSERT INTO low_stock_event (product_id, variant_id, type, stock, stock_low, created_at)
+    VALUES (OLD.product_id, OLD.variant_id, 'ok', OLD.stock, OLD.stock_low, datetime('now', 'localtime'));
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_product_low_stock_insert AFTER INSERT ON product BEGIN
+    {_low_stock_refresh("p.id = NEW.id", "0")}
+END;
+CREATE TRIGGER IF NOT EXISTS trg_product_low_stock_update AFTER UPDATE OF stock, stock_low, active ON product BEGIN
+    {_low_stock_refresh("p.id = NEW.id", "pv.product_id = NEW.id AND OLD.active IS NOT NEW.active")}
+END;
+CREATE TRIGGER IF NOT EXISTS trg_product_low_stock_delete AFTER DELETE ON product BEGIN
+    DELETE FROM low_stock WHERE product_id = OLD.id;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_variant_low_stock_insert AFTER INSERT ON product_variant BEGIN
+    {_low_stock_refresh("p.id = NEW.product_id", "pv.id = NEW.id")}
+END;
+CREATE TRIGGER IF NOT EXISTS trg_variant_low_stock_update AFTER UPDATE OF stock, stock_low ON product_variant BEGIN
+    {_low_stock_refresh("0", "pv.id = NEW.id")}
+END;
+CREATE TRIGGER IF NOT EXISTS trg_variant_low_stock_delete AFTER DELETE ON product_variant BEGIN
+    DELETE FROM low_stock WHERE variant_id = OLD.id;
+    {_low_stock_refresh("p.id = OLD.product_id", "0")}
+END;
+
+{_low_stock_refresh("1", "1")}
+DELETE FROM low_stock_event;  -- The items already low are not news
+"""
+
+
+# (version, description, SQL script or function that receives the connection and returns the script)
+# Never edit a migration that was already released, add a new one at the end instead.
+MIGRATIONS = [
+    (1, "baseline schema", _baseline),
+    (2, "indexes for date ranges, details and stock transactions", INDEXES),
+    (3, "indexes for the sales and purchases filters and sort orders", PAGINATION_INDEXES),
+    (4, "daily rollups of sales and purchases", ROLLUPS),
+    (5, "price history kept by triggers", PRICE_HISTORY),
+    (6, "full-text search of products, clients and suppliers", _search),
+    (7, "generation counters of the catalog", _generations),
+    (8, "low stock table and events kept by triggers", _low_stock),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+class NewerSchemaError(RuntimeError):
+    """Raised when the database was migrated by a newer version of the app than this one."""
+
+
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """
+    Applies the pending migrations in order, each one in its own transaction.
+    :param conn: Connection to the database.
+    :return: List with the versions applied. Empty on a warm start.
+    :raises NewerSchemaError: If the database schema is newer than the last migration this app knows.
+    """
+    current = get_version(conn)
+    if current > LATEST_VERSION:
+        raise NewerSchemaError(f"The database is from a newer version of the app (schema {current}, "
+                               f"this one supports up to {LATEST_VERSION})")
+    applied = []
+    for version, description, step in MIGRATIONS:
+        if version <= current:
+            continue
+        script = step(conn) if callable(step) else step
+        try:
+            conn.executescript(f"BEGIN;\n{script}\nPRAGMA user_version = {version};\nCOMMIT;")
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"Migration {version} applied: {description}")
+        applied.append(version)
+    return applied
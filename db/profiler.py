@@ -0,0 +1,322 @@
+"""
+Query instrumentation of the pooled connections (see db.db.PooledConnection).
+While it is enabled, every statement run through a pooled connection is timed from execute to its last fetched row,
+and recorded with its parameters shape, the rows returned (or changed) and the model or service method that ran it.
+Statements are aggregated per UI action (see action), the ones slower than the threshold are written to a rotating
+log file, and the EXPLAIN QUERY PLAN of the most expensive ones can be printed with print_report.
+While it is disabled, connections hand out plain sqlite3 cursors, so the only cost is checking the enabled flag.
+
+Usage:
+    profiler.enable(threshold=50)
+    with profiler.action("InventoryPage.load_data"):
+        ProductService.get_all_products()
+    profiler.print_report()
+"""
+import contextvars
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+enabled = False  # Checked by PooledConnection every time it creates a cursor
+threshold_ms = 100.0  # Statements slower than this are written to the slow query log
+
+LOG_MAX_BYTES = 1_000_000
+LOG_BACKUPS = 3
+
+_action = contextvars.ContextVar("db_action", default=None)  # Run of the UI action of the current thread
+_lock = threading.RLock()  # Reentrant: a cursor released while recording records itself too
+_stats = {}  # (action, caller, sql) -> aggregated statement
+_log = logging.getLogger("lachapita.slow_queries")
+_log.propagate = False
+_WHITESPACE = re.compile(r"\s+")
+_OWN_FILES = {os.path.join(os.path.dirname(os.path.abspath(__file__)), name) for name in ("db.py", "profiler.py")}
+
+
+def enable(threshold=None, log_path=None):
+    """
+    Starts recording the statements of every pooled connection.
+    :param threshold: Milliseconds above which a statement goes to the slow query log. If None, it is not changed.
+    :param log_path: Path of the slow query log. By default, slow_queries.log in the app folder.
+    """
+    global enabled, threshold_ms
+    if threshold is not None:
+        threshold_ms = float(threshold)
+    if log_path is None:
+        from utils.path_utils import get_writable_path
+        log_path = os.path.join(get_writable_path(), "slow_queries.log")
+    for handler in list(_log.handlers):
+        _log.removeHandler(handler)
+        handler.close()
+    handler = RotatingFileHandler(log_path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    _log.addHandler(handler)
+    _log.setLevel(logging.INFO)
+    enabled = True
+    print(f"Query profiling enabled, statements over {threshold_ms:.0f} ms are logged to {log_path}")
+
+
+def disable():
+    """Stops recording. Cursors created from now on are plain sqlite3 cursors. The statistics are kept."""
+    global enabled
+    enabled = False
+    for handler in list(_log.handlers):
+        _log.removeHandler(handler)
+        handler.close()
+
+
+def is_enabled():
+    return enabled
+
+
+@contextmanager
+def action(name):
+    """
+    Context manager that attributes the statements run inside it, in the current thread, to the UI action name.
+    :return: Dictionary with the statements, seconds and rows of this run, updated as statements finish.
+    None if profiling is disabled.
+    """
+    if not enabled:
+        yield None
+        return
+    run = {"action": name, "statements": 0, "seconds": 0.0, "rows": 0}
+    token = _action.set(run)
+    try:
+        yield run
+    finally:
+        _action.reset(token)
+
+
+def _caller():
+    """Returns module.function of the first frame outside this package's connection code."""
+    frame = sys._getframe(2)
+    while frame is not None and frame.f_code.co_filename in _OWN_FILES:
+        frame = frame.f_back
+    if frame is None:
+        return "?"
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__', '?')}.{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def _shape(parameters):
+    """Describes the parameters without their values: (3) for three positional ones, {id, name} for named ones."""
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(sorted(parameters)) + "}"
+    try:
+        return f"({len(parameters)})"
+    except TypeError:
+        return "(?)"
+
+
+class _Statement:
+    """One execution of a statement, from execute until its last row is fetched."""
+    __slots__ = ("sql", "parameters", "shape", "caller", "run", "seconds", "rows", "explainable")
+
+    def __init__(self, sql, parameters, shape, explainable=True):
+        self.sql = sql
+        self.parameters = parameters
+        self.shape = shape
+        self.caller = _caller()
+        self.run = _action.get()
+        self.seconds = 0.0
+        self.rows = 0
+        self.explainable = explainable
+
+
+def _record(statement):
+    sql = _WHITESPACE.sub(" ", statement.sql).strip()
+    action_name = statement.run["action"] if statement.run else None
+    key = (action_name, statement.caller, sql)
+    with _lock:
+        entry = _stats.get(key)
+        if entry is None:
+            entry = _stats[key] = {"action": action_name, "caller": statement.caller, "sql": sql,
+                                   "shape": statement.shape, "count": 0, "seconds": 0.0, "max_seconds": 0.0,
+                                   "rows": 0, "sample": None}
+        entry["count"] += 1
+        entry["seconds"] += statement.seconds
+        entry["rows"] += statement.rows
+        if statement.seconds >= entry["max_seconds"]:
+            entry["max_seconds"] = statement.seconds
+            # The parameters of the slowest execution, to explain the plan it got
+            entry["sample"] = statement.parameters if statement.explainable else None
+    if statement.run is not None:
+        statement.run["statements"] += 1
+        statement.run["seconds"] += statement.seconds
+        statement.run["rows"] += statement.rows
+
+    milliseconds = statement.seconds * 1000
+    if milliseconds >= threshold_ms and _log.handlers:
+        _log.info(f"{milliseconds:.1f} ms | {action_name or '-'} | {statement.caller} | rows {statement.rows} "
+                  f"| params {statement.shape} | {sql}")
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    Cursor that records each statement it runs. The time and rows of a query include its fetches, so a statement
+    is recorded when its last row is read, when the cursor runs another one, or when it is closed or released.
+    """
+    _statement = None
+
+    def _run(self, statement, method, *args):
+        self._finish()
+        start = time.perf_counter()
+        try:
+            method(*args)
+        except BaseException:
+            statement.seconds = time.perf_counter() - start
+            _record(statement)
+            raise
+        statement.seconds = time.perf_counter() - start
+        if self.description is None:  # Nothing to fetch: INSERT, UPDATE, DELETE, DDL
+            statement.rows = max(self.rowcount, 0)
+            _record(statement)
+        else:
+            self._statement = statement
+        return self
+
+    def _finish(self):
+        statement = self._statement
+        if statement is not None:
+            self._statement = None
+            _record(statement)
+
+    def _fetched(self, start, rows, done):
+        statement = self._statement
+        if statement is not None:
+            statement.seconds += time.perf_counter() - start
+            statement.rows += rows
+            if done:
+                self._finish()
+
+    def execute(self, sql, parameters=()):
+        return self._run(_Statement(sql, parameters, _shape(parameters)), super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        seq_of_parameters = list(seq_of_parameters)
+        shape = f"{len(seq_of_parameters)} x {_shape(seq_of_parameters[0]) if seq_of_parameters else '()'}"
+        return self._run(_Statement(sql, None, shape, explainable=False), super().executemany, sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self._run(_Statement(sql_script, None, "script", explainable=False), super().executescript, sql_script)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(start, row is not None, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(start, len(rows), not rows)
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows), True)
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(start, 0, True)
+            raise
+        self._fetched(start, 1, False)
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+def _public(entry):
+    return {"action": entry["action"], "caller": entry["caller"], "sql": entry["sql"], "shape": entry["shape"],
+            "count": entry["count"], "rows": entry["rows"], "total_ms": entry["seconds"] * 1000,
+            "max_ms": entry["max_seconds"] * 1000, "mean_ms": entry["seconds"] * 1000 / entry["count"]}
+
+
+def get_stats(action_name=None):
+    """
+    Returns the aggregated statements, the most expensive first.
+    :param action_name: If given, only the statements of that UI action.
+    :return: List of dictionaries with action, caller, sql, shape, count, rows, total_ms, max_ms and mean_ms.
+    """
+    with _lock:
+        entries = [_public(entry) for entry in _stats.values() if action_name is None or entry["action"] == action_name]
+    return sorted(entries, key=lambda entry: entry["total_ms"], reverse=True)
+
+
+def get_action_summary():
+    """Returns, for each UI action (None for statements outside any), its statements, total_ms and rows."""
+    summary = {}
+    with _lock:
+        for entry in _stats.values():
+            item = summary.setdefault(entry["action"], {"statements": 0, "total_ms": 0.0, "rows": 0})
+            item["statements"] += entry["count"]
+            item["total_ms"] += entry["seconds"] * 1000
+            item["rows"] += entry["rows"]
+    return summary
+
+
+def reset_stats():
+    with _lock:
+        _stats.clear()
+
+
+def explain_top(n=5):
+    """
+    Gets the EXPLAIN QUERY PLAN of the n statements with the most total time, with the parameters of their slowest
+    execution. Statements run with executemany or executescript are skipped.
+    :return: List of the dictionaries of get_stats with a "plan" key (list of lines, or the error message).
+    """
+    from db.db import get_connection
+
+    with _lock:
+        entries = sorted((entry for entry in _stats.values() if entry["count"] and entry["shape"] != "script"
+                          and " x " not in entry["shape"]), key=lambda entry: entry["seconds"], reverse=True)[:n]
+        entries = [(_public(entry), entry["sample"]) for entry in entries]
+
+    conn = get_connection()
+    result = []
+    for entry, sample in entries:
+        try:
+            # A plain cursor, so the EXPLAIN itself is not recorded
+            rows = conn.cursor(sqlite3.Cursor).execute(f"EXPLAIN QUERY PLAN {entry['sql']}", sample or ()).fetchall()
+            entry["plan"] = [row[3] for row in rows]
+        except sqlite3.Error as e:
+            entry["plan"] = [f"Error: {e}"]
+        result.append(entry)
+    return result
+
+
+def print_report(n=5):
+    """Prints the time of each UI action and the plans of the n most expensive statements."""
+    summary = get_action_summary()
+    if not summary:
+        print("Query profiling: no statements recorded")
+        return
+    print("Query profiling per action:")
+    for name, item in sorted(summary.items(), key=lambda pair: pair[1]["total_ms"], reverse=True):
+        print(f"  {name or '(no action)'}: {item['statements']} statements, {item['total_ms']:.1f} ms, {item['rows']} rows")
+    print(f"Top {n} statements:")
+    for entry in explain_top(n):
+        print(f"  {entry['total_ms']:.1f} ms in {entry['count']} runs (max {entry['max_ms']:.1f} ms, {entry['rows']} rows) "
+              f"from {entry['caller']} [{entry['action'] or '-'}]")
+        print(f"    {entry['sql'][:200]}")
+        for line in entry["plan"]:
+            print(f"      {line}")
@@ -3,19 +3,31 @@ import sys
 
 from PySide6.QtCore import QSettings
 from PySide6.QtGui import QIcon
-from PySide6.QtWidgets import QApplication
+from PySide6.QtWidgets import QApplication, QMessageBox
 from desktop.ui.main_window import MainWindow
+from db import profiler
 from db.db import initialize_db
+from db.migrations import NewerSchemaError
 from utils import config
 from utils.path_utils import get_writable_path, resource_path
 
 if __name__ == "__main__":
 
-    initialize_db()
+    try:
+        initialize_db()
+    except NewerSchemaError as e:
+        # Writing with an older schema could break the data of the newer version
+        app = QApplication(sys.argv)
+        QMessageBox.critical(None, "LaChapita Manager",
+                             f"La base de datos fue actualizada por una versión más nueva de la aplicación. "
+                             f"Instalá la última versión para abrirla.\n\n{e}")
+        sys.exit(1)
 
     settings_path = os.path.join(get_writable_path(), "lachapita_config.ini")
     settings = QSettings(settings_path, QSettings.Format.IniFormat)
     config.backup_drive = settings.value("backup_drive_enabled", False, type=bool)
+    if settings.value("query_profiling_enabled", False, type=bool):
+        profiler.enable(settings.value("slow_query_ms", 100, type=float))
     app = QApplication(sys.argv)
     app.setWindowIcon(QIcon(resource_path("assets/icon.png")))
     window = MainWindow()
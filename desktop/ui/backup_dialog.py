@@ -2,6 +2,7 @@ from datetime import datetime
 
 from PySide6.QtWidgets import QTableWidgetItem, QDialog, QVBoxLayout, QHBoxLayout, QPushButton, QTableWidget, QMessageBox, QHeaderView
 
+from desktop.ui.page_loader import loads_paused
 from utils.backup import get_backups_drive, restore_backup_drive, get_backups_local, restore_backup_local
 from utils import config
 
@@ -46,7 +47,7 @@ class BackupDialog(QDialog):
 
     def load_backups(self):
             self.table.setRowCount(0)
-            if config.backup_drive: backups = get_backups_drive()[0]
+            if config.backup_drive: backups = get_backups_drive()
             else: backups = get_backups_local()
 
             for backup in backups:
@@ -71,10 +72,18 @@ class BackupDialog(QDialog):
         )
 
         if confirm == QMessageBox.StandardButton.Yes:
-            file_id = self.table.item(selected_row, 0).text()
             title = self.table.item(selected_row, 1).text()
-            if config.backup_drive: restore_backup_drive(file_id)
-            else: restore_backup_local(title)
-            QMessageBox.information(self, "Restaurado", "Backup restaurado correctamente.")
+            try:
+                # The pages' worker threads must not be using the database while it is replaced
+                with loads_paused():
+                    if config.backup_drive: ok, message = restore_backup_drive(title)
+                    else: ok, message = restore_backup_local(title)
+            except RuntimeError as e:
+                ok, message = False, str(e)
+            if not ok:
+                # The backup was rejected before touching the current data
+                QMessageBox.warning(self, "Error", f"No se pudo restaurar el backup. Los datos actuales no se modificaron.\n{message}")
+                return
+            QMessageBox.information(self, "Restaurado", f"Backup restaurado correctamente.\n{message}")
             self.accept()
 
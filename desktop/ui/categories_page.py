@@ -93,7 +93,10 @@ class CategoriesPage(QWidget):
         if reply == QMessageBox.Yes:
             ids = [self.table.item(row.row(), 0).text() for row in selected_items]
             for id in ids:
-                ProductService.delete_category_by_id(int(id))
+                try:
+                    ProductService.delete_category_by_id(int(id))
+                except ValueError as e:
+                    QMessageBox.warning(self, "Error", str(e))
             self.load_categories()
 
     def rename_category_dialog(self):
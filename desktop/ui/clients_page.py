@@ -1,15 +1,22 @@
 from PySide6.QtWidgets import (
-    QWidget, QVBoxLayout, QLabel, QLineEdit, QTableWidget, QTableWidgetItem,
+    QWidget, QVBoxLayout, QLabel, QLineEdit, QTableView,
     QHBoxLayout, QCheckBox, QPushButton, QDialog, QHeaderView, QMessageBox
 )
 from services.agenda_services import AgendaService
 from desktop.ui.client_dialog import ClientDialog
+from desktop.ui.page_loader import PageLoader
+from desktop.ui.table_models import Column, DictTableModel, TableFilterProxy, ButtonDelegate, ROW_ROLE
 from PySide6.QtCore import Qt
 
 
 class ClientsPage(QWidget):
+    SEARCH_LIMIT = 500
     def __init__(self):
         super().__init__()
+        self.loader = PageLoader(self)
+        self.search_loader = PageLoader(self)  # Own loader, so a search doesn't drop a load of the list
+        self.matches = None  # IDs found by the search, None when there is no search text
+        self.matches_truncated = False  # True if the search found more than SEARCH_LIMIT matches
         self.setup_ui()
 
         self.reset_filters()
@@ -27,14 +34,14 @@ class ClientsPage(QWidget):
         filter_layout = QHBoxLayout()
 
         self.search_input = QLineEdit()
-        self.search_input.setPlaceholderText("Buscar por nombre o apellido...")
-        self.search_input.textChanged.connect(self.load_clients)
+        self.search_input.setPlaceholderText("Buscar por nombre, apellido, celular o mail...")
+        self.search_input.textChanged.connect(self.search)
 
         self.email_checkbox = QCheckBox("Con email")
-        self.email_checkbox.stateChanged.connect(self.load_clients)
+        self.email_checkbox.stateChanged.connect(self.apply_filters)
 
         self.phone_checkbox = QCheckBox("Con celular")
-        self.phone_checkbox.stateChanged.connect(self.load_clients)
+        self.phone_checkbox.stateChanged.connect(self.apply_filters)
 
         # Button for new client
         btn_new_client = QPushButton("Nuevo")
@@ -53,24 +60,42 @@ class ClientsPage(QWidget):
         layout.addLayout(filter_layout)
 
         # Client's table
-        self.client_table = QTableWidget()
-        self.client_table.setColumnCount(6)
-        self.client_table.setHorizontalHeaderLabels(["Id", "Nombre", "Apellido", "Email", "Celular", "       "])
+        columns = [
+            Column("Id", "id"),
+            Column("Nombre", "name"),
+            Column("Apellido", "surname"),
+            Column("Email", "mail"),
+            Column("Celular", "phone"),
+            Column("       "),  # Edit button
+        ]
+        self.model = DictTableModel(columns, self)
+        self.proxy = TableFilterProxy(self)
+        self.proxy.setSourceModel(self.model)
+
+        self.client_table = QTableView()
+        self.client_table.setModel(self.proxy)
         self.client_table.setColumnHidden(0, True)
-        self.client_table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
-        self.client_table.setSelectionBehavior(QTableWidget.SelectionBehavior.SelectRows)
-        self.client_table.setSelectionMode(QTableWidget.SelectionMode.MultiSelection)
+        self.client_table.setEditTriggers(QTableView.EditTrigger.NoEditTriggers)
+        self.client_table.setSelectionBehavior(QTableView.SelectionBehavior.SelectRows)
+        self.client_table.setSelectionMode(QTableView.SelectionMode.MultiSelection)
+        self.client_table.setMouseTracking(True)
         self.client_table.setSortingEnabled(True)
-        self.client_table.itemSelectionChanged.connect(self.update_delete_button_state)
+        self.client_table.sortByColumn(1, Qt.SortOrder.AscendingOrder)  # Sort by name by default
+        self.client_table.selectionModel().selectionChanged.connect(self.update_delete_button_state)
+
+        # Edit button painted by a delegate instead of a widget per row
+        self.edit_delegate = ButtonDelegate("Editar", self.client_table)
+        self.edit_delegate.clicked.connect(lambda index: self.open_client(index.data(ROW_ROLE)))
+        self.client_table.setItemDelegateForColumn(5, self.edit_delegate)
 
         # Resize cols
         header = self.client_table.horizontalHeader()
         # Stretch all columns except the last one
-        for i in range(self.client_table.columnCount() - 1):
+        for i in range(self.model.columnCount() - 1):
             header.setSectionResizeMode(i, QHeaderView.ResizeMode.Stretch)
 
         # The last column (Edit button) will resize to contents
-        header.setSectionResizeMode(self.client_table.columnCount() - 1, QHeaderView.ResizeMode.ResizeToContents)
+        header.setSectionResizeMode(self.model.columnCount() - 1, QHeaderView.ResizeMode.ResizeToContents)
 
         layout.addWidget(self.client_table)
 
@@ -95,48 +120,54 @@ class ClientsPage(QWidget):
 
         if confirm == QMessageBox.StandardButton.Yes:
             for client in selected_rows:
-                client_id = self.client_table.item(client.row(), 0).text()
+                client_id = client.data(ROW_ROLE)["id"]
                 AgendaService.delete_client(int(client_id))
             self.load_clients()
 
     def load_clients(self):
-        def get_filtered_clients():
-            text = self.search_input.text().lower()
-            only_with_email = self.email_checkbox.isChecked()
-            only_with_phone = self.phone_checkbox.isChecked()
-
-            filtered = []
-            for client in AgendaService.get_all_clients():
-                full_name = f"{client['name']} {client['surname']}".lower()
-                if text and text not in full_name:
-                    continue
-                if only_with_email and not client.get("mail"):
-                    continue
-                if only_with_phone and not client.get("phone"):
-                    continue
-                filtered.append(client)
-
-            return sorted(filtered, key=lambda c: (c['name'].lower(), c['surname'].lower()))
-
-
-        filtered = get_filtered_clients()
-
-        self.total_label.setText(f"Total de clientes: {len(filtered)}")
-
-        self.client_table.setRowCount(len(filtered))
-        for row, client in enumerate(filtered):
-            self.client_table.setItem(row, 0, QTableWidgetItem(client['id']))
-            self.client_table.setItem(row, 1, QTableWidgetItem(client['name']))
-            self.client_table.setItem(row, 2, QTableWidgetItem(client['surname']))
-            self.client_table.setItem(row, 3, QTableWidgetItem(client.get('mail') or ""))
-            self.client_table.setItem(row, 4, QTableWidgetItem(client.get('phone') or ""))
-
-            # Button edit
-            btn_edit = QPushButton("Editar")
-            btn_edit.clicked.connect(lambda checked, c=client: self.open_client(c))
-            self.client_table.setCellWidget(row, 5, btn_edit)
-
-        self.client_table.sortByColumn(1, Qt.SortOrder.AscendingOrder)  # Sort by name by default
+        """Loads the clients from the database in the background, then shows them with the filters applied."""
+        self.loader.load(AgendaService.get_all_clients, self.show_clients)
+
+    def show_clients(self, clients):
+        self.model.set_rows(clients)
+        self.search()
+
+    def search(self):
+        """Looks up the search text in the full-text index in the background, then filters the list with the results."""
+        text = self.search_input.text().strip()
+        if not text:
+            self.search_loader.cancel()  # A search still running would filter the list by the old text
+            self.matches = None
+            self.matches_truncated = False
+            self.apply_filters()
+            return
+        self.search_loader.load(AgendaService.search_clients, self.show_matches, text, limit=self.SEARCH_LIMIT + 1)
+
+    def show_matches(self, clients):
+        # One more than the limit is asked for, to know if there were more matches than the ones shown
+        self.matches_truncated = len(clients) > self.SEARCH_LIMIT
+        self.matches = {client["id"] for client in clients[:self.SEARCH_LIMIT]}
+        self.apply_filters()
+
+    def apply_filters(self):
+        """Filters the loaded clients in the proxy model, without going to the database."""
+        only_with_email = self.email_checkbox.isChecked()
+        only_with_phone = self.phone_checkbox.isChecked()
+
+        def accepts(client):
+            if self.matches is not None and client["id"] not in self.matches:
+                return False
+            if only_with_email and not client.get("mail"):
+                return False
+            if only_with_phone and not client.get("phone"):
+                return False
+            return True
+
+        self.proxy.set_predicate(accepts)
+        text = f"Total de clientes: {self.proxy.rowCount()}"
+        if self.matches_truncated:
+            text += f" (solo los primeros {self.SEARCH_LIMIT} resultados de la búsqueda, refiná el texto para ver el resto)"
+        self.total_label.setText(text)
 
     def open_client(self, client=None):
         dialog = ClientDialog(self, client)
@@ -1,25 +1,15 @@
 from PySide6.QtWidgets import QVBoxLayout, QWidget, QComboBox, QHBoxLayout, QLabel, QTableWidget, QTableWidgetItem, \
     QHeaderView, QScrollArea
-from services.agenda_services import AgendaService
-from services.product_services import ProductService
-from services.transactions_services import TransactionsService
+from services.dashboard_services import DashboardService
 from desktop.ui.category_progress import SalesCategoryProgress
+from desktop.ui.page_loader import PageLoader
 from utils.periods import PERIODS, get_period_range
 
 
-def get_data(start_date, end_date):
-    sales_total, purchases_total = TransactionsService.get_totals(start_date, end_date)
-    top5_products = TransactionsService.get_top5_products(start_date=start_date, end_date=end_date)
-    last_sales = TransactionsService.get_all_sales(start_date=start_date, end_date=end_date)#.reverse()
-    last_purchases = TransactionsService.get_all_purchases(start_date=start_date, end_date=end_date)#.reverse()
-    low_stock = ProductService.get_low_stock()
-
-    return sales_total, purchases_total, last_sales, last_purchases, top5_products, low_stock
-
-
 class HomePage(QWidget):
     def __init__(self):
         super().__init__()
+        self.loader = PageLoader(self)
         self.setup_ui()
 
     def setup_ui(self):
@@ -32,7 +22,15 @@ class HomePage(QWidget):
         self.period_combo.setCurrentIndex(0) # By default, last week
         self.period_combo.currentIndexChanged.connect(self.refresh)
 
-        layout.addWidget(self.period_combo)
+        # Loading state, shown while the data is loaded in the background
+        self.loading_label = QLabel("Cargando...")
+        self.loading_label.setVisible(False)
+        self.loader.loading_changed.connect(self.loading_label.setVisible)
+
+        period_layout = QHBoxLayout()
+        period_layout.addWidget(self.period_combo)
+        period_layout.addWidget(self.loading_label)
+        layout.addLayout(period_layout)
 
         main_layout = QHBoxLayout()
         layout.addLayout(main_layout)
@@ -141,34 +139,38 @@ class HomePage(QWidget):
         table.setFixedHeight(total_height)
 
     def refresh(self):
+        """
+        Loads the data of the selected period in the background. The widgets are updated when it arrives.
+        """
         period = self.period_combo.currentText()
         start_date, end_date = get_period_range(period)
+        self.loader.load(DashboardService.get_dashboard, self.show_data, start_date, end_date)
 
-        sales_total, purchases_total, sales, purchases, top5, low_stock = get_data(start_date, end_date)
-
-        self.categories_progress.set_data(TransactionsService.get_sales_by_categories(start_date, end_date), ProductService.get_all_categories())
+    def show_data(self, data):
+        """
+        Updates the widgets with the result of DashboardService.get_dashboard.
+        """
+        sales_by_category = data["sales_by_category"]
+        self.categories_progress.set_data(sales_by_category, {cat_id: c["name"] for cat_id, c in sales_by_category.items()})
 
-        self.load_sales(sales, sales_total, top5)
-        self.load_purchases(purchases, purchases_total, low_stock)
+        self.load_sales(data)
+        self.load_purchases(data)
 
-    def load_sales(self, sales, sales_total, top5):
+    def load_sales(self, data):
         # Update total sales
-        self.total_sales.setText(f"Ventas totales: ${sales_total:.2f} ({len(sales)} ventas)")
+        self.total_sales.setText(f"Ventas totales: ${data['sales_total']:.2f} ({data['sales_count']} ventas)")
 
         # Update last sales table
-        sales = sales[:5]
+        sales = data["latest_sales"]
         self.last_sales_table.setRowCount(len(sales))
         for i, sale in enumerate(sales):
             self.last_sales_table.setItem(i, 0, QTableWidgetItem(sale["date"]))
-            client = AgendaService.get_client_by_id(sale["client_id"])
-            if client:
-                self.last_sales_table.setItem(i, 1, QTableWidgetItem(client["name"] + " " + client["surname"]))
-            else:
-                self.last_sales_table.setItem(i, 1, QTableWidgetItem("-"))
+            self.last_sales_table.setItem(i, 1, QTableWidgetItem(sale["client_name"] or "-"))
             self.last_sales_table.setItem(i, 2, QTableWidgetItem(f"${sale['total']:.2f}"))
         self.table_heigt(self.last_sales_table, 5)
 
         # Update top 5 products table
+        top5 = data["top5"]
         self.top5_table.setRowCount(len(top5))
         for i, product in enumerate(top5):
             self.top5_table.setItem(i, 0, QTableWidgetItem(product[0]))
@@ -179,25 +181,21 @@ class HomePage(QWidget):
             self.top5_table.setItem(i, 2, QTableWidgetItem(str(product[2])))
         self.table_heigt(self.top5_table, 5)
 
-    def load_purchases(self, purchases, purchases_total, low_stock):
-        self.total_purchases.setText(f"Compras totales: ${purchases_total:.2f} ({len(purchases)} compras)")
+    def load_purchases(self, data):
+        self.total_purchases.setText(f"Compras totales: ${data['purchases_total']:.2f} ({data['purchases_count']} compras)")
 
         # Update last purchases table
-        purchases = purchases[:5]
+        purchases = data["latest_purchases"]
         self.last_purchases_table.setRowCount(len(purchases))
         for i, purchase in enumerate(purchases):
             self.last_purchases_table.setItem(i, 0, QTableWidgetItem(purchase["date"]))
-            supplier = AgendaService.get_supplier_by_id(purchase["supplier_id"])
-            if supplier:
-                self.last_purchases_table.setItem(i, 1, QTableWidgetItem(supplier["name"] + " " + supplier["surname"]))
-            else:
-                self.last_purchases_table.setItem(i, 1, QTableWidgetItem("-"))
+            self.last_purchases_table.setItem(i, 1, QTableWidgetItem(purchase["supplier_name"] or "-"))
             self.last_purchases_table.setItem(i, 2, QTableWidgetItem(f"${purchase['total']:.2f}"))
         self.table_heigt(self.last_purchases_table, 5)
 
         # Update low stock table
-        self.low.setText(f"Productos con bajo stock: {len(low_stock)}")
-        low_stock = low_stock[:5]  # Show only the first 5 products with low stock
+        self.low.setText(f"Productos con bajo stock: {data['low_stock_count']}")
+        low_stock = data["low_stock"]  # Only the first 5 products with low stock
         self.low_stock_table.setRowCount(len(low_stock))
         for i, product in enumerate(low_stock):
             self.low_stock_table.setItem(i, 0, QTableWidgetItem(product["product_name"]))
@@ -1,23 +1,73 @@
-from functools import partial
+import unicodedata
 
 from PySide6.QtWidgets import (
-    QWidget, QLabel, QVBoxLayout, QHBoxLayout, QLineEdit, QComboBox, QCheckBox, QTableWidget, QTableWidgetItem,
-    QPushButton, QHeaderView, QMessageBox, QToolButton
+    QWidget, QLabel, QVBoxLayout, QHBoxLayout, QLineEdit, QComboBox, QCheckBox, QTableView,
+    QPushButton, QHeaderView, QMessageBox, QFileDialog, QApplication
 )
-from PySide6.QtCore import Qt, Signal
+from PySide6.QtCore import Qt, Signal, QTimer
 from services.product_services import ProductService
+from services.import_services import CatalogImportService
+from .page_loader import PageLoader
+from .price_update_dialog import PriceUpdateDialog
 from .product_dialog import AddProductDialog
+from .table_models import Column, DictTableModel, TableFilterProxy, ButtonDelegate, ROW_ROLE
+
+
+def search_key(text):
+    """Lowercase and without accents, so "azucar" finds "Azúcar"."""
+    text = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in text if not unicodedata.combining(c)).lower()
+
+
+class CatalogEntry:
+    """A loaded product with what the filters need precomputed, so filtering doesn't look at the variants again."""
+    __slots__ = ("product", "key", "category", "low", "empty")
+
+    def __init__(self, product):
+        self.product = product
+        self.key = search_key(product["name"])
+        self.category = product["category"]
+        variants = product["variants"]
+        if variants:
+            self.low = any(v["stock"] <= v["stock_low"] for v in variants)
+            self.empty = any(v["stock"] == 0 for v in variants)
+        else:
+            self.low = product["stock"] <= product["stock_low"]
+            self.empty = product["stock"] == 0
+
+
+def stock_color(product):
+    """Color of the stock of a product without variants: red if 0, yellow if low, else green."""
+    if product.get("variants"):
+        return None
+    if product["stock"] == 0:
+        return Qt.GlobalColor.red
+    if product["stock"] <= product["stock_low"]:
+        return Qt.GlobalColor.darkYellow
+    return Qt.GlobalColor.green
 
 
 class InventoryPage(QWidget):
     product_changed = Signal()
+    SEARCH_DELAY_MS = 200
     def __init__(self):
         super().__init__()
+        self.products = []  # Active products, loaded in the background
+        self.entries = []  # CatalogEntry of each product, sorted by name
+        self.generation = None  # Generation of the catalog when it was loaded
+        self.last_filter = None  # (text, category, low stock, no stock) of the rows shown
+        self.last_entries = []  # Entries shown, narrowed when the search text grows
+        self.loader = PageLoader(self)
+
+        # Typing only filters once it pauses for a moment, not on every key
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(self.SEARCH_DELAY_MS)
+        self.search_timer.timeout.connect(self.load_filtered_products)
         self.setup_iu()
 
         # Show the total products at the beginning
-        self.reset_filters()
-        self.load_filtered_products()
+        self.load_products()
 
     def setup_iu(self):
         main_layout = QVBoxLayout(self)
@@ -59,44 +109,102 @@ class InventoryPage(QWidget):
         self.delete_products_btn.clicked.connect(self.delete_selected_products)
         filters_layout.addWidget(self.delete_products_btn)
 
+        # Import products from a CSV/XLSX file
+        self.import_btn = QPushButton("Importar")
+        self.import_btn.clicked.connect(self.import_products)
+        filters_layout.addWidget(self.import_btn)
+
+        # Change many prices at once
+        self.prices_btn = QPushButton("Precios")
+        self.prices_btn.clicked.connect(self.open_price_update_dialog)
+        filters_layout.addWidget(self.prices_btn)
+
         main_layout.addLayout(filters_layout)
 
         # Product's table
-        self.table = QTableWidget()
-        self.table.setColumnCount(6)  # Id (hidden), Name, Category, Variants, Stock, Edit button
-        self.table.setHorizontalHeaderLabels(["Id", "Nombre", "Categoría", "Variantes", "Stock", "      "])
-        self.table.setSelectionBehavior(QTableWidget.SelectionBehavior.SelectRows)
-        self.table.setSelectionMode(QTableWidget.SelectionMode.MultiSelection)
-        self.table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        columns = [
+            Column("Id", "id"),
+            Column("Nombre", "name"),
+            Column("Categoría", "category"),
+            Column("Variantes", lambda p: len(p.get("variants", []))),  # Show amount of variants
+            Column("Stock", "stock", foreground=stock_color),
+            Column("      "),  # Edit button
+        ]
+        self.model = DictTableModel(columns, self)
+        self.proxy = TableFilterProxy(self)
+        self.proxy.setSourceModel(self.model)
+
+        self.table = QTableView()
+        self.table.setModel(self.proxy)
+        self.table.setColumnHidden(0, True)  # Hide the ID column
+        self.table.setSelectionBehavior(QTableView.SelectionBehavior.SelectRows)
+        self.table.setSelectionMode(QTableView.SelectionMode.MultiSelection)
+        self.table.setEditTriggers(QTableView.EditTrigger.NoEditTriggers)
+        self.table.setMouseTracking(True)
         self.table.setSortingEnabled(True)
-        self.table.itemSelectionChanged.connect(self.update_delete_button_state)
+        self.table.sortByColumn(1, Qt.SortOrder.AscendingOrder)
+        self.table.selectionModel().selectionChanged.connect(self.update_delete_button_state)
         main_layout.addWidget(self.table)
 
+        # Details button painted by a delegate instead of a widget per row
+        self.details_delegate = ButtonDelegate("Detalles", self.table)
+        self.details_delegate.clicked.connect(lambda index: self.open_product_dialog(index.data(ROW_ROLE)))
+        self.table.setItemDelegateForColumn(5, self.details_delegate)
+
         # Reset column
         header = self.table.horizontalHeader()
         # Stretch the columns 1 to 4
-        for i in range(1, self.table.columnCount() - 1):
+        for i in range(1, self.model.columnCount() - 1):
             header.setSectionResizeMode(i, QHeaderView.ResizeMode.Stretch)
 
         # Make edit col fit the content
-        header.setSectionResizeMode(self.table.columnCount() - 1, QHeaderView.ResizeMode.ResizeToContents)
+        header.setSectionResizeMode(self.model.columnCount() - 1, QHeaderView.ResizeMode.ResizeToContents)
 
         # Connect filters so the table updates automatically
-        self.search_bar.textChanged.connect(self.load_filtered_products)
+        self.search_bar.textChanged.connect(self.search_timer.start)
         self.category_filter.currentIndexChanged.connect(self.load_filtered_products)
         self.low_stock_cb.stateChanged.connect(self.load_filtered_products)
         self.no_stock_cb.stateChanged.connect(self.load_filtered_products)
 
-    def reset_filters(self):
-        categories = ProductService.get_all_categories()
+    def load_products(self, force=False):
+        """
+        Loads the products and categories in the background and then shows them.
+        :param force: If False, the catalog is only read again if it changed since it was loaded.
+        """
+        self.loader.load(self.load_data, self.show_data, None if force else self.generation)
+
+    @staticmethod
+    def load_data(generation=None):
+        """
+        Called from a worker thread, so it must not touch the widgets.
+        Returns None if the catalog is still at the given generation.
+        """
+        current = ProductService.get_catalog_generation()
+        if generation is not None and current == generation:
+            return None
+        return current, ProductService.get_all_products(active=1), ProductService.get_all_categories()
+
+    def show_data(self, data):
+        if data is None:  # Nothing changed
+            return
+        self.generation, self.products, categories = data
+        self.entries = sorted((CatalogEntry(p) for p in self.products), key=lambda e: e.key)
+        self.last_filter = None  # The previous result is from the old data
+        self.set_categories(categories)
+        self.load_filtered_products()
+
+    def set_categories(self, categories):
+        """Fills the category filter, keeping the selected category if it still exists."""
+        selected = self.category_filter.currentData()
+        # Block the signals so the table is filtered once, not once per added item
+        self.category_filter.blockSignals(True)
         self.category_filter.clear()
         self.category_filter.addItem("Todas las categorías", None)
         for cat in categories:
             self.category_filter.addItem(cat["name"], cat["id"])
-
-        self.low_stock_cb.setChecked(False)
-        self.no_stock_cb.setChecked(False)
-        self.search_bar.clear()
+        index = self.category_filter.findData(selected)
+        self.category_filter.setCurrentIndex(max(index, 0))
+        self.category_filter.blockSignals(False)
 
     def update_delete_button_state(self):
         selected = self.table.selectionModel().selectedRows()
@@ -112,99 +220,95 @@ class InventoryPage(QWidget):
                                      f"¿Estás seguro de que quieres eliminar {len(selected)} producto/s ?",
                                      QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
         if reply == QMessageBox.StandardButton.Yes:
-            for row in selected:
-                product_id = self.table.item(row.row(), 0).text()
+            for index in selected:
+                product_id = index.data(ROW_ROLE)["id"]
                 ProductService.delete_product(int(product_id))
             self.refresh()
 
     def load_filtered_products(self):
-        def is_variant_low(variants):
-            for v in variants:
-                if v["stock"] <= v["stock_low"]:
-                    return True
-            return False
-
-        def is_variant_no_stock(variants):
-            for v in variants:
-                if v["stock"] == 0:
-                    return True
-            return False
-
-        def get_filtered_products():
-            text = self.search_bar.text().lower()
-            category = self.category_filter.currentText()
-            low_stock = self.low_stock_cb.isChecked()
-            no_stock = self.no_stock_cb.isChecked()
-
-            products = ProductService.get_all_products(active=1)
-
-            filtered = []
-            for p in products:
-                if text and text not in p["name"].lower():
-                    continue
-                if category != "Todas las categorías" and p["category"] != category:
+        """
+        Filters the loaded products, without going to the database.
+        When only the search text grew (the old text is part of the new one), the rows shown are narrowed
+        instead of going through the whole catalog again.
+        """
+        self.search_timer.stop()
+        text = search_key(self.search_bar.text().strip())
+        category = self.category_filter.currentText()
+        low_stock = self.low_stock_cb.isChecked()
+        no_stock = self.no_stock_cb.isChecked()
+
+        entries = self.entries
+        if self.last_filter is not None:
+            last_text, last_category, last_low_stock, last_no_stock = self.last_filter
+            if (last_category, last_low_stock, last_no_stock) == (category, low_stock, no_stock):
+                if last_text == text:
+                    return
+                if last_text in text:
+                    entries = self.last_entries
+
+        all_categories = category == "Todas las categorías"
+        filtered = []
+        for entry in entries:
+            if text and text not in entry.key:
+                continue
+            if not all_categories and entry.category != category:
+                continue
+            if low_stock:
+                if not entry.low:
                     continue
-                if len(p['variants']) == 0:
-                    if low_stock and p["stock"] <= p["stock_low"]:
-                        pass
-                    else:
-                        if low_stock and p["stock"] > p["stock_low"]:
-                            continue
-                        elif no_stock and p["stock"] != 0:
-                            continue
-                else:
-                    if low_stock and is_variant_low(p["variants"]):
-                        pass
-                    else:
-                        if low_stock and not is_variant_low(p["variants"]):
-                            continue
-                        elif no_stock and not is_variant_no_stock(p["variants"]):
-                            continue
-                filtered.append(p)
-            return sorted(filtered, key=lambda x: x["name"].lower())
-
-        filtered = get_filtered_products()
+            elif no_stock and not entry.empty:
+                continue
+            filtered.append(entry)
+
+        self.last_filter = (text, category, low_stock, no_stock)
+        self.last_entries = filtered
 
         # Update total products label
         self.total_label.setText(f"Total productos: {len(filtered)}")
 
         # Update table
-        self.table.setRowCount(len(filtered))
-        for row, product in enumerate(filtered):
-            self.table.setItem(row, 0, QTableWidgetItem(str(product["id"])))
-            self.table.setColumnHidden(0, True)  # Hide the ID column
-
-            self.table.setItem(row, 1, QTableWidgetItem(product["name"]))
-            self.table.setItem(row, 2, QTableWidgetItem(product["category"]))
-            # Show amount of variables
-            variant_count = len(product.get("variants", []))
-            self.table.setItem(row, 3, QTableWidgetItem(str(variant_count)))
-            stock_item = QTableWidgetItem(str(product["stock"]))
-            if variant_count == 0:
-                # Stock in red if 0
-                if product["stock"] == 0:
-                    stock_item.setForeground(Qt.GlobalColor.red)
-                # Stock in yellow if below the low stock threshold
-                elif product["stock"] <= product["stock_low"]:
-                    stock_item.setForeground(Qt.GlobalColor.darkYellow)
-                else:
-                    # Else green
-                    stock_item.setForeground(Qt.GlobalColor.green)
-            self.table.setItem(row, 4, stock_item)
-            # Edit button
-            details_btn = QToolButton()
-            details_btn.setText("Detalles")
-            details_btn.clicked.connect(partial(self.open_product_dialog, product))
-            self.table.setCellWidget(row, 5, details_btn)
-
-    def refresh(self):
+        self.model.set_rows([entry.product for entry in filtered])
+
+    def refresh(self, force=False):
         """
-        Updates the product list and emits a signal to notify other components.
+        Updates the product list if the catalog changed and emits a signal to notify other components.
+        :param force: Read the catalog again even if its generation didn't change (for example, after the
+        database file was replaced).
         """
         self.table.selectionModel().clearSelection()  # Clear selection
         self.product_changed.emit()
-        self.reset_filters()
-        self.load_filtered_products()
+        self.load_products(force=force)
+
+    def import_products(self):
+        """Imports products from a CSV or XLSX file chosen by the user and shows a summary."""
+        path, _ = QFileDialog.getOpenFileName(self, "Importar productos", "", "Planillas (*.csv *.xlsx);;CSV (*.csv);;Excel (*.xlsx)")
+        if not path:
+            return
+
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            result = CatalogImportService.import_file(path)
+        except Exception as e:
+            return QMessageBox.critical(self, "Error", f"No se pudo importar el archivo:\n{str(e)}")
+        finally:
+            QApplication.restoreOverrideCursor()
+
+        summary = (f"Filas importadas: {result['imported']} de {result['rows']}\n"
+                   f"Productos nuevos: {result['created_products']}, actualizados: {result['updated_products']}\n"
+                   f"Variantes nuevas: {result['created_variants']}, actualizadas: {result['updated_variants']}")
+        if result["created_categories"]:
+            summary += f"\nCategorías nuevas: {', '.join(result['created_categories'])}"
+        if result["errors"]:
+            summary += f"\n\nFilas con errores: {len(result['errors'])}\n"
+            summary += "\n".join(f"Fila {line}: {message}" for line, message in result["errors"][:10])
+            if len(result["errors"]) > 10:
+                summary += "\n..."
+        QMessageBox.information(self, "Importación terminada", summary)
+        self.refresh()
+
+    def open_price_update_dialog(self):
+        if PriceUpdateDialog(parent=self).exec() == PriceUpdateDialog.DialogCode.Accepted:
+            self.refresh()
 
     def open_product_dialog(self, p=None):
         dialog = AddProductDialog(product=p, parent=self)
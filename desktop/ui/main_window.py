@@ -1,8 +1,8 @@
 import os
 
 from PySide6.QtGui import QIcon
-from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QStackedWidget, QLabel, QMessageBox
-from PySide6.QtCore import Qt, QSettings
+from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QStackedWidget, QLabel, QMessageBox, QProgressDialog
+from PySide6.QtCore import Qt, QSettings, Signal, QTimer
 
 from .backup_dialog import BackupDialog
 from .backup_toggle import DriveBackupToggle
@@ -11,15 +11,26 @@ from .home_page import HomePage
 from .suppliers_page import SuppliersPage
 from .categories_page import CategoriesPage
 from .inventory_page import InventoryPage
+from .page_loader import wait_for_loaders
 from .purchases_page import PurchasesPage
 from .sales_page import SalesPage
 
+from db import profiler
+from services import stock_alerts
 from utils import config
-from utils.backup import make_backup, authenticate_drive
+from utils.backup import start_backup, authenticate_drive
 from utils.path_utils import resource_path, get_writable_path
 
 
+# Longest time closing the window waits for the backup. After it the app exits and the partial copy is discarded
+BACKUP_TIMEOUT_MS = 60000
+
+
 class MainWindow(QWidget):
+    low_stock_alert = Signal(object)  # Events from stock_alerts, delivered in the GUI thread
+    backup_progress = Signal(int, int)  # Pages copied, total pages. From the backup thread
+    backup_finished = Signal(bool)
+
     def __init__(self):
         super().__init__()
 
@@ -158,6 +169,18 @@ class MainWindow(QWidget):
         # Signal connections for refreshing pages
         self.inventory_page.product_changed.connect(self.categories_page.refresh)
 
+        # Warn when a sale or an edit leaves products with low stock
+        self.low_stock_box = None
+        self.low_stock_alert.connect(self.show_low_stock_alert)
+        stock_alerts.add_listener(self.low_stock_alert.emit)
+
+        # Backup made when closing, in a background thread
+        self.closing = False
+        self.ready_to_close = False
+        self.backup_dialog = None
+        self.backup_progress.connect(self.on_backup_progress)
+        self.backup_finished.connect(self.on_backup_finished)
+
     def handle_drive_backup_toggle(self, enabled: bool):
         """
         Handle the toggle state of the Drive Backup.
@@ -187,16 +210,82 @@ class MainWindow(QWidget):
             settings.setValue("backup_drive_enabled", False)
             print("Drive Backup disabled.")
 
+    def show_low_stock_alert(self, events):
+        """Shows, without blocking, the products and variants that just reached their minimum stock."""
+        lines = []
+        for event in events:
+            if event["type"] != "low":
+                continue
+            name = event["product_name"] or "Producto eliminado"
+            if event["variant_name"]:
+                name += f" ({event['variant_name']})"
+            lines.append(f"- {name}: {event['stock']} (mínimo {event['stock_low']})")
+        if not lines:
+            return
+        if self.low_stock_box is not None:
+            self.low_stock_box.close()
+        self.low_stock_box = QMessageBox(QMessageBox.Icon.Warning, "Stock bajo",
+                                         "Quedaron con stock bajo:\n" + "\n".join(lines), parent=self)
+        self.low_stock_box.setModal(False)
+        self.low_stock_box.show()
+
     def closeEvent(self, event):
         """
-        Override close event make a backup before closing the window.
+        Override close event to make a backup before closing the window.
+        The backup runs in a background thread while a progress dialog is shown, and the window closes when it
+        finishes or after BACKUP_TIMEOUT_MS, whatever comes first.
         """
-        make_backup()
-        event.accept()
+        if self.ready_to_close:
+            event.accept()
+            return
+        event.ignore()
+        if self.closing:
+            return  # Already waiting for the backup
+        self.closing = True
+
+        stock_alerts.remove_listener(self.low_stock_alert.emit)
+        wait_for_loaders()  # Let the pages finish their loads before the app exits
+        if profiler.is_enabled():
+            profiler.print_report()
+
+        self.backup_dialog = QProgressDialog("Guardando backup...", "", 0, 0, self)
+        self.backup_dialog.setCancelButton(None)  # Closing waits for the backup, at most BACKUP_TIMEOUT_MS
+        self.backup_dialog.setWindowTitle("Backup")
+        self.backup_dialog.setWindowModality(Qt.WindowModality.WindowModal)
+        self.backup_dialog.setMinimumDuration(500)  # Not shown at all for quick backups
+        self.backup_dialog.setAutoClose(False)
+        start_backup(progress=self.backup_progress.emit, finished=self.backup_finished.emit)
+        QTimer.singleShot(BACKUP_TIMEOUT_MS, self.on_backup_timeout)
+
+    def on_backup_progress(self, copied, total):
+        if self.backup_dialog is not None:
+            self.backup_dialog.setMaximum(total)
+            self.backup_dialog.setValue(copied)
+
+    def on_backup_finished(self, ok):
+        if not ok and not self.ready_to_close:
+            print("Backup failed, closing anyway.")
+            if self.backup_dialog is not None:
+                self.backup_dialog.close()
+            QMessageBox.warning(self, "Backup", "No se pudo guardar el backup de la base de datos.")
+        self.finish_close()
+
+    def on_backup_timeout(self):
+        if not self.ready_to_close:
+            print(f"Backup didn't finish in {BACKUP_TIMEOUT_MS / 1000:.0f} s, closing without it.")
+            self.finish_close()
+
+    def finish_close(self):
+        if self.ready_to_close:
+            return
+        self.ready_to_close = True
+        if self.backup_dialog is not None:
+            self.backup_dialog.close()
+        self.close()
 
     def on_page_changed(self, index):
         current_page = self.stack.widget(index)
-        # Intentar llamar a refresh si existe el método
+        # Intentar llamar a refresh si existe el método. Las páginas cargan sus datos en segundo plano
         if hasattr(current_page, "refresh"):
             current_page.refresh()
 
@@ -213,7 +302,7 @@ class MainWindow(QWidget):
 
         # After changing the db, refresh the pages
         self.home_page.refresh()
-        self.inventory_page.refresh()
+        self.inventory_page.refresh(force=True)  # The database may have been replaced by a backup
         self.sales_page.refresh()
         self.purchases_page.refresh()
         self.clients_page.refresh()
@@ -0,0 +1,169 @@
+import time
+import traceback
+from contextlib import contextmanager
+
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal, Qt
+
+from db import profiler
+
+_pool = None
+_paused = False  # True while loads_paused runs: new loads are refused
+
+
+def get_thread_pool():
+    """
+    Returns the thread pool used to load the pages' data.
+    Its threads never expire, so the database connection each one opens (see db.get_connection) is reused
+    instead of leaking a connection every time Qt replaces an idle thread.
+    """
+    global _pool
+    if _pool is None:
+        _pool = QThreadPool()
+        _pool.setMaxThreadCount(2)
+        _pool.setExpiryTimeout(-1)
+    return _pool
+
+
+def wait_for_loaders(timeout_ms=2000):
+    """Waits until the running loads finish, at most timeout_ms. Returns False if some are still running."""
+    if _pool is None:
+        return True
+    _pool.clear()  # Drop the loads that didn't start yet
+    return _pool.waitForDone(timeout_ms)
+
+
+@contextmanager
+def loads_paused(timeout_ms=5000):
+    """
+    Waits for the running loads and refuses new ones inside the block, so no worker thread uses its database
+    connection while the database file is replaced (see utils.backup.restore_file).
+    :raises RuntimeError: If the running loads don't finish in timeout_ms.
+    """
+    global _paused
+    _paused = True
+    try:
+        if not wait_for_loaders(timeout_ms):
+            raise RuntimeError("Todavía se están cargando datos, intentá de nuevo en unos segundos.")
+        yield
+    finally:
+        _paused = False
+
+
+class LoadSignals(QObject):
+    # request id, result, seconds spent in the queries
+    finished = Signal(int, object, float)
+    # request id, error message
+    failed = Signal(int, str)
+
+
+class LoadTask(QRunnable):
+    """
+    Runs a query function in a worker thread and emits its result.
+    Its statements are attributed to the action name in the query profiler.
+    """
+    def __init__(self, request_id, action, query, args, kwargs):
+        super().__init__()
+        self.request_id = request_id
+        self.action = action
+        self.query = query
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = LoadSignals()
+
+    def run(self):
+        start = time.perf_counter()
+        try:
+            with profiler.action(self.action) as run:
+                result = self.query(*self.args, **self.kwargs)
+        except Exception as e:
+            traceback.print_exc()
+            self.signals.failed.emit(self.request_id, str(e))
+            return
+        if run:
+            print(f"{self.action}: {run['statements']} statements, {run['seconds'] * 1000:.1f} ms in SQL, {run['rows']} rows")
+        self.signals.finished.emit(self.request_id, result, time.perf_counter() - start)
+
+
+class PageLoader(QObject):
+    """
+    Loads the data of a page in a worker thread and hands it to the page in the GUI thread.
+    The query function only reads from the database (through the services) and returns the data,
+    the apply function receives that data and updates the widgets.
+    Only the result of the last load is applied: if the page asks for new data before the previous load
+    finished, the old result is discarded when it arrives.
+    :param page: Widget of the page. Shows a busy cursor while loading.
+    :param name: Name used in the timing messages. By default, the class name of the page.
+    """
+    loading_changed = Signal(bool)
+    failed = Signal(str)
+
+    def __init__(self, page, name=None):
+        super().__init__(page)
+        self.page = page
+        self.name = name or type(page).__name__
+        self.request_id = 0
+        self.pending = {}  # request id -> (signals, apply function, start time)
+        self.last_timing = None
+
+    def is_loading(self):
+        return self.request_id in self.pending
+
+    def load(self, query, apply, *args, **kwargs):
+        """
+        Runs query(*args, **kwargs) in a worker thread and calls apply(result) with its result.
+        :return: The id of the request, or None if loads are paused (see loads_paused).
+        """
+        if _paused:
+            return None
+        self.request_id += 1
+        task = LoadTask(self.request_id, f"{self.name}.{getattr(query, '__name__', 'query')}", query, args, kwargs)
+        task.signals.finished.connect(self.on_finished, Qt.ConnectionType.QueuedConnection)
+        task.signals.failed.connect(self.on_failed, Qt.ConnectionType.QueuedConnection)
+        # Keep the signals alive until the result arrives, the task itself is deleted by the pool after running
+        self.pending[self.request_id] = (task.signals, apply, time.perf_counter())
+
+        self.set_loading(True)
+        get_thread_pool().start(task)
+        return self.request_id
+
+    def cancel(self):
+        """Discards the result of the load in progress, if any, when it arrives."""
+        if self.is_loading():
+            self.request_id += 1
+            self.set_loading(False)
+
+    def on_finished(self, request_id, result, query_time):
+        _, apply, start = self.pending.pop(request_id)
+        if request_id != self.request_id:
+            return  # Stale result of a load that was replaced or cancelled
+
+        render_start = time.perf_counter()
+        try:
+            apply(result)
+        finally:
+            self.set_loading(False)
+        end = time.perf_counter()
+
+        self.last_timing = {
+            "total": end - start,
+            "queries": query_time,
+            "render": end - render_start,
+        }
+        if profiler.is_enabled():
+            print(f"{self.name} refreshed in {self.last_timing['total'] * 1000:.1f} ms "
+                  f"(queries {query_time * 1000:.1f} ms, render {self.last_timing['render'] * 1000:.1f} ms)")
+
+    def on_failed(self, request_id, message):
+        self.pending.pop(request_id, None)
+        if request_id != self.request_id:
+            return
+        self.set_loading(False)
+        print(f"Error loading {self.name}: {message}")
+        self.failed.emit(message)
+
+    def set_loading(self, loading):
+        if loading:
+            self.page.setCursor(Qt.CursorShape.BusyCursor)
+        else:
+            self.page.unsetCursor()
+        self.loading_changed.emit(loading)
@@ -0,0 +1,127 @@
+from PySide6.QtWidgets import (
+    QDialog, QVBoxLayout, QHBoxLayout, QFormLayout, QLabel, QLineEdit, QComboBox, QDoubleSpinBox, QPushButton,
+    QTableView, QHeaderView, QMessageBox
+)
+from services.price_services import PriceService
+from services.product_services import ProductService
+from .table_models import Column, DictTableModel
+import models.units as Units
+
+
+def money(value):
+    return f"${value:,.2f}"
+
+
+class PriceUpdateDialog(QDialog):
+    """Changes the prices of many products at once, showing first which prices change and how."""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Actualizar precios")
+        self.resize(700, 500)
+        self.setup_ui()
+
+    def setup_ui(self):
+        layout = QVBoxLayout(self)
+
+        form = QFormLayout()
+        self.category_combo = QComboBox()
+        self.category_combo.addItem("Todas las categorías", None)
+        for category in ProductService.get_all_categories():
+            self.category_combo.addItem(category["name"], category["id"])
+        form.addRow("Categoría:", self.category_combo)
+
+        self.unit_combo = QComboBox()
+        self.unit_combo.addItem("Todas las unidades", None)
+        for unit in Units.get_all():
+            self.unit_combo.addItem(unit, unit)
+        form.addRow("Unidad:", self.unit_combo)
+
+        self.name_input = QLineEdit()
+        self.name_input.setPlaceholderText("Texto del nombre, * como comodín")
+        form.addRow("Nombre:", self.name_input)
+
+        self.mode_combo = QComboBox()
+        self.mode_combo.addItem("Porcentaje (%)", "percent")
+        self.mode_combo.addItem("Monto fijo ($)", "amount")
+        form.addRow("Cambio:", self.mode_combo)
+
+        self.value_input = QDoubleSpinBox()
+        self.value_input.setRange(-999999, 999999)
+        self.value_input.setDecimals(2)
+        form.addRow("Valor:", self.value_input)
+
+        self.round_combo = QComboBox()
+        for text, step in (("Centavos", None), ("$1", 1), ("$10", 10), ("$50", 50), ("$100", 100)):
+            self.round_combo.addItem(text, step)
+        form.addRow("Redondear a:", self.round_combo)
+        layout.addLayout(form)
+
+        preview_btn = QPushButton("Vista previa")
+        preview_btn.clicked.connect(self.show_preview)
+        layout.addWidget(preview_btn)
+
+        self.model = DictTableModel([
+            Column("Producto", "product_name"),
+            Column("Variante", "variant_name"),
+            Column("Precio actual", "old_price", display=money),
+            Column("Precio nuevo", "new_price", display=money),
+        ], self)
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.setEditTriggers(QTableView.EditTrigger.NoEditTriggers)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        layout.addWidget(self.table)
+
+        self.summary_label = QLabel("")
+        layout.addWidget(self.summary_label)
+
+        btn_layout = QHBoxLayout()
+        self.apply_btn = QPushButton("Aplicar")
+        self.apply_btn.setEnabled(False)
+        self.apply_btn.clicked.connect(self.apply_update)
+        cancel_btn = QPushButton("Cancelar")
+        cancel_btn.clicked.connect(self.reject)
+        btn_layout.addWidget(self.apply_btn)
+        btn_layout.addWidget(cancel_btn)
+        layout.addLayout(btn_layout)
+
+        # A preview only holds for the options it was made with
+        for combo in (self.category_combo, self.unit_combo, self.mode_combo, self.round_combo):
+            combo.currentIndexChanged.connect(self.clear_preview)
+        self.name_input.textChanged.connect(self.clear_preview)
+        self.value_input.valueChanged.connect(self.clear_preview)
+
+    def get_options(self):
+        return {
+            "mode": self.mode_combo.currentData(),
+            "value": self.value_input.value(),
+            "category_id": self.category_combo.currentData(),
+            "unit": self.unit_combo.currentData(),
+            "name": self.name_input.text().strip(),
+            "round_to": self.round_combo.currentData(),
+        }
+
+    def clear_preview(self):
+        self.model.set_rows([])
+        self.summary_label.setText("")
+        self.apply_btn.setEnabled(False)
+
+    def show_preview(self):
+        rows = PriceService.preview_update(**self.get_options())
+        self.model.set_rows(rows)
+        changed = sum(1 for row in rows if row["new_price"] != row["old_price"])
+        self.summary_label.setText(f"Precios a cambiar: {changed} de {len(rows)}")
+        self.apply_btn.setEnabled(changed > 0)
+
+    def apply_update(self):
+        reply = QMessageBox.question(self, "Confirmar", "¿Aplicar los nuevos precios?",
+                                     QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
+        if reply != QMessageBox.StandardButton.Yes:
+            return
+        try:
+            result = PriceService.update_prices(**self.get_options())
+        except Exception as e:
+            return QMessageBox.critical(self, "Error", f"No se pudieron actualizar los precios:\n{str(e)}")
+        QMessageBox.information(self, "Precios actualizados",
+                                f"Productos: {result['products']}\nVariantes: {result['variants']}")
+        self.accept()
@@ -1,20 +1,24 @@
-from functools import partial
-
 from PySide6.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QLabel, QDateEdit, QDoubleSpinBox,
-    QComboBox, QPushButton, QTableWidget, QTableWidgetItem, QHeaderView, QMessageBox, QDialog, QToolButton
+    QComboBox, QPushButton, QTableView, QHeaderView, QMessageBox, QDialog
 )
 from PySide6.QtCore import Qt, QDate
 
 from services.product_services import ProductService
 from services.transactions_services import TransactionsService
 from services.agenda_services import AgendaService
+from .page_loader import PageLoader
+from .table_models import Column, LazyTableModel, ButtonDelegate, ROW_ROLE
 from .purchase_dialog import PurchaseDialog
 
 
 class PurchasesPage(QWidget):
+    PAGE_SIZE = 100
+
     def __init__(self):
         super().__init__()
+        self.filters = {}
+        self.loader = PageLoader(self)
         self.setup_ui()
 
         # Load initial data
@@ -87,30 +91,52 @@ class PurchasesPage(QWidget):
         filter_layout.addWidget(self.delete_purchase_btn)
         main_layout.addLayout(filter_layout)
 
-        # --- Sales table ---
-        self.table = QTableWidget()
-        self.table.setColumnCount(5)  # ID (hidden), date, supplier, total, details button
-        self.table.setHorizontalHeaderLabels(["ID", "Fecha", "Proveedor", "Monto", "      "])
+        # --- Purchases table ---
+        # Rows are loaded page by page from the database when the view needs them
+        columns = [
+            Column("ID", "id"),
+            Column("Fecha", "date"),
+            Column("Proveedor", lambda purchase: purchase["supplier_name"] or "Sin proveedor"),
+            Column("Monto", "total"),
+            Column("      "),  # Details button
+        ]
+        self.model = LazyTableModel(columns, self.fetch_page, sort_keys={1: "date", 3: "total"}, page_size=self.PAGE_SIZE,
+                                    on_sort=self.load_filtered_purchases, parent=self)
+
+        self.table = QTableView()
+        self.table.setModel(self.model)
         self.table.setColumnHidden(0, True)
-        self.table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
-        self.table.setSelectionMode(QTableWidget.SelectionMode.MultiSelection)
+        self.table.setEditTriggers(QTableView.EditTrigger.NoEditTriggers)
+        self.table.setSelectionMode(QTableView.SelectionMode.MultiSelection)
+        self.table.setSelectionBehavior(QTableView.SelectionBehavior.SelectRows)
+        self.table.setMouseTracking(True)
+        self.table.selectionModel().selectionChanged.connect(self.update_delete_button_state)
+
+        # Sorting is done by the database: clicking a header loads the first page in the new order
+        self.table.horizontalHeader().setSortIndicator(1, Qt.SortOrder.DescendingOrder)
         self.table.setSortingEnabled(True)
-        self.table.setSelectionBehavior(QTableWidget.SelectionBehavior.SelectRows)
-        self.table.itemSelectionChanged.connect(self.update_delete_button_state)
+
+        # Details button painted by a delegate instead of a widget per row
+        self.details_delegate = ButtonDelegate("Detalles", self.table)
+        self.details_delegate.clicked.connect(lambda index: self.open_purchase_dialog(index.data(ROW_ROLE)))
+        self.table.setItemDelegateForColumn(4, self.details_delegate)
 
         # Resize cols
         header = self.table.horizontalHeader()
         # Stretch the columns 1 to 3
-        for i in range(1, self.table.columnCount() - 1):
+        for i in range(1, self.model.columnCount() - 1):
             header.setSectionResizeMode(i, QHeaderView.ResizeMode.Stretch)
 
         # Make the details column fit the content
-        header.setSectionResizeMode(self.table.columnCount() - 1, QHeaderView.ResizeMode.ResizeToContents)
+        header.setSectionResizeMode(self.model.columnCount() - 1, QHeaderView.ResizeMode.ResizeToContents)
 
         main_layout.addWidget(self.table)
 
     def reset_filters(self):
         suppliers = AgendaService.get_all_suppliers()
+        self.supplier_filter.blockSignals(True)
+        self.supplier_filter.clear()
+        self.supplier_filter.blockSignals(False)
         self.supplier_filter.addItem("Todos", None)
         for supplier in suppliers:
             self.supplier_filter.addItem(f"{supplier['name']} {supplier['surname']}", supplier["id"])
@@ -119,79 +145,59 @@ class PurchasesPage(QWidget):
         self.date_from.setDate(QDate.currentDate().addMonths(-1))  # Default to one month ago
 
     def update_delete_button_state(self):
-        selected_items = self.table.selectedItems()
-        self.delete_purchase_btn.setEnabled(bool(selected_items))
+        selected_rows = self.table.selectionModel().selectedRows()
+        self.delete_purchase_btn.setEnabled(bool(selected_rows))
 
     def delete_selected_sales(self):
-        selected_items = self.table.selectionModel().selectedRows()
-        for row in selected_items:
-            # Get the sale ID from the first column
-            x = self.table.item(row.row(), 0)
-            purchase_id = x.text() if x else None
+        selected_rows = self.table.selectionModel().selectedRows()
+        for index in selected_rows:
+            purchase_id = index.data(ROW_ROLE)["id"]
             TransactionsService.delete_purchase(int(purchase_id))
         self.load_filtered_purchases()
 
+    def get_filters(self):
+        return {
+            "start_date": self.date_from.date().toString("dd-MM-yyyy"),
+            "end_date": self.date_to.date().toString("dd-MM-yyyy"),
+            "min_total": self.min_amount.value(),
+            "max_total": self.max_amount.value(),
+            "supplier_id": self.supplier_filter.currentData(),
+        }
+
     def load_filtered_purchases(self):
-        def get_filtered_products():
-            date_from = self.date_from.date().toPython()
-            date_to = self.date_to.date().toPython()
-            min_amount = self.min_amount.value()
-            max_amount = self.max_amount.value()
-            client = self.supplier_filter.currentData()
-
-            purchases = TransactionsService.get_all_purchases()
-
-            # Filter purchases based on criteria
-            filtered_purchases = []
-            for purchase in purchases:
-                f = purchase["date"]
-                f_date = QDate.fromString(f, "dd-MM-yyyy").toPython()
-                if not (date_from <= f_date <= date_to):
-                    continue
-                if not (min_amount <= purchase["total"] <= max_amount):
-                    continue
-                if client != None and purchase["client_id"] != client:
-                    continue
-                filtered_purchases.append(purchase)
-            return sorted(filtered_purchases, key=lambda x: QDate.fromString(x["date"], "dd-MM-yyyy"), reverse=True)
-
-        filtered_purchase = get_filtered_products()
+        """
+        Loads the first page of purchases matching the filters in the background. The filters run in the database.
+        """
+        self.loader.load(self.load_data, self.show_data, self.get_filters(), self.model.sort_key, self.model.descending)
+
+    def load_data(self, filters, sort, descending):
+        """
+        Counts the purchases and loads the first page. Called from a worker thread, so it must not touch the widgets.
+        """
+        count, _ = TransactionsService.count_purchases(**filters)
+        purchases, next_cursor = self.query_page(filters, None, self.PAGE_SIZE, sort, descending)
+        return filters, count, purchases, next_cursor
+
+    def show_data(self, data):
+        self.filters, count, purchases, next_cursor = data
 
         # Update total purchases label
-        self.total_label.setText(f"Total compras: {len(filtered_purchase)}")
-
-        # Set up the table with filtered purchases
-        self.table.setRowCount(len(filtered_purchase))
-        for row, purchase in enumerate(filtered_purchase):
-            supplier = AgendaService.get_supplier_by_id(purchase["supplier_id"]) if purchase["supplier_id"] else None
-
-            self.table.setItem(row, 0, QTableWidgetItem(str(purchase['id'])))
-
-            # Date column
-            item_date = QTableWidgetItem(purchase["date"])
-            date_qdate = QDate.fromString(purchase["date"], "dd-MM-yyyy")
-            item_date.setData(Qt.ItemDataRole.UserRole, date_qdate)
-            self.table.setItem(row, 1, item_date)
-
-            if supplier:
-                self.table.setItem(row, 2, QTableWidgetItem(supplier["name"] + " " + supplier["surname"], supplier["id"]))
-            else:
-                self.table.setItem(row, 2, QTableWidgetItem("Sin proveedor"))
-
-            # Amount column
-            item_amount = QTableWidgetItem(str(purchase["total"]))
-            item_amount.setData(Qt.ItemDataRole.UserRole, purchase["total"])
-            self.table.setItem(row, 3, item_amount)
-
-            # Detail buttons
-            details_btn = QToolButton()
-            details_btn.setText("Detalles")
-            details_btn.setToolTip("Ver detalles de la compra")
-            details_btn.clicked.connect(partial(self.open_purchase_dialog, purchase))
-            details_btn.setStyleSheet("padding: 4px;")
-            self.table.setCellWidget(row, 4, details_btn)
+        self.total_label.setText(f"Total compras: {count}")
+
+        self.model.set_first_page(purchases, next_cursor)
         self.table.selectionModel().clearSelection()  # Clear selection after saving
 
+    def fetch_page(self, after, limit, sort, descending):
+        """
+        Loads the next page of purchases for the table model, with the filters of the rows already loaded.
+        """
+        return self.query_page(self.filters, after, limit, sort, descending)
+
+    @staticmethod
+    def query_page(filters, after, limit, sort, descending):
+        """Called from a worker thread. The supplier names come in the same query."""
+        return TransactionsService.query_purchases(**filters, sort=sort, descending=descending, after=after, limit=limit)
+
     def open_purchase_dialog(self, purchase=None):
         def unify_item():
             """
@@ -1,21 +1,36 @@
-from copy import deepcopy
-from functools import partial
-
 from PySide6.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QLabel, QDateEdit, QDoubleSpinBox,
-    QComboBox, QPushButton, QTableWidget, QTableWidgetItem, QHeaderView, QMessageBox, QDialog, QToolButton
+    QComboBox, QPushButton, QTableView, QHeaderView, QMessageBox, QDialog
 )
 from PySide6.QtCore import Qt, QDate
 
+from models.product_variant import InsufficientStockError
 from services.product_services import ProductService
 from services.transactions_services import TransactionsService
 from services.agenda_services import AgendaService
+from .page_loader import PageLoader
+from .table_models import Column, LazyTableModel, ButtonDelegate, ROW_ROLE
 from .sale_dialog import AddSaleDialog
 
 
+def shortages_message(shortages):
+    """Text with every line of a sale that doesn't have enough stock."""
+    lines = []
+    for shortage in shortages:
+        name = shortage["product_name"] or f"producto {shortage['product_id']}"
+        if shortage["variant_name"] or shortage["variant_id"]:
+            name += f" ({shortage['variant_name'] or 'variante ' + str(shortage['variant_id'])})"
+        lines.append(f"- {name}: stock actual {shortage['stock']}, cantidad requerida {shortage['quantity']}")
+    return "No hay suficiente stock para:\n" + "\n".join(lines)
+
+
 class SalesPage(QWidget):
+    PAGE_SIZE = 100
+
     def __init__(self):
         super().__init__()
+        self.filters = {}
+        self.loader = PageLoader(self)
         self.setup_ui()
 
         # Load initial data
@@ -89,29 +104,51 @@ class SalesPage(QWidget):
         main_layout.addLayout(filter_layout)
 
         # --- Sales table ---
-        self.table = QTableWidget()
-        self.table.setColumnCount(5)  # ID (hidden), date, client, total, details button
-        self.table.setHorizontalHeaderLabels(["ID", "Fecha", "Cliente", "Monto", "      "])
+        # Rows are loaded page by page from the database when the view needs them
+        columns = [
+            Column("ID", "id"),
+            Column("Fecha", "date"),
+            Column("Cliente", lambda sale: sale["client_name"] or "Sin cliente"),
+            Column("Monto", "total"),
+            Column("      "),  # Details button
+        ]
+        self.model = LazyTableModel(columns, self.fetch_page, sort_keys={1: "date", 3: "total"}, page_size=self.PAGE_SIZE,
+                                    on_sort=self.load_filtered_sales, parent=self)
+
+        self.table = QTableView()
+        self.table.setModel(self.model)
         self.table.setColumnHidden(0, True)
-        self.table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
-        self.table.setSelectionMode(QTableWidget.SelectionMode.MultiSelection)
+        self.table.setEditTriggers(QTableView.EditTrigger.NoEditTriggers)
+        self.table.setSelectionMode(QTableView.SelectionMode.MultiSelection)
+        self.table.setSelectionBehavior(QTableView.SelectionBehavior.SelectRows)
+        self.table.setMouseTracking(True)
+        self.table.selectionModel().selectionChanged.connect(self.update_delete_button_state)
+
+        # Sorting is done by the database: clicking a header loads the first page in the new order
+        self.table.horizontalHeader().setSortIndicator(1, Qt.SortOrder.DescendingOrder)
         self.table.setSortingEnabled(True)
-        self.table.setSelectionBehavior(QTableWidget.SelectionBehavior.SelectRows)
-        self.table.itemSelectionChanged.connect(self.update_delete_button_state)
+
+        # Details button painted by a delegate instead of a widget per row
+        self.details_delegate = ButtonDelegate("Detalles", self.table)
+        self.details_delegate.clicked.connect(lambda index: self.open_add_sale_dialog(index.data(ROW_ROLE)))
+        self.table.setItemDelegateForColumn(4, self.details_delegate)
 
         # Resize cols
         header = self.table.horizontalHeader()
         # Stretch the columns 1 to 3
-        for i in range(1, self.table.columnCount() - 1):
+        for i in range(1, self.model.columnCount() - 1):
             header.setSectionResizeMode(i, QHeaderView.ResizeMode.Stretch)
 
         # Make the details column fit the content
-        header.setSectionResizeMode(self.table.columnCount() - 1, QHeaderView.ResizeMode.ResizeToContents)
+        header.setSectionResizeMode(self.model.columnCount() - 1, QHeaderView.ResizeMode.ResizeToContents)
 
         main_layout.addWidget(self.table)
 
     def reset_filters(self):
         clients = AgendaService.get_all_clients()
+        self.client_filter.blockSignals(True)
+        self.client_filter.clear()
+        self.client_filter.blockSignals(False)
         self.client_filter.addItem("Todos", None)
         for client in clients:
             self.client_filter.addItem(f"{client['name']} {client['surname']}", client["id"])
@@ -120,78 +157,59 @@ class SalesPage(QWidget):
         self.date_from.setDate(QDate.currentDate().addMonths(-1))  # Default to one month ago
 
     def update_delete_button_state(self):
-        selected_items = self.table.selectedItems()
-        self.delete_sale_btn.setEnabled(bool(selected_items))
+        selected_rows = self.table.selectionModel().selectedRows()
+        self.delete_sale_btn.setEnabled(bool(selected_rows))
 
     def delete_selected_sales(self):
-        selected_items = self.table.selectionModel().selectedRows()
-        for row in selected_items:
-            # Get the sale ID from the first column
-            x = self.table.item(row.row(), 0)
-            sale_id = x.text() if x else None
+        selected_rows = self.table.selectionModel().selectedRows()
+        for index in selected_rows:
+            sale_id = index.data(ROW_ROLE)["id"]
             TransactionsService.delete_sale(int(sale_id))
         self.load_filtered_sales()
 
+    def get_filters(self):
+        return {
+            "start_date": self.date_from.date().toString("dd-MM-yyyy"),
+            "end_date": self.date_to.date().toString("dd-MM-yyyy"),
+            "min_total": self.min_amount.value(),
+            "max_total": self.max_amount.value(),
+            "client_id": self.client_filter.currentData(),
+        }
+
     def load_filtered_sales(self):
-        def get_filtered_products():
-            date_from = self.date_from.date().toPython()
-            date_to = self.date_to.date().toPython()
-            min_amount = self.min_amount.value()
-            max_amount = self.max_amount.value()
-            client = self.client_filter.currentData()
-
-            sales = TransactionsService.get_all_sales()
-
-            # Filter sales based on criteria
-            filtered_sales = []
-            for s in sales:
-                f = s["date"]
-                f_date = QDate.fromString(f, "dd-MM-yyyy").toPython()
-                if not (date_from <= f_date <= date_to):
-                    continue
-                if not (min_amount <= s["total"] <= max_amount):
-                    continue
-                if client != None and s["client_id"] != client:
-                    continue
-                filtered_sales.append(s)
-            return filtered_sales
-
-        filtered_sales = get_filtered_products()
+        """
+        Loads the first page of sales matching the filters in the background. The filters run in the database.
+        """
+        self.loader.load(self.load_data, self.show_data, self.get_filters(), self.model.sort_key, self.model.descending)
+
+    def load_data(self, filters, sort, descending):
+        """
+        Counts the sales and loads the first page. Called from a worker thread, so it must not touch the widgets.
+        """
+        count, _ = TransactionsService.count_sales(**filters)
+        sales, next_cursor = self.query_page(filters, None, self.PAGE_SIZE, sort, descending)
+        return filters, count, sales, next_cursor
+
+    def show_data(self, data):
+        self.filters, count, sales, next_cursor = data
 
         # Update total sales label
-        self.total_label.setText(f"Total ventas: {len(filtered_sales)}")
-
-        # Set up the table with filtered sales
-        self.table.setRowCount(len(filtered_sales))
-        for row, sale in enumerate(filtered_sales):
-            client = AgendaService.get_client_by_id(sale["client_id"]) if sale["client_id"] else None
-
-            self.table.setItem(row, 0, QTableWidgetItem(str(sale['id'])))
-
-            # Date column
-            item_fecha = QTableWidgetItem(sale["date"])
-            fecha_qdate = QDate.fromString(sale["date"], "dd-MM-yyyy")
-            item_fecha.setData(Qt.ItemDataRole.UserRole, fecha_qdate)
-            self.table.setItem(row, 1, item_fecha)
-
-            if client:
-                self.table.setItem(row, 2, QTableWidgetItem(client["name"] + " " + client["surname"], client["id"]))
-            else:
-                self.table.setItem(row, 2, QTableWidgetItem("Sin cliente"))
-
-            # Amount column
-            item_amount = QTableWidgetItem(str(sale["total"]))
-            self.table.setItem(row, 3, item_amount)
-
-            # Detail buttons
-            details_btn = QToolButton()
-            details_btn.setText("Detalles")
-            details_btn.setToolTip("Ver detalles de la venta")
-            details_btn.clicked.connect(partial(self.open_add_sale_dialog, sale))
-            details_btn.setStyleSheet("padding: 4px;")
-            self.table.setCellWidget(row, 4, details_btn)
+        self.total_label.setText(f"Total ventas: {count}")
+
+        self.model.set_first_page(sales, next_cursor)
         self.table.selectionModel().clearSelection()  # Clear selection after saving
 
+    def fetch_page(self, after, limit, sort, descending):
+        """
+        Loads the next page of sales for the table model, with the filters of the rows already loaded.
+        """
+        return self.query_page(self.filters, after, limit, sort, descending)
+
+    @staticmethod
+    def query_page(filters, after, limit, sort, descending):
+        """Called from a worker thread. The client names come in the same query."""
+        return TransactionsService.query_sales(**filters, sort=sort, descending=descending, after=after, limit=limit)
+
     def open_add_sale_dialog(self, sale=None):
         def unify_item():
             """
@@ -223,31 +241,14 @@ class SalesPage(QWidget):
                 return QMessageBox.warning(self, "Error", "Debe agregar al menos un producto a la venta.")
 
             items = unify_item()
-            # Check the stock is available
-            available, details = self.check_stock(items=deepcopy(items), sale=sale)
-
-            if not available:
-                product_id, variant_id, quantity, stock = details
-                msg = f"No hay suficiente stock para el producto {product_id} {'con variante ' + str(variant_id) if variant_id else ''}. Stock actual: {stock}, cantidad requerida: {quantity}."
-                return QMessageBox.warning(self, "Error de stock", msg)
-            print("Items antes del save es ", items)
-            TransactionsService.save_sale(sale_id=sale_id, date=date, client_id=client_id, items=items)
+            # The stock is checked and taken in the same transaction that saves the sale, so nothing is saved
+            # if any line is short, even if another sale took the stock after the dialog was filled in
+            try:
+                TransactionsService.save_sale(sale_id=sale_id, date=date, client_id=client_id, items=items)
+            except InsufficientStockError as e:
+                return QMessageBox.warning(self, "Error de stock", shortages_message(e.shortages))
             self.load_filtered_sales()
 
-    def check_stock(self, items, sale):
-        """
-        Makes the difference to see how many more products were added
-        """
-
-        if sale:
-            already = sale['items']
-            for key, value in already.items():
-                if key in items:
-                    if items[key]['quantity'] != value['quantity']:
-                        items[key]['quantity'] -= value['quantity'] # Shouldn't be checked for stock because it was already # checked when the sale was created
-                        print("Chequear solo por ", items[key]['quantity'], " de ", key)
-        return ProductService.check_stock(items=items)
-
     def refresh(self):
         """
         Refresh the sales page.
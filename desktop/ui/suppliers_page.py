@@ -1,16 +1,23 @@
 from PySide6.QtWidgets import (
-    QWidget, QVBoxLayout, QLabel, QLineEdit, QTableWidget, QTableWidgetItem,
-    QHBoxLayout, QCheckBox, QPushButton, QDialog, QHeaderView, QMessageBox, QToolButton
+    QWidget, QVBoxLayout, QLabel, QLineEdit, QTableView,
+    QHBoxLayout, QCheckBox, QPushButton, QDialog, QHeaderView, QMessageBox
 )
 from services.agenda_services import AgendaService
 from PySide6.QtCore import Qt
 
 from .supplier_dialog import SupplierDialog
+from .page_loader import PageLoader
+from .table_models import Column, DictTableModel, TableFilterProxy, ButtonDelegate, ROW_ROLE
 
 
 class SuppliersPage(QWidget):
+    SEARCH_LIMIT = 500
     def __init__(self):
         super().__init__()
+        self.loader = PageLoader(self)
+        self.search_loader = PageLoader(self)  # Own loader, so a search doesn't drop a load of the list
+        self.matches = None  # IDs found by the search, None when there is no search text
+        self.matches_truncated = False  # True if the search found more than SEARCH_LIMIT matches
         self.setup_ui()
 
         self.reset_filters()
@@ -28,14 +35,14 @@ class SuppliersPage(QWidget):
         filter_layout = QHBoxLayout()
 
         self.search_input = QLineEdit()
-        self.search_input.setPlaceholderText("Buscar por nombre o apellido...")
-        self.search_input.textChanged.connect(self.load_suppliers)
+        self.search_input.setPlaceholderText("Buscar por nombre, apellido, celular o mail...")
+        self.search_input.textChanged.connect(self.search)
 
         self.email_checkbox = QCheckBox("Con email")
-        self.email_checkbox.stateChanged.connect(self.load_suppliers)
+        self.email_checkbox.stateChanged.connect(self.apply_filters)
 
         self.phone_checkbox = QCheckBox("Con celular")
-        self.phone_checkbox.stateChanged.connect(self.load_suppliers)
+        self.phone_checkbox.stateChanged.connect(self.apply_filters)
 
         # Button for new supplier
         btn_new_supplier = QPushButton("Nuevo")
@@ -54,24 +61,42 @@ class SuppliersPage(QWidget):
         layout.addLayout(filter_layout)
 
         # Supplier's table
-        self.supplier_table = QTableWidget()
-        self.supplier_table.setColumnCount(6)
-        self.supplier_table.setHorizontalHeaderLabels(["Id", "Nombre", "Apellido", "Email", "Celular", "       "])
+        columns = [
+            Column("Id", "id"),
+            Column("Nombre", "name"),
+            Column("Apellido", "surname"),
+            Column("Email", "mail"),
+            Column("Celular", "phone"),
+            Column("       "),  # Edit button
+        ]
+        self.model = DictTableModel(columns, self)
+        self.proxy = TableFilterProxy(self)
+        self.proxy.setSourceModel(self.model)
+
+        self.supplier_table = QTableView()
+        self.supplier_table.setModel(self.proxy)
         self.supplier_table.setColumnHidden(0, True)
-        self.supplier_table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
-        self.supplier_table.setSelectionBehavior(QTableWidget.SelectionBehavior.SelectRows)
-        self.supplier_table.setSelectionMode(QTableWidget.SelectionMode.MultiSelection)
+        self.supplier_table.setEditTriggers(QTableView.EditTrigger.NoEditTriggers)
+        self.supplier_table.setSelectionBehavior(QTableView.SelectionBehavior.SelectRows)
+        self.supplier_table.setSelectionMode(QTableView.SelectionMode.MultiSelection)
+        self.supplier_table.setMouseTracking(True)
         self.supplier_table.setSortingEnabled(True)
-        self.supplier_table.itemSelectionChanged.connect(self.update_delete_button_state)
+        self.supplier_table.sortByColumn(1, Qt.SortOrder.AscendingOrder)  # Sort by name by default
+        self.supplier_table.selectionModel().selectionChanged.connect(self.update_delete_button_state)
+
+        # Edit button painted by a delegate instead of a widget per row
+        self.edit_delegate = ButtonDelegate("Editar", self.supplier_table)
+        self.edit_delegate.clicked.connect(lambda index: self.open_supplier(index.data(ROW_ROLE)))
+        self.supplier_table.setItemDelegateForColumn(5, self.edit_delegate)
 
         # Resize cols
         header = self.supplier_table.horizontalHeader()
         # Stretch all columns except the last one
-        for i in range(self.supplier_table.columnCount() - 1):
+        for i in range(self.model.columnCount() - 1):
             header.setSectionResizeMode(i, QHeaderView.ResizeMode.Stretch)
 
         # The last column (Edit button) will resize to contents
-        header.setSectionResizeMode(self.supplier_table.columnCount() - 1, QHeaderView.ResizeMode.ResizeToContents)
+        header.setSectionResizeMode(self.model.columnCount() - 1, QHeaderView.ResizeMode.ResizeToContents)
 
         layout.addWidget(self.supplier_table)
 
@@ -96,49 +121,54 @@ class SuppliersPage(QWidget):
 
         if confirm == QMessageBox.StandardButton.Yes:
             for supplier in selected_rows:
-                supplier_id = self.supplier_table.item(supplier.row(), 0).text()
+                supplier_id = supplier.data(ROW_ROLE)["id"]
                 AgendaService.delete_supplier(int(supplier_id))
             self.load_suppliers()
 
     def load_suppliers(self):
-        def get_filtered_suppliers():
-            text = self.search_input.text().lower()
-            only_with_email = self.email_checkbox.isChecked()
-            only_with_phone = self.phone_checkbox.isChecked()
-
-            filtered = []
-            for supplier in AgendaService.get_all_suppliers():
-                full_name = f"{supplier['name']} {supplier['surname']}".lower()
-                if text and text not in full_name:
-                    continue
-                if only_with_email and not supplier.get("mail"):
-                    continue
-                if only_with_phone and not supplier.get("phone"):
-                    continue
-                filtered.append(supplier)
-
-            return sorted(filtered, key=lambda c: (c['name'].lower(), c['surname'].lower()))
-
-        filtered = get_filtered_suppliers()
-
-        self.total_label.setText(f"Total de proveedores: {len(filtered)}")
-
-        self.supplier_table.setRowCount(len(filtered))
-        for row, client in enumerate(filtered):
-            self.supplier_table.setItem(row, 0, QTableWidgetItem(client['id']))
-            self.supplier_table.setItem(row, 1, QTableWidgetItem(client['name']))
-            self.supplier_table.setItem(row, 2, QTableWidgetItem(client['surname']))
-            self.supplier_table.setItem(row, 3, QTableWidgetItem(client.get('mail') or ""))
-            self.supplier_table.setItem(row, 4, QTableWidgetItem(client.get('phone') or ""))
-
-            # Button edit
-            btn_edit = QToolButton()
-            btn_edit.setText("Editar")
-            btn_edit.setToolTip("Editar proveedor")
-            btn_edit.clicked.connect(lambda checked, c=client: self.open_supplier(c))
-            self.supplier_table.setCellWidget(row, 5, btn_edit)
-
-        self.supplier_table.sortByColumn(1, Qt.SortOrder.AscendingOrder)  # Sort by name by default
+        """Loads the suppliers from the database in the background, then shows them with the filters applied."""
+        self.loader.load(AgendaService.get_all_suppliers, self.show_suppliers)
+
+    def show_suppliers(self, suppliers):
+        self.model.set_rows(suppliers)
+        self.search()
+
+    def search(self):
+        """Looks up the search text in the full-text index in the background, then filters the list with the results."""
+        text = self.search_input.text().strip()
+        if not text:
+            self.search_loader.cancel()  # A search still running would filter the list by the old text
+            self.matches = None
+            self.matches_truncated = False
+            self.apply_filters()
+            return
+        self.search_loader.load(AgendaService.search_suppliers, self.show_matches, text, limit=self.SEARCH_LIMIT + 1)
+
+    def show_matches(self, suppliers):
+        # One more than the limit is asked for, to know if there were more matches than the ones shown
+        self.matches_truncated = len(suppliers) > self.SEARCH_LIMIT
+        self.matches = {supplier["id"] for supplier in suppliers[:self.SEARCH_LIMIT]}
+        self.apply_filters()
+
+    def apply_filters(self):
+        """Filters the loaded suppliers in the proxy model, without going to the database."""
+        only_with_email = self.email_checkbox.isChecked()
+        only_with_phone = self.phone_checkbox.isChecked()
+
+        def accepts(supplier):
+            if self.matches is not None and supplier["id"] not in self.matches:
+                return False
+            if only_with_email and not supplier.get("mail"):
+                return False
+            if only_with_phone and not supplier.get("phone"):
+                return False
+            return True
+
+        self.proxy.set_predicate(accepts)
+        text = f"Total de proveedores: {self.proxy.rowCount()}"
+        if self.matches_truncated:
+            text += f" (solo los primeros {self.SEARCH_LIMIT} resultados de la búsqueda, refiná el texto para ver el resto)"
+        self.total_label.setText(text)
 
     def open_supplier(self, supplier=None):
         dialog = SupplierDialog(self, supplier)
@@ -0,0 +1,201 @@
+from PySide6.QtCore import Qt, QAbstractTableModel, QModelIndex, QSortFilterProxyModel, Signal, QEvent, QSize
+from PySide6.QtGui import QBrush
+from PySide6.QtWidgets import QStyledItemDelegate, QStyleOptionButton, QStyle, QApplication
+
+# Roles used by the models on top of the Qt ones
+ROW_ROLE = Qt.ItemDataRole.UserRole + 1  # The whole row (dictionary)
+SORT_ROLE = Qt.ItemDataRole.UserRole + 2  # Raw value used to sort and compare
+
+
+class Column:
+    """
+    Column of a table model.
+    :param title: Header text.
+    :param value: Key of the row dictionary or function that receives the row and returns the value.
+    :param display: Function that turns the value into the text shown. By default str(value).
+    :param foreground: Function that receives the row and returns a color for the text, or None.
+    """
+    def __init__(self, title, value=None, display=None, foreground=None):
+        self.title = title
+        self.value = value
+        self.display = display
+        self.foreground = foreground
+
+    def get(self, row):
+        if self.value is None:
+            return None
+        if callable(self.value):
+            return self.value(row)
+        return row.get(self.value)
+
+    def text(self, row):
+        value = self.get(row)
+        if self.display:
+            return self.display(value)
+        return "" if value is None else str(value)
+
+
+class DictTableModel(QAbstractTableModel):
+    """
+    Read-only model over a list of dictionaries. Cells are computed when the view paints them,
+    so no Qt object is created per cell or per row.
+    """
+    def __init__(self, columns, parent=None):
+        super().__init__(parent)
+        self.columns = columns
+        self.rows = []
+
+    def set_rows(self, rows):
+        self.beginResetModel()
+        self.rows = list(rows)
+        self.endResetModel()
+
+    def row(self, index):
+        """Returns the dictionary of the row of an index of this model."""
+        return self.rows[index.row()]
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return self.columns[section].title
+        return None
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self.rows[index.row()]
+        column = self.columns[index.column()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return column.text(row)
+        if role == SORT_ROLE:
+            value = column.get(row)
+            return value.lower() if isinstance(value, str) else value
+        if role == ROW_ROLE:
+            return row
+        if role == Qt.ItemDataRole.ForegroundRole and column.foreground:
+            color = column.foreground(row)
+            return QBrush(color) if color is not None else None
+        return None
+
+
+class LazyTableModel(DictTableModel):
+    """
+    Model that loads its rows page by page from the database.
+    The view asks for more rows (canFetchMore/fetchMore) only when the user scrolls to the end,
+    and sorting is done by the query, not by the view.
+    :param fetch_page: Function (after, limit, sort, descending) -> (rows, cursor of the next page or None).
+    :param sort_keys: Dictionary with column index as key and the sort key of the query as value.
+    :param on_sort: Function called when the sort order changes, to reload the rows (e.g. in the background).
+    By default, the first page is reloaded right away.
+    """
+    def __init__(self, columns, fetch_page, sort_keys=None, page_size=100, on_sort=None, parent=None):
+        super().__init__(columns, parent)
+        self.fetch_page = fetch_page
+        self.sort_keys = sort_keys or {}
+        self.page_size = page_size
+        self.on_sort = on_sort
+        self.sort_key = next(iter(self.sort_keys.values()), None)
+        self.descending = True
+        self.next_cursor = None
+        self.has_more = False
+        self.loaded = False
+
+    def reload(self):
+        """Drops the loaded rows and loads the first page again."""
+        rows, next_cursor = self.fetch_page(None, self.page_size, self.sort_key, self.descending)
+        self.set_first_page(rows, next_cursor)
+
+    def set_first_page(self, rows, next_cursor):
+        """Replaces the rows with a first page loaded elsewhere, e.g. in a worker thread."""
+        self.loaded = True
+        self.beginResetModel()
+        self.rows = list(rows)
+        self.next_cursor = next_cursor
+        self.has_more = next_cursor is not None
+        self.endResetModel()
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.has_more
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or not self.has_more:
+            return
+        rows, self.next_cursor = self.fetch_page(self.next_cursor, self.page_size, self.sort_key, self.descending)
+        self.has_more = self.next_cursor is not None
+        if rows:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(rows) - 1)
+            self.rows.extend(rows)
+            self.endInsertRows()
+
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        if column not in self.sort_keys:
+            return
+        self.sort_key = self.sort_keys[column]
+        self.descending = order == Qt.SortOrder.DescendingOrder
+        if not self.loaded:  # Before the first load only the order is stored
+            return
+        if self.on_sort:
+            self.on_sort()
+        else:
+            self.reload()
+
+
+class TableFilterProxy(QSortFilterProxyModel):
+    """
+    Sorts by the raw values of the source model and filters rows with a function that receives the row dictionary.
+    """
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.predicate = None
+        self.setSortRole(SORT_ROLE)
+        self.setSortCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
+
+    def set_predicate(self, predicate):
+        """Sets the function used to filter the rows. None shows every row."""
+        self.predicate = predicate
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        if self.predicate is None:
+            return True
+        return self.predicate(self.sourceModel().rows[source_row])
+
+
+class ButtonDelegate(QStyledItemDelegate):
+    """
+    Paints a button in the cells of a column instead of creating a real widget per row.
+    Emits clicked with the index when the button is pressed.
+    """
+    clicked = Signal(QModelIndex)
+
+    def __init__(self, text, parent=None):
+        super().__init__(parent)
+        self.text = text
+
+    def paint(self, painter, option, index):
+        button = QStyleOptionButton()
+        button.rect = option.rect.adjusted(2, 2, -2, -2)
+        button.text = self.text
+        button.state = QStyle.StateFlag.State_Enabled
+        if option.state & QStyle.StateFlag.State_MouseOver:
+            button.state |= QStyle.StateFlag.State_MouseOver
+        style = option.widget.style() if option.widget else QApplication.style()
+        style.drawControl(QStyle.ControlElement.CE_PushButton, button, painter, option.widget)
+
+    def sizeHint(self, option, index):
+        width = option.fontMetrics.horizontalAdvance(self.text) + 24
+        return QSize(width, option.fontMetrics.height() + 10)
+
+    def editorEvent(self, event, model, option, index):
+        # Consume the press so clicking the button doesn't change the selection
+        if event.type() == QEvent.Type.MouseButtonPress and option.rect.contains(event.position().toPoint()):
+            return True
+        if event.type() == QEvent.Type.MouseButtonRelease and option.rect.contains(event.position().toPoint()):
+            self.clicked.emit(index)
+            return True
+        return super().editorEvent(event, model, option, index)
@@ -11,7 +11,7 @@ a = Analysis(
         ('db/schema.sql', 'db'),
         ('assets/logo.png', 'assets'),
     ],
-    hiddenimports=[],
+    hiddenimports=['openpyxl'],  # Imported only when an XLSX catalog is imported
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -0,0 +1,129 @@
+from models.category import Category
+
+
+class CatalogWriter:
+    """
+    Writes batches of imported catalog rows, matching products by name and variants by product and variant name
+    (both without distinguishing upper and lower case).
+    The names and IDs already in the database are read once, so each batch only writes.
+    Products with variants follow the convention of the inventory page: price and stock_low are -1 and the stock
+    is the sum of the stock of the variants.
+    :param conn: Connection with the transaction of the import.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, name FROM category")
+        self.categories = {name.lower(): id for id, name in cursor.fetchall()}
+        cursor.execute("SELECT id, name FROM product")
+        self.products = {name.lower(): id for id, name in cursor.fetchall()}
+        cursor.execute("SELECT id, product_id, variant_name FROM product_variant")
+        self.variants = {(product_id, name.lower()): id for id, product_id, name in cursor.fetchall()}
+        self.with_variants = {product_id for product_id, _ in self.variants}
+
+        self.stats = {"created_products": 0, "updated_products": 0, "created_variants": 0, "updated_variants": 0,
+                      "created_categories": []}
+
+    def category_id(self, name):
+        """Returns the ID of a category, creating it if it doesn't exist."""
+        key = name.lower()
+        if key not in self.categories:
+            Category.add_category(name)  # Same thread, so it uses the connection of the import
+            self.categories[key] = Category.get_id_by_name(name)
+            self.stats["created_categories"].append(name)
+        return self.categories[key]
+
+    def write(self, rows):
+        """
+        Inserts or updates a batch of rows with one executemany per kind of change.
+        :param rows: List of dictionaries with name, variant_name, category, unit, price, stock and stock_low.
+        Empty values (None) keep the current value of an existing product/variant. Deleted products are reactivated.
+        The batch must have at most 500 rows, to stay below the SQLite limit of parameters per query.
+        :return: List of (index of the row in the batch, error message) of the rows that were not written.
+        """
+        errors = []
+        cursor = self.conn.cursor()
+
+        # New products, once per name. Variant products are created with the -1 markers and stock 0
+        new_products = {}
+        created_by = set()  # Index of the row that creates each new product
+        for index, row in enumerate(rows):
+            key = row["name"].lower()
+            if key not in self.products and key not in new_products:
+                created_by.add(index)
+                has_variant = row["variant_name"] is not None
+                new_products[key] = (
+                    row["name"], self.category_id(row["category"]), row["unit"] or "unidad",
+                    -1 if has_variant else (row["price"] or 0),
+                    0 if has_variant else (row["stock"] or 0),
+                    -1 if has_variant else (row["stock_low"] or 0),
+                )
+        cursor.executemany("INSERT INTO product (name, category_id, unit, price, stock, stock_low) VALUES (?, ?, ?, ?, ?, ?)",
+                           list(new_products.values()))
+        if new_products:
+            names = [values[0] for values in new_products.values()]
+            cursor.execute(f"SELECT id, name FROM product WHERE name IN ({', '.join('?' * len(names))})", names)
+            for id, name in cursor.fetchall():
+                self.products[name.lower()] = id
+        self.stats["created_products"] += len(new_products)
+
+        product_updates = []
+        variant_updates = []
+        new_variants = []
+        repeated_variants = []  # Variants created by an earlier row of this batch, updated once they have an ID
+        touched = set()  # Products with variants whose stock has to be added up again
+        for index, row in enumerate(rows):
+            key = row["name"].lower()
+            product_id = self.products[key]
+            category_id = self.category_id(row["category"]) if row["category"] else None
+
+            if row["variant_name"] is None:
+                if product_id in self.with_variants:
+                    errors.append((index, "El producto tiene variantes, indique la variante"))
+                elif index not in created_by:  # The creating row already has these values
+                    product_updates.append((category_id, row["unit"], row["price"], row["stock"], row["stock_low"], product_id))
+                continue
+
+            # Variant row: the product keeps the variant markers
+            if index not in created_by:
+                product_updates.append((category_id, row["unit"], -1, None, -1, product_id))
+            variant_key = (product_id, row["variant_name"].lower())
+            if variant_key not in self.variants:
+                self.variants[variant_key] = None
+                new_variants.append((product_id, row["variant_name"], row["stock"] or 0, row["stock_low"] or 0, row["price"] or 0))
+            elif self.variants[variant_key] is None:
+                repeated_variants.append((row["stock"], row["stock_low"], row["price"], variant_key))
+            else:
+                variant_updates.append((row["stock"], row["stock_low"], row["price"], self.variants[variant_key]))
+            self.with_variants.add(product_id)
+            touched.add(product_id)
+
+        cursor.executemany("""
+            UPDATE product SET category_id = COALESCE(?, category_id), unit = COALESCE(?, unit),
+                price = COALESCE(?, price), stock = COALESCE(?, stock), stock_low = COALESCE(?, stock_low), active = 1
+            WHERE id = ?
+        """, product_updates)
+        self.stats["updated_products"] += len({values[-1] for values in product_updates})
+
+        cursor.executemany("INSERT INTO product_variant (product_id, variant_name, stock, stock_low, price) VALUES (?, ?, ?, ?, ?)",
+                           new_variants)
+        self.stats["created_variants"] += len(new_variants)
+        if new_variants:
+            product_ids = list({values[0] for values in new_variants})
+            cursor.execute(f"SELECT id, product_id, variant_name FROM product_variant WHERE product_id IN ({', '.join('?' * len(product_ids))})",
+                           product_ids)
+            for id, product_id, name in cursor.fetchall():
+                self.variants[(product_id, name.lower())] = id
+
+        variant_updates += [(stock, stock_low, price, self.variants[variant_key])
+                            for stock, stock_low, price, variant_key in repeated_variants]
+        cursor.executemany("""
+            UPDATE product_variant SET stock = COALESCE(?, stock), stock_low = COALESCE(?, stock_low), price = COALESCE(?, price)
+            WHERE id = ?
+        """, variant_updates)
+        self.stats["updated_variants"] += len(variant_updates)
+
+        # Stock of the products with variants, as the sum of its variants
+        cursor.executemany("UPDATE product SET stock = (SELECT COALESCE(SUM(stock), 0) FROM product_variant WHERE product_id = ?) WHERE id = ?",
+                           [(product_id, product_id) for product_id in touched])
+        return errors
@@ -31,7 +31,6 @@ class Category:
             cursor.execute("DELETE FROM category WHERE id = ?", (id,))
             if cursor.rowcount == 0:
                 raise ValueError(f"No se encontró la categoría con id: {id}")
-            conn.commit()
 
     @staticmethod
     def rename_category(id, new_name):
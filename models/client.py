@@ -1,4 +1,5 @@
 from db.db import get_connection
+from models.search import match_query
 
 class Client:
     def __init__(self, name, surname="", phone="", mail="", id=None):
@@ -45,6 +46,8 @@ class Client:
     def delete(client_id):
         """Deletes a client from the database by ID."""
         with get_connection() as conn:
+            # Keep the client's sales, detached from the deleted client
+            conn.execute("UPDATE sale SET client_id=NULL WHERE client_id=?", (client_id,))
             conn.execute("DELETE FROM client WHERE id=?", (client_id,))
 
     @staticmethod
@@ -57,3 +60,26 @@ class Client:
             if fila:
                 return {"name": fila[1], "surname": fila[2], "phone": fila[3], "mail": fila[4], "id": fila[0]}
             return None
+
+    @staticmethod
+    def search(text, limit=50):
+        """
+        Full-text search of clients by name, surname, phone and mail, ignoring accents. Every word of the text
+        must start a word of the client. The best matches come first.
+        :param text: Text typed by the user.
+        :param limit: Maximum number of clients to return.
+        :return: List of dictionaries like get_all.
+        """
+        query = match_query(text)
+        if query is None:
+            return []
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT client.id, client.name, client.surname, client.phone, client.mail
+                FROM client_fts JOIN client ON client.id = client_fts.rowid
+                WHERE client_fts MATCH ?
+                ORDER BY bm25(client_fts, 10.0, 8.0, 2.0, 2.0)
+                LIMIT ?
+            """, (query, limit))
+            return [{"name": fila[1], "surname": fila[2], "phone": fila[3], "mail": fila[4], "id": fila[0]} for fila in cur.fetchall()]
@@ -0,0 +1,104 @@
+from datetime import datetime
+
+from db.db import read_transaction
+from models import low_stock, rollup
+from models.purchase import Purchase
+from models.sale import Sale
+
+
+class Dashboard:
+    @staticmethod
+    def get(start_date=None, end_date=None, latest=5, low_stock_limit=5):
+        """
+        Computes everything the home page shows, in one read transaction so every number comes from the same
+        state of the database.
+        :param start_date: Minimum date in ISO format. If None, it is not filtered.
+        :param end_date: Maximum date in ISO format. If None, it is not filtered.
+        :param latest: Number of latest sales and purchases to return.
+        :param low_stock_limit: Number of low-stock products/variants to return. The count includes all of them.
+        :return: Dictionary with the totals, counts and lists of the dashboard.
+        """
+        with read_transaction() as conn:
+            cursor = conn.cursor()
+
+            # Sales and purchases totals, from the daily rollups
+            conditions, day_params = rollup.date_filter(start_date, end_date, column="r.day")
+            day_where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+            cursor.execute(f"SELECT COALESCE(SUM(r.count), 0), COALESCE(SUM(r.total), 0) FROM sale_daily_total r {day_where}", day_params)
+            sales_count, sales_total = cursor.fetchone()
+            cursor.execute(f"SELECT COALESCE(SUM(r.count), 0), COALESCE(SUM(r.total), 0) FROM purchase_daily_total r {day_where}", day_params)
+            purchases_count, purchases_total = cursor.fetchone()
+
+            conditions, sale_params = Sale._filters(start_date, end_date)
+            sale_where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+            conditions, purchase_params = Purchase._filters(start_date, end_date)
+            purchase_where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+            # Latest sales and purchases, with the name of the client/supplier
+            cursor.execute(f"""
+                SELECT s.id, s.date, s.client_id, s.total, c.name || ' ' || c.surname
+                FROM sale s
+                LEFT JOIN client c ON c.id = s.client_id
+                {sale_where}
+                ORDER BY s.date DESC, s.id DESC
+                LIMIT ?
+            """, (*sale_params, latest))
+            latest_sales = [
+                {"id": row[0], "date": datetime.strptime(row[1], "%Y-%m-%d").strftime("%d-%m-%Y"), "client_id": row[2], "total": row[3], "client_name": row[4]}
+                for row in cursor.fetchall()
+            ]
+
+            cursor.execute(f"""
+                SELECT p.id, p.date, p.supplier_id, p.total, su.name || ' ' || su.surname
+                FROM purchase p
+                LEFT JOIN supplier su ON su.id = p.supplier_id
+                {purchase_where}
+                ORDER BY p.date DESC, p.id DESC
+                LIMIT ?
+            """, (*purchase_params, latest))
+            latest_purchases = [
+                {"id": row[0], "date": datetime.strptime(row[1], "%Y-%m-%d").strftime("%d-%m-%Y"), "supplier_id": row[2], "total": row[3], "supplier_name": row[4]}
+                for row in cursor.fetchall()
+            ]
+
+            # Top 5 products sold
+            cursor.execute(f"""
+                SELECT p.name, pv.variant_name, SUM(r.quantity) AS total_quantity
+                FROM sale_daily r
+                JOIN product p ON p.id = r.product_id
+                LEFT JOIN product_variant pv ON pv.id = r.variant_id
+                {day_where} {'AND' if day_where else 'WHERE'} p.active = 1
+                GROUP BY r.product_id, r.variant_id
+                ORDER BY total_quantity DESC
+                LIMIT 5
+            """, day_params)
+            top5 = [(row[0], row[1], row[2]) for row in cursor.fetchall()]  # product_name, variant_name, quantity
+
+            # Sales by category
+            cursor.execute(f"""
+                SELECT c.id, c.name, SUM(r.amount) AS total
+                FROM sale_daily r
+                JOIN product p ON p.id = r.product_id
+                JOIN category c ON c.id = p.category_id
+                {day_where}
+                GROUP BY c.id
+                ORDER BY total DESC, c.name
+            """, day_params)
+            sales_by_category = {row[0]: {"name": row[1], "total": row[2]} for row in cursor.fetchall()}
+
+            # Low stock, from the table kept by triggers
+            low_stock_count = low_stock.count(conn)
+            low_stock_items = low_stock.get(low_stock_limit, conn)
+
+        return {
+            "sales_total": sales_total,
+            "sales_count": sales_count,
+            "purchases_total": purchases_total,
+            "purchases_count": purchases_count,
+            "latest_sales": latest_sales,
+            "latest_purchases": latest_purchases,
+            "top5": top5,
+            "sales_by_category": sales_by_category,
+            "low_stock_count": low_stock_count,
+            "low_stock": low_stock_items,
+        }
@@ -0,0 +1,66 @@
+"""
+Products and variants at or below their minimum stock.
+The low_stock table and its events are kept by triggers on product and product_variant (migration 8), so every
+write path keeps them current and reading them is an indexed read of a few rows.
+"""
+from db.db import get_connection, transaction
+
+
+def get(limit=None, conn=None):
+    """
+    Gets the items with low stock, the ones without stock first and then from the lowest stock.
+    :param limit: Maximum number of items. If None, all of them.
+    :param conn: Connection to the database. If None, the connection of the thread is used.
+    :return: List of dictionaries with product_id, variant_id (None for a product), product_name, variant_name,
+    stock, low_stock and severity (2 without stock, 1 low stock).
+    """
+    if conn is None:
+        conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT ls.product_id, NULLIF(ls.variant_id, 0), p.name, pv.variant_name, ls.stock, ls.stock_low, ls.severity
+        FROM low_stock ls
+        JOIN product p ON p.id = ls.product_id
+        LEFT JOIN product_variant pv ON pv.id = ls.variant_id
+        ORDER BY ls.severity DESC, ls.stock, p.name
+        LIMIT ?
+    """, (-1 if limit is None else limit,))
+    return [{"product_id": row[0], "variant_id": row[1], "product_name": row[2], "variant_name": row[3],
+             "stock": row[4], "low_stock": row[5], "severity": row[6]} for row in cursor.fetchall()]
+
+
+def count(conn=None):
+    """Returns the number of products and variants with low stock."""
+    if conn is None:
+        conn = get_connection()
+    return conn.execute("SELECT COUNT(*) FROM low_stock").fetchone()[0]
+
+
+def has_events(conn=None):
+    """Returns True if there are pending events. A plain read, so it doesn't take the write lock."""
+    if conn is None:
+        conn = get_connection()
+    return bool(conn.execute("SELECT EXISTS (SELECT 1 FROM low_stock_event)").fetchone()[0])
+
+
+def take_events():
+    """
+    Reads and deletes the pending events, oldest first.
+    :return: List of dictionaries with product_id, variant_id (None for a product), product_name, variant_name,
+    type ("low" when the item went down to its minimum stock, "ok" when it went back above), stock, stock_low
+    and created_at.
+    """
+    with transaction(immediate=True) as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT e.id, e.product_id, NULLIF(e.variant_id, 0), p.name, pv.variant_name, e.type, e.stock, e.stock_low, e.created_at
+            FROM low_stock_event e
+            LEFT JOIN product p ON p.id = e.product_id
+            LEFT JOIN product_variant pv ON pv.id = e.variant_id
+            ORDER BY e.id
+        """)
+        rows = cursor.fetchall()
+        if rows:
+            cursor.execute("DELETE FROM low_stock_event WHERE id <= ?", (rows[-1][0],))
+    return [{"product_id": row[1], "variant_id": row[2], "product_name": row[3], "variant_name": row[4],
+             "type": row[5], "stock": row[6], "stock_low": row[7], "created_at": row[8]} for row in rows]
@@ -0,0 +1,128 @@
+from db.db import get_connection, transaction
+
+MODES = ("percent", "amount")
+
+
+def _filters(category_id=None, unit=None, name=None):
+    """
+    Builds the WHERE conditions over the product table (alias p) for a price update.
+    Only active products are changed.
+    :param name: Text the product name must contain. '*' works as a wildcard.
+    """
+    conditions, params = ["p.active = 1"], []
+    if category_id is not None:
+        conditions.append("p.category_id = ?")
+        params.append(category_id)
+    if unit is not None:
+        conditions.append("p.unit = ?")
+        params.append(unit)
+    if name:
+        pattern = name.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_").replace("*", "%")
+        conditions.append("p.name LIKE ? ESCAPE '\\'")
+        params.append(f"%{pattern}%")
+    return " AND ".join(conditions), params
+
+
+def _new_price(mode, value, round_to, column="price"):
+    """SQL expression for the new price computed from a price column, and its parameters. Never below 0."""
+    if mode not in MODES:
+        raise ValueError("El modo debe ser 'percent' o 'amount'")
+    expression = f"{column} * (1 + ? / 100.0)" if mode == "percent" else f"{column} + ?"
+    params = [value]
+    if round_to:
+        expression = f"ROUND(({expression}) / ?) * ?"
+        params += [round_to, round_to]
+    else:
+        expression = f"ROUND({expression}, 2)"
+    return f"MAX(0, {expression})", params
+
+
+class Price:
+    @staticmethod
+    def preview(mode, value, category_id=None, unit=None, name=None, round_to=None, conn=None):
+        """
+        Lists the prices a bulk update would change, without changing them.
+        Products with variants are changed through their variants.
+        :param mode: "percent" to change by a percentage, "amount" to add a fixed amount (both can be negative).
+        :param value: Percentage or amount.
+        :param category_id: Only products of this category. None for all.
+        :param unit: Only products with this unit. None for all.
+        :param name: Only products whose name contains this text ('*' as wildcard). None for all.
+        :param round_to: Optional step to round the new prices to (for example 10). If None, rounds to cents.
+        :return: List of dictionaries with product_id, variant_id (None for a product), product_name, variant_name,
+        old_price and new_price, sorted by product name.
+        """
+        where, params = _filters(category_id, unit, name)
+        new_price, price_params = _new_price(mode, value, round_to, "p.price")
+        new_variant_price, _ = _new_price(mode, value, round_to, "pv.price")
+        if conn is None:
+            conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT p.id, NULL, p.name, NULL, p.price, {new_price}
+            FROM product p
+            WHERE {where} AND p.price >= 0
+            UNION ALL
+            SELECT p.id, pv.id, p.name, pv.variant_name, pv.price, {new_variant_price}
+            FROM product_variant pv
+            JOIN product p ON p.id = pv.product_id
+            WHERE {where} AND pv.price IS NOT NULL
+            ORDER BY 3, 4
+        """, price_params + params + price_params + params)
+        return [{"product_id": row[0], "variant_id": row[1], "product_name": row[2], "variant_name": row[3],
+                 "old_price": row[4], "new_price": row[5]} for row in cursor.fetchall()]
+
+    @staticmethod
+    def bulk_update(mode, value, category_id=None, unit=None, name=None, round_to=None):
+        """
+        Changes the prices of every matching product and variant with one UPDATE per table, in one transaction.
+        The parameters are the same as in preview. The price history is written by the triggers of the tables.
+        :return: Dictionary with the number of products and variants changed.
+        """
+        where, params = _filters(category_id, unit, name)
+        new_price, price_params = _new_price(mode, value, round_to)
+        with transaction(immediate=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                UPDATE product SET price = {new_price}
+                WHERE price >= 0 AND id IN (SELECT p.id FROM product p WHERE {where})
+            """, price_params + params)
+            products = cursor.rowcount
+            cursor.execute(f"""
+                UPDATE product_variant SET price = {new_price}
+                WHERE price IS NOT NULL AND product_id IN (SELECT p.id FROM product p WHERE {where})
+            """, price_params + params)
+            variants = cursor.rowcount
+        return {"products": products, "variants": variants}
+
+    @staticmethod
+    def get_history(product_id, variant_id=None):
+        """
+        Gets the price changes of a product or variant, newest first.
+        :return: List of dictionaries with price and changed_at.
+        """
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT price, changed_at FROM price_history
+                WHERE product_id = ? AND variant_id = ?
+                ORDER BY changed_at DESC, id DESC
+            """, (product_id, variant_id or 0))
+            return [{"price": row[0], "changed_at": row[1]} for row in cursor.fetchall()]
+
+    @staticmethod
+    def get_price_at(product_id, variant_id, date):
+        """
+        Gets the price that a product or variant had at the end of a date.
+        :param date: Date in ISO format (YYYY-MM-DD).
+        :return: The price, or None if the product/variant had no price yet.
+        """
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT price FROM price_history
+                WHERE product_id = ? AND variant_id = ? AND changed_at < date(?, '+1 day')
+                ORDER BY changed_at DESC, id DESC LIMIT 1
+            """, (product_id, variant_id or 0, date))
+            row = cursor.fetchone()
+            return row[0] if row else None
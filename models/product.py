@@ -1,6 +1,8 @@
-from db.db import get_connection
+from db.db import get_connection, transaction
 from models.product_variant import ProductVariant
 from models.category import Category
+from models.search import match_query
+from models import low_stock
 
 class Product():
     def __init__(self, name, category, unit, price, stock=0, stock_low=0, id = None, variants=None):
@@ -19,10 +21,8 @@ class Product():
         :param conn: Connection to the database. If None, a new connection will be created.
         :return: ID of the product created or updated.
         """
-        if conn is None:
-            conn = get_connection()
-            conn.isolation_level = 'EXCLUSIVE'
-        with conn:
+        # Without a connection of the caller, take the write lock at the start
+        with (transaction(immediate=True) if conn is None else conn) as conn:
             cursor = conn.cursor()
             if self.id: # Update existing product
                 cursor.execute("""UPDATE product SET name=?, category_id=?, unit=?, price=?, 
@@ -49,11 +49,7 @@ class Product():
         - If the element in variants_list does not contain id, then creates a new variant
         - If the variant exists in the database but not in variants_list, it is deleted
         """
-        if conn is None:
-            conn = get_connection()
-            conn.isolation_level = 'EXCLUSIVE'
-
-        with conn:
+        with (transaction(immediate=True) if conn is None else conn) as conn:
             cursor = conn.cursor()
             # Get current variant IDs for the product
             cursor.execute("SELECT id FROM product_variant WHERE product_id=?", (self.id,))
@@ -99,13 +95,64 @@ class Product():
             # Devuelve todas las filas resultantes de haber ejecutado la query de execute
             products = [{"id": row[0], "name": row[1], "category": row[2], "unit": row[3], "price": row[4], "stock": row[5], "stock_low": row[6]} for row in cursor.fetchall()]
 
-            # If there are products, get their variants
+            # Load every variant in a single query and attach them to their products
+            variants = ProductVariant.get_grouped_by_product(active=active, conn=conn)
             for product in products:
-                product_id = product["id"]
-                product["variants"] = ProductVariant.get_by_product_id(product_id)
+                product["variants"] = variants.get(product["id"], [])
+
+        return products
+
+    @staticmethod
+    def search(text, limit=50, active=1):
+        """
+        Full-text search of products by name, variant names and category, ignoring accents. Every word of the text
+        must start a word of the product. The best matches come first (a match in the name weighs more than one in
+        a variant, and that more than one in the category).
+        :param text: Text typed by the user.
+        :param limit: Maximum number of products to return.
+        :param active: 2 for all products, 1 for active products, 0 for inactive products.
+        :return: List of products like get_all, including variants.
+        """
+        query = match_query(text)
+        if query is None:
+            return []
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT product.id, product.name, category.name AS category, product.unit, product.price, product.stock, product.stock_low
+                FROM product_fts
+                JOIN product ON product.id = product_fts.rowid
+                JOIN category ON product.category_id = category.id
+                WHERE product_fts MATCH ? AND (? = 2 OR product.active = ?)
+                ORDER BY bm25(product_fts, 10.0, 4.0, 1.0)
+                LIMIT ?
+            """, (query, active, active, limit))
+            products = [{"id": row[0], "name": row[1], "category": row[2], "unit": row[3], "price": row[4], "stock": row[5], "stock_low": row[6]} for row in cursor.fetchall()]
 
+            if products:
+                ids = [product["id"] for product in products]
+                cursor.execute(f"""
+                    SELECT id, product_id, variant_name, stock, stock_low, price FROM product_variant
+                    WHERE product_id IN ({', '.join('?' * len(ids))})
+                    ORDER BY product_id, variant_name
+                """, ids)
+                variants = {}
+                for row in cursor.fetchall():
+                    variants.setdefault(row[1], []).append({'id': row[0], 'product_id': row[1], 'variant_name': row[2], 'stock': row[3], "stock_low": row[4], 'price': row[5]})
+                for product in products:
+                    product["variants"] = variants.get(product["id"], [])
         return products
 
+    @staticmethod
+    def get_catalog_generation():
+        """
+        Returns a number that changes every time a product, variant or category is written (triggers of
+        migration 7 keep it). If it is the same as when the catalog was loaded, the loaded catalog is current.
+        """
+        with get_connection() as conn:
+            row = conn.execute("SELECT generation FROM data_generation WHERE name = 'catalog'").fetchone()
+            return row[0] if row else None
+
     @staticmethod
     def get_by_id(product_id, conn=None):
         """
@@ -156,103 +203,63 @@ class Product():
             return result[0] if result else 0
 
     @staticmethod
-    def edit_stock(product_id, variant_id, quantity, type, conn=None):
+    def find_shortages(requested, conn=None):
         """
-        Adjusts the stock of a product or its variant based on the type of transaction.
-        :param product_id: ID of the product.
-        :param variant_id: ID of the product variant. If None, the stock of the product itself is adjusted.
-        :param quantity: Amount to adjust the stock by.
-        :param type: "in" if it was a purchase, "out" if it was a sale.
+        Finds every line that asks for more stock than there is, with one query per table for the whole list.
+        :param requested: Dictionary with (product_id, variant_id) as key and the quantity needed as value.
+        A quantity of 0 only checks that the product/variant exists.
+        :param conn: Connection to the database. Pass the one of a write transaction to check the stock that
+        transaction sees. If None, the connection of the thread is used.
+        :return: List of dictionaries with product_id, variant_id, product_name, variant_name, quantity (needed)
+        and stock (None if the product/variant doesn't exist), one per insufficient line.
         """
+        if conn is None:
+            conn = get_connection()
+        cursor = conn.cursor()
 
-        with conn:
-            cursor = conn.cursor()
-            if variant_id:
-                ProductVariant.edit_stock(variant_id=variant_id, quantity=quantity, type=type, conn=conn)
-
-                # Calculates the stock of the product as the sum of the variant's stock
-                cursor.execute("SELECT stock FROM product_variant WHERE product_id=?", (product_id,))
-                q = cursor.fetchall()
-                new_stock = 0
-                for row in q:
-                    new_stock += row[0]
-            else:
-                cursor.execute("SELECT stock FROM product WHERE id=?", (product_id,))
-                stock = cursor.fetchone()[0]
-                if type == "out": # Stock decreases
-                    if stock < quantity:
-                        raise ValueError("Insufficient stock to complete the sale.")
-                    new_stock = stock - quantity
-                elif type == "in": # Stock increases
-                    new_stock = stock + quantity
-                cursor.execute("UPDATE product SET stock=? WHERE id=?", (new_stock, product_id))
+        # Products and variants read in chunks, to stay below the SQLite limit of parameters per query
+        found = {}
+        variant_ids = [variant_id for _, variant_id in requested if variant_id is not None]
+        product_ids = list({product_id for product_id, variant_id in requested if variant_id is None})
+        for i in range(0, len(variant_ids), 500):
+            chunk = variant_ids[i:i + 500]
+            cursor.execute(f"""
+                SELECT pv.product_id, pv.id, p.name, pv.variant_name, pv.stock
+                FROM product_variant pv JOIN product p ON p.id = pv.product_id
+                WHERE pv.id IN ({', '.join('?' * len(chunk))})
+            """, chunk)
+            for product_id, variant_id, name, variant_name, stock in cursor.fetchall():
+                found[(product_id, variant_id)] = (name, variant_name, stock)
+        for i in range(0, len(product_ids), 500):
+            chunk = product_ids[i:i + 500]
+            cursor.execute(f"SELECT id, name, stock FROM product WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+            for product_id, name, stock in cursor.fetchall():
+                found[(product_id, None)] = (name, None, stock)
 
-            cursor.execute("UPDATE product SET stock=? WHERE id=?", (new_stock, product_id))
+        shortages = []
+        for (product_id, variant_id), quantity in requested.items():
+            name, variant_name, stock = found.get((product_id, variant_id), (None, None, None))
+            if stock is None or stock < quantity:
+                shortages.append({"product_id": product_id, "variant_id": variant_id, "product_name": name,
+                                  "variant_name": variant_name, "quantity": quantity, "stock": stock})
+        return shortages
 
     @staticmethod
     def check_stock(actual_products):
         """
         Checks if the stock for each product and variant in actual_products is sufficient.
         :param actual_products: Dictionary with product_id and variant_id as keys, and a dictionary with 'quantity' as value.
+        :return: Tuple (True if every line has enough stock, list of the insufficient lines as in find_shortages).
         """
-        with get_connection() as conn:
-            cursor = conn.cursor()
-            for (product_id, variant_id), details in actual_products.items():
-                if variant_id is not None:
-                    cursor.execute("SELECT stock FROM product_variant WHERE id = ?", (variant_id,))
-                    stock = cursor.fetchone()
-                    if not stock or stock[0] < details['quantity']:
-                        return False, (product_id, variant_id, details['quantity'], stock[0] if stock else None)
-                else:
-                    cursor.execute("SELECT stock FROM product WHERE id = ?", (product_id,))
-                    stock = cursor.fetchone()
-                    if not stock or stock[0] < details['quantity']:
-                        return False, (product_id, None, details['quantity'], stock[0] if stock else None)
-        return True, None
+        shortages = Product.find_shortages({key: details["quantity"] for key, details in actual_products.items()})
+        return not shortages, shortages
 
     @staticmethod
     def get_low_stock(q):
         """
-        Retrieves products and variants with low stock.
+        Retrieves products and variants with low stock, from the low_stock table kept by triggers.
         :param q: Quantity limit for the number of low-stock items to return. If None, returns all low-stock items.
-        :return: List of dictionaries with product and variant details where stock is below the low stock threshold.
+        :return: List of dictionaries with product and variant details where stock is below the low stock threshold,
+        the ones without stock first.
         """
-        with get_connection() as conn:
-            cursor = conn.cursor()
-
-            # Get all low-stock variants (where variant stock is below threshold)
-            cursor.execute("""
-                    SELECT 
-                        p.name AS product_name,
-                        pv.variant_name,
-                        pv.stock,
-                        pv.stock_low
-                    FROM product_variant pv
-                    JOIN product p ON p.id = pv.product_id
-                    WHERE pv.stock <= pv.stock_low
-                    ORDER BY pv.stock ASC
-                """)
-            low_stock_variants = cursor.fetchall()
-
-            # Now, get all products with no variants and low stock
-            cursor.execute("""
-                    SELECT 
-                        p.name AS product_name,
-                        NULL AS variant_name,
-                        p.stock,
-                        p.stock_low
-                    FROM product p
-                    WHERE p.stock <= p.stock_low
-                    AND p.active = 1
-                      AND p.id NOT IN (SELECT DISTINCT product_id FROM product_variant)
-                    ORDER BY p.stock ASC
-                """)
-            low_stock_products = cursor.fetchall()
-
-            # Merge and take the first `limit` items overall
-            all_low_stock = low_stock_variants + low_stock_products
-
-            all_low_stock = [dict(zip(["product_name", "variant_name", "stock", "low_stock"], row)) for row in all_low_stock]
-
-            if q: return all_low_stock[:q]
-            else: return all_low_stock
+        return low_stock.get(q or None)
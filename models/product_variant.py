@@ -1,4 +1,21 @@
-from db.db import get_connection
+from db.db import get_connection, transaction
+
+
+class InsufficientStockError(ValueError):
+    """
+    Raised when a sale asks for more stock than a product or variant has.
+    shortages lists every insufficient line (see Product.find_shortages) when they were all checked at once;
+    product_id, variant_id and quantity are those of the first one.
+    """
+    def __init__(self, message, product_id=None, variant_id=None, quantity=None, shortages=None):
+        super().__init__(message)
+        self.product_id = product_id
+        self.variant_id = variant_id
+        self.quantity = quantity
+        self.shortages = shortages if shortages is not None else [
+            {"product_id": product_id, "variant_id": variant_id, "product_name": None, "variant_name": None,
+             "quantity": quantity, "stock": None}]
+
 
 class ProductVariant():
     def __init__(self, id, product_id, variant_name, stock=0, stock_low=0, price=0):
@@ -15,10 +32,7 @@ class ProductVariant():
         :param conn: Connection object, if None a new connection will be created.
         :return: ID of the saved variant.
         """
-        if conn is None:
-            conn = get_connection()
-            conn.isolation_level = 'EXCLUSIVE'
-        with conn:
+        with (transaction(immediate=True) if conn is None else conn) as conn:
             cursor = conn.cursor()
             if self.id:
                 cursor.execute("""UPDATE product_variant SET variant_name=?, stock=?, price=?, stock_low=? WHERE id=?""",
@@ -38,6 +52,39 @@ class ProductVariant():
             rows = cursor.fetchall()
             return [{'id': row[0], 'product_id': row[1], 'variant_name': row[2], 'stock': row[3], "stock_low": row[4], 'price': row[5]} for row in rows]
 
+    @staticmethod
+    def get_grouped_by_product(active=2, conn=None):
+        """
+        Get the variants of every product in one query, grouped by product ID.
+        :param active: 2 for all products, 1 for active products, 0 for inactive products.
+        :param conn: Connection to the database. If None, a new connection will be created.
+        :return: Dictionary with product ID as key and the list of its variants as value.
+        """
+        if conn is None:
+            conn = get_connection()
+        cursor = conn.cursor()
+        if active == 2:
+            cursor.execute("""
+                SELECT pv.id, pv.product_id, pv.variant_name, pv.stock, pv.stock_low, pv.price
+                FROM product_variant pv
+                GROUP BY pv.product_id, pv.variant_name
+                ORDER BY pv.product_id, pv.variant_name
+            """)
+        else:
+            cursor.execute("""
+                SELECT pv.id, pv.product_id, pv.variant_name, pv.stock, pv.stock_low, pv.price
+                FROM product_variant pv
+                JOIN product p ON p.id = pv.product_id
+                WHERE p.active = ?
+                GROUP BY pv.product_id, pv.variant_name
+                ORDER BY pv.product_id, pv.variant_name
+            """, (active,))
+
+        grouped = {}
+        for row in cursor:
+            grouped.setdefault(row[1], []).append({'id': row[0], 'product_id': row[1], 'variant_name': row[2], 'stock': row[3], "stock_low": row[4], 'price': row[5]})
+        return grouped
+
     @staticmethod
     def delete(variant_id, conn):
         """Delete a product variant by its ID."""
@@ -45,36 +92,6 @@ class ProductVariant():
             cursor = conn.cursor()
             cursor.execute("DELETE FROM product_variant WHERE id=?", (variant_id,))
 
-    @staticmethod
-    def edit_stock(variant_id, quantity, type, conn=None):
-        """ Edit stock of a product variant."""
-        if type not in ["in", "out"]:
-            raise ValueError("Tipo de movimiento debe ser 'in' o 'out'")
-
-        with conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM product_variant WHERE id=?", (variant_id,))
-            x = cursor.fetchone()
-            variant = {
-                "id": x[0],
-                "product_id": x[1],
-                "variant_name": x[2],
-                "stock": x[3],
-                "stock_low": x[4],
-                "price": x[5]
-            }
-            if not variant:
-                raise ValueError("Variante no encontrada")
-
-            if type == "out": # Stock decreases
-                if quantity > variant["stock"]:
-                    raise ValueError("No hay suficiente stock en la variante seleccionada")
-                variant["stock"] -= quantity
-            elif type == "in": # Stock increases
-                variant["stock"] += quantity
-
-            cursor.execute("""UPDATE product_variant SET stock=? WHERE id=?""", (variant["stock"], variant_id))
-
     @staticmethod
     def get_variant_by_id(product_id, variant_id):
         """Get a specific variant by its ID."""
@@ -1,6 +1,6 @@
-from models.product import Product
-from models.stock import save_transaction, delete_transaction, update_transaction
-from db.db import get_connection
+from models import rollup
+from models import stock
+from db.db import get_connection, read_transaction, transaction
 from datetime import datetime
 
 class Purchase:
@@ -20,12 +20,14 @@ class Purchase:
     def save(self):
         """
         Save the purchase to the database. If it has an id, it updates the existing purchase.
+        Like Sale.save, it takes the write lock at the start: lowering the quantity of a purchase takes stock back.
         :return: ID of the purchase
         """
-        with get_connection() as conn:
+        with transaction(immediate=True) as conn:
             cursor = conn.cursor()
 
             if self.id:
+                rollup.remove(conn, "purchase", self.id)  # Take the old version out of the rollups
                 # Update sale
                 cursor.execute("""
                     UPDATE purchase
@@ -41,36 +43,15 @@ class Purchase:
                 """, (self.date, self.supplier_id, self.total))
                 self.id = cursor.lastrowid
             self.save_details(conn=conn)
+            rollup.add(conn, "purchase", self.id)
         return self.id
 
     def save_details(self, conn):
         """
-        Save the details of the purchase to the database. It updates the existing details or adds new ones.
+        Save the details of the purchase to the database. It updates the existing details or adds new ones,
+        in bulk and adjusting the stock (see models.stock.save_details).
         """
-        with conn:
-            cursor = conn.cursor()
-
-            # Get old details
-            cursor.execute("SELECT product_id, variant_id, quantity, unit_price from purchase_detail WHERE purchase_id = ?", (self.id,))
-            old_products = {(row[0], row[1]):{'quantity':row[2], 'unit_price':row[3]} for row in cursor.fetchall()}
-            delete = old_products.keys() - self.items.keys()
-
-            # Delete products that are no longer in the purchase
-            for product_id, variant_id in delete:
-                cursor.execute("DELETE FROM purchase_detail WHERE purchase_id = ? AND product_id = ? AND variant_id = ?", (self.id, product_id, variant_id))
-                # Update the transaction
-                delete_transaction(product_id=product_id, variant_id=variant_id, type="in", quantity=old_products[(product_id, variant_id)]['quantity'], conn=conn, purchase_id=self.id)
-
-            for p, details in self.items.items():
-                if p not in old_products: # New product
-                    cursor.execute("INSERT INTO purchase_detail (purchase_id, product_id, variant_id, quantity, unit_price) VALUES (?, ?, ?, ?, ?)", (self.id, p[0], p[1], details["quantity"], details["unit_price"]))
-                    # New transaction
-                    save_transaction(product_id=p[0], variant_id=p[1], type="in", quantity=details["quantity"],conn=conn, purchase_id=self.id)
-                elif p in old_products:
-                    if details["quantity"] != old_products.get(p, {}).get("quantity", 0): # If the quantity has changed
-                        # Update existing products
-                        cursor.execute("UPDATE purchase_detail SET variant_id = ?, quantity = ?, unit_price = ? WHERE product_id = ?", (p[1], details["quantity"], details['unit_price'], self.id))
-                        update_transaction(product_id=p[0], variant_id=p[1], type="in", new_q=details["quantity"], conn=conn, purchase_id=self.id)
+        stock.save_details("purchase", self.id, self.items, self.date, conn=conn)
 
     @staticmethod
     def get_by_id(purchase_id):
@@ -110,54 +91,168 @@ class Purchase:
         }
 
     @staticmethod
-    def get_all(start_date, end_date):
+    def get_all(start_date, end_date, with_items=True):
         """
         Get all purchases within a specified date range.
+        Headers and details are read with two ordered queries and merged in a single pass.
         :param start_date: Date to start filtering purchases. If None, it retrieves all purchases.
         :param end_date: Date to end filtering purchases. If None, it retrieves all purchases.
-        :return: List of dictionaries with purchase details including id, date, supplier_id, total, and items.
+        :param with_items: If False, the details are not loaded and the purchases have no "items" key.
+        :return: List of dictionaries with purchase details including id, date, supplier_id, supplier_name (None without supplier), total, and items.
         """
+        if start_date is None or end_date is None:
+            where, params = "", ()
+        else:
+            where, params = "WHERE p.date BETWEEN ? AND ?", (start_date, end_date)
+
+        with read_transaction() as conn:  # Headers and details from the same snapshot
+            headers = conn.cursor()
+            headers.execute(f"""
+                SELECT p.id, p.date, p.supplier_id, p.total, sp.name || ' ' || sp.surname
+                FROM purchase p
+                LEFT JOIN supplier sp ON sp.id = p.supplier_id
+                {where}
+                ORDER BY p.date DESC, p.id DESC
+            """, params)
+            purchases = [{
+                "id": row[0],
+                "date": datetime.strptime(row[1], "%Y-%m-%d").strftime("%d-%m-%Y"),
+                "supplier_id": row[2] if row[2] else None,
+                "total": row[3],
+                "supplier_name": row[4],
+            } for row in headers]
+            if not with_items:
+                return purchases
+
+            # Details come in the same order as the headers, so each purchase takes the rows until the purchase_id changes
+            details = conn.cursor()
+            details.execute(f"""
+                SELECT pd.purchase_id, pd.product_id, pd.variant_id, pd.quantity, pd.unit_price, product.active
+                FROM purchase p
+                JOIN purchase_detail pd ON pd.purchase_id = p.id
+                JOIN product ON product.id = pd.product_id
+                {where}
+                ORDER BY p.date DESC, p.id DESC, pd.product_id, pd.variant_id
+            """, params)
+            item = details.fetchone()
+            for purchase in purchases:
+                # Dictionary with (product_id, variant_id) as key and quantity, unit_price, and active status as value
+                purchase_items = {}
+                while item is not None and item[0] == purchase["id"]:
+                    key = (item[1], item[2])  # (product_id, variant_id)
+                    purchase_items[key] = {"quantity": item[3], "unit_price": item[4], "active": item[5]}
+                    item = details.fetchone()
+                purchase["items"] = purchase_items
+        return purchases
+
+    SORT_COLUMNS = {"date": "p.date", "total": "p.total", "id": "p.id"}
+
+    @staticmethod
+    def _filters(start_date=None, end_date=None, min_total=None, max_total=None, supplier_id=None):
+        """Builds the WHERE conditions and parameters for the purchases filters. Dates in ISO format."""
+        conditions, params = [], []
+        if start_date is not None:
+            conditions.append("p.date >= ?")
+            params.append(start_date)
+        if end_date is not None:
+            conditions.append("p.date <= ?")
+            params.append(end_date)
+        if min_total is not None:
+            conditions.append("p.total >= ?")
+            params.append(min_total)
+        if max_total is not None:
+            conditions.append("p.total <= ?")
+            params.append(max_total)
+        if supplier_id is not None:
+            conditions.append("p.supplier_id = ?")
+            params.append(supplier_id)
+        return conditions, params
+
+    @staticmethod
+    def query(start_date=None, end_date=None, min_total=None, max_total=None, supplier_id=None,
+              sort="date", descending=True, after=None, limit=100, with_items=True):
+        """
+        Get one page of purchases matching the filters, using keyset pagination.
+        :param start_date: Minimum date in ISO format. If None, it is not filtered.
+        :param end_date: Maximum date in ISO format. If None, it is not filtered.
+        :param min_total: Minimum total amount. If None, it is not filtered.
+        :param max_total: Maximum total amount. If None, it is not filtered.
+        :param supplier_id: ID of the supplier. If None, purchases of every supplier are returned.
+        :param sort: Column to sort by: "date", "total" or "id".
+        :param descending: True to sort from the highest value to the lowest.
+        :param after: Cursor returned with the previous page. If None, the first page is returned.
+        :param limit: Maximum number of purchases in the page.
+        :param with_items: If False, the details are not loaded and the purchases have no "items" key.
+        :return: Tuple (list of purchases with their supplier name, cursor for the next page or None if this was the last one).
+        """
+        if sort not in Purchase.SORT_COLUMNS:
+            raise ValueError(f"Orden inválido: {sort}")
+        column = Purchase.SORT_COLUMNS[sort]
+        conditions, params = Purchase._filters(start_date, end_date, min_total, max_total, supplier_id)
+        if after is not None:
+            # Continue right after the last row of the previous page. The id breaks ties between equal values
+            conditions.append(f"({column}, p.id) {'<' if descending else '>'} (?, ?)")
+            params.extend(after)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        order = "DESC" if descending else "ASC"
+
+        with read_transaction() as conn:  # The page and its details from the same snapshot
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT p.id, p.date, p.supplier_id, p.total, {column}, sp.name || ' ' || sp.surname
+                FROM purchase p
+                LEFT JOIN supplier sp ON sp.id = p.supplier_id
+                {where}
+                ORDER BY {column} {order}, p.id {order}
+                LIMIT ?
+            """, (*params, limit + 1))
+            rows = cursor.fetchall()
+
+            # The extra row tells if there is a next page
+            next_cursor = None
+            if len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = (rows[-1][4], rows[-1][0])
+
+            purchases = [{
+                "id": row[0],
+                "date": datetime.strptime(row[1], "%Y-%m-%d").strftime("%d-%m-%Y"),
+                "supplier_id": row[2] if row[2] else None,
+                "total": row[3],
+                "supplier_name": row[5],
+            } for row in rows]
+
+            if with_items and purchases:
+                # Details only for the purchases of this page
+                items_by_id = {}
+                for purchase in purchases:
+                    purchase["items"] = {}
+                    items_by_id[purchase["id"]] = purchase["items"]
+                placeholders = ", ".join("?" * len(items_by_id))
+                cursor.execute(f"""
+                    SELECT pd.purchase_id, pd.product_id, pd.variant_id, pd.quantity, pd.unit_price, product.active
+                    FROM purchase_detail pd
+                    JOIN product ON product.id = pd.product_id
+                    WHERE pd.purchase_id IN ({placeholders})
+                    ORDER BY pd.product_id, pd.variant_id
+                """, tuple(items_by_id))
+                for item in cursor:
+                    items_by_id[item[0]][(item[1], item[2])] = {"quantity": item[3], "unit_price": item[4], "active": item[5]}
+
+        return purchases, next_cursor
+
+    @staticmethod
+    def count(start_date=None, end_date=None, min_total=None, max_total=None, supplier_id=None):
+        """
+        Count the purchases matching the filters.
+        :return: Tuple (number of purchases, sum of their totals).
+        """
+        conditions, params = Purchase._filters(start_date, end_date, min_total, max_total, supplier_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
         with get_connection() as conn:
             cursor = conn.cursor()
-            if start_date is None or end_date is None:
-                cursor.execute("""
-                    SELECT purchase.id, purchase.date, purchase.supplier_id, purchase.total
-                    FROM purchase
-                    ORDER BY purchase.date DESC
-                """)
-            else:
-                cursor.execute("""
-                    SELECT purchase.id, purchase.date, purchase.supplier_id, purchase.total
-                    FROM purchase
-                    WHERE purchase.date BETWEEN ? AND ?
-                    ORDER BY purchase.date DESC
-                """, (start_date, end_date))
-            purchases = cursor.fetchall()
-        items = [] # List to store all purchases with their items
-        for row in purchases:
-            purchase = {
-            "id": row[0],
-            "date": datetime.strptime(row[1], "%Y-%m-%d").strftime("%d-%m-%Y"),
-            "supplier_id": row[2] if row[2] else None,
-            "total": row[3],
-            }
-            # Get items for each purchase
-            cursor.execute("""
-                SELECT pd.product_id, pd.variant_id, pd.quantity, pd.unit_price, product.active
-                FROM purchase_detail pd
-                JOIN product ON product.id = pd.product_id
-                WHERE pd.purchase_id = ?
-                ORDER BY pd.product_id, pd.variant_id
-            """, (purchase["id"],))
-            details = cursor.fetchall()
-            purchase_items = {}
-            # Create a dictionary with (product_id, variant_id) as key and quantity, unit_price, and active status as value
-            for item in details:
-                key = (item[0], item[1])  # (product_id, variant_id)
-                purchase_items[key] = {"quantity": item[2], "unit_price": item[3], "active": item[4]}
-            purchase["items"] = purchase_items
-            items.append(purchase)
-        return items
+            cursor.execute(f"SELECT COUNT(*), COALESCE(SUM(p.total), 0) FROM purchase p {where}", params)
+            return cursor.fetchone()
 
     @staticmethod
     def delete(purchase_id):
@@ -166,18 +261,19 @@ class Purchase:
         :param purchase_id: ID of the purchase to delete.
         :return: None
         """
-        with get_connection() as conn:
+        # One transaction for the stock, the rollups and the rows, so the stock savepoint doesn't commit on its own
+        with transaction(immediate=True) as conn:
             cursor = conn.cursor()
 
-            # Get items
-            cursor.execute("SELECT product_id, variant_id, quantity FROM purchase_detail WHERE purchase_id = ?", (purchase_id,))
-            items = cursor.fetchall()
-            for item in items:
-                product_id, variant_id, quantity = item
-                # Update stock of products
-                Product.edit_stock(product_id=product_id, variant_id=variant_id, type="out", quantity=quantity, conn=conn)
+            # Give back the stock of the items in one batch
+            cursor.execute("SELECT product_id, variant_id, SUM(quantity) FROM purchase_detail WHERE purchase_id = ? GROUP BY product_id, variant_id", (purchase_id,))
+            stock.apply_stock_deltas({(row[0], row[1]): -row[2] for row in cursor.fetchall()}, conn=conn)
+
+            rollup.remove(conn, "purchase", purchase_id)
 
-            # Detele purchase. The details and transaction erases automatically due to cascading
+            # Delete the purchase with its details and stock transactions
+            cursor.execute("DELETE FROM transaction_stock WHERE purchase_id = ?", (purchase_id,))
+            cursor.execute("DELETE FROM purchase_detail WHERE purchase_id = ?", (purchase_id,))
             cursor.execute("DELETE FROM purchase WHERE id = ?", (purchase_id,))
 
     @staticmethod
@@ -185,12 +281,12 @@ class Purchase:
         """
         Get the total purchase amount within a specified date range.
         If no dates are provided, it returns the total purchase amount without filtering.
+        Reads the daily rollups.
         """
+        conditions, params = rollup.date_filter(start_date, end_date)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
         with get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("""
-                SELECT SUM(total) FROM purchase
-                WHERE date BETWEEN ? AND ?
-            """, (start_date, end_date))
+            cursor.execute(f"SELECT SUM(total) FROM purchase_daily_total {where}", params)
             total = cursor.fetchone()[0]
-            return total if total else 0
\ No newline at end of file
+            return total if total else 0
@@ -0,0 +1,117 @@
+"""
+Daily rollups of sales and purchases.
+<kind>_daily has the quantity and amount sold/bought per day, product and variant, and <kind>_daily_total the
+number of sales/purchases and their total per day. Sale and Purchase keep them up to date in the same transaction
+that changes the sale/purchase, so the period reports read a few rows per day instead of the whole history.
+"""
+from db.db import get_connection
+
+KINDS = ("sale", "purchase")
+
+
+def _check_kind(kind):
+    if kind not in KINDS:
+        raise ValueError("Tipo debe ser 'sale' o 'purchase'")
+
+
+def _apply(conn, kind, record_id, sign):
+    """Adds (sign=1) or subtracts (sign=-1) a sale/purchase, as it is now in the database, to the rollups."""
+    _check_kind(kind)
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        INSERT INTO {kind}_daily (day, product_id, variant_id, quantity, amount)
+        SELECT h.date, d.product_id, COALESCE(d.variant_id, 0), ? * SUM(d.quantity), ? * SUM(d.quantity * d.unit_price)
+        FROM {kind} h
+        JOIN {kind}_detail d ON d.{kind}_id = h.id
+        WHERE h.id = ? AND d.product_id IS NOT NULL
+        GROUP BY d.product_id, COALESCE(d.variant_id, 0)
+        ON CONFLICT (day, product_id, variant_id) DO UPDATE SET
+            quantity = quantity + excluded.quantity,
+            amount = amount + excluded.amount
+    """, (sign, sign, record_id))
+    cursor.execute(f"""
+        INSERT INTO {kind}_daily_total (day, count, total)
+        SELECT date, ?, ? * total FROM {kind} WHERE id = ?
+        ON CONFLICT (day) DO UPDATE SET
+            count = count + excluded.count,
+            total = total + excluded.total
+    """, (sign, sign, record_id))
+
+    if sign < 0:
+        # Drop the rows left empty, so the rollups only grow with the days that have movements
+        cursor.execute(f"DELETE FROM {kind}_daily WHERE day = (SELECT date FROM {kind} WHERE id = ?) AND quantity = 0", (record_id,))
+        cursor.execute(f"DELETE FROM {kind}_daily_total WHERE day = (SELECT date FROM {kind} WHERE id = ?) AND count = 0", (record_id,))
+
+
+def add(conn, kind, record_id):
+    """
+    Adds a sale/purchase to the rollups. Call it after saving the sale/purchase and its details.
+    :param conn: Connection with the transaction of the change.
+    :param kind: "sale" or "purchase".
+    :param record_id: ID of the sale/purchase.
+    """
+    _apply(conn, kind, record_id, 1)
+
+
+def remove(conn, kind, record_id):
+    """
+    Removes a sale/purchase from the rollups. Call it before changing or deleting the sale/purchase or its details.
+    :param conn: Connection with the transaction of the change.
+    :param kind: "sale" or "purchase".
+    :param record_id: ID of the sale/purchase.
+    """
+    _apply(conn, kind, record_id, -1)
+
+
+def rebuild_script():
+    """Returns the SQL script that recomputes every rollup from the sales and purchases."""
+    script = ""
+    for kind in KINDS:
+        script += f"""
+            DELETE FROM {kind}_daily;
+            INSERT INTO {kind}_daily (day, product_id, variant_id, quantity, amount)
+            SELECT h.date, d.product_id, COALESCE(d.variant_id, 0), SUM(d.quantity), SUM(d.quantity * d.unit_price)
+            FROM {kind} h
+            JOIN {kind}_detail d ON d.{kind}_id = h.id
+            WHERE d.product_id IS NOT NULL
+            GROUP BY h.date, d.product_id, COALESCE(d.variant_id, 0);
+
+            DELETE FROM {kind}_daily_total;
+            INSERT INTO {kind}_daily_total (day, count, total)
+            SELECT date, COUNT(*), SUM(total) FROM {kind} GROUP BY date;
+        """
+    return script
+
+
+def rebuild(conn=None):
+    """
+    Recomputes every rollup from the sales and purchases, in one transaction.
+    Use it on databases where the rollups were changed or lost outside the app.
+    """
+    if conn is None:
+        conn = get_connection()
+    try:
+        conn.executescript(f"BEGIN;\n{rebuild_script()}\nCOMMIT;")
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def date_filter(start_date, end_date, column="day"):
+    """Builds the WHERE conditions and parameters for a date range over a rollup. Dates in ISO format."""
+    conditions, params = [], []
+    if start_date is not None:
+        conditions.append(f"{column} >= ?")
+        params.append(start_date)
+    if end_date is not None:
+        conditions.append(f"{column} <= ?")
+        params.append(end_date)
+    return conditions, params
+
+
+if __name__ == "__main__":
+    # python -m models.rollup
+    from db.db import initialize_db
+    initialize_db()
+    rebuild()
+    print("Rollups rebuilt")
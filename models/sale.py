@@ -1,6 +1,6 @@
-from models.product import Product
-from models.stock import save_transaction, delete_transaction, update_transaction
-from db.db import get_connection
+from models import rollup
+from models import stock
+from db.db import get_connection, read_transaction, transaction
 from datetime import datetime
 
 class Sale:
@@ -20,12 +20,16 @@ class Sale:
     def save(self):
         """
         Save the sale to the database. If self.id is set, it updates the existing sale.
-        :return:
+        The write lock is taken at the start, so the stock checked and taken by the details can't be changed by
+        another sale in between. If some line doesn't have enough stock, nothing is saved and InsufficientStockError
+        is raised with every insufficient line.
+        :return: ID of the sale.
         """
-        with get_connection() as conn:
+        with transaction(immediate=True) as conn:
             cursor = conn.cursor()
 
             if self.id:
+                rollup.remove(conn, "sale", self.id)  # Take the old version out of the rollups
                 # Update sale
                 cursor.execute("""
                     UPDATE sale
@@ -41,37 +45,15 @@ class Sale:
                 """, (self.date, self.client_id, self.total))
                 self.id = cursor.lastrowid
             self.save_details(conn=conn) # Save the details of the sale
+            rollup.add(conn, "sale", self.id)
         return self.id
 
     def save_details(self, conn):
         """
-        Save the details of the sale to the database. It updates the existing details or adds new ones.
+        Save the details of the sale to the database. It updates the existing details or adds new ones,
+        in bulk and adjusting the stock (see models.stock.save_details).
         """
-        with conn:
-            cursor = conn.cursor()
-
-            # Get old details
-            cursor.execute("SELECT product_id, variant_id, quantity, unit_price from sale_detail WHERE sale_id = ?", (self.id,))
-            old_products = {(row[0], row[1]):{'quantity':row[2], 'unit_price':row[3]} for row in cursor.fetchall()}
-            delete = old_products.keys() - self.items.keys()
-
-            # Delete products that are no longer in the sale
-            for product_id, variant_id in delete:
-                cursor.execute("DELETE FROM sale_detail WHERE sale_id = ? AND product_id = ? AND variant_id = ?", (self.id, product_id, variant_id))
-                # Update the trsaction
-                delete_transaction(product_id=product_id, variant_id=variant_id, type="out", quantity=old_products[(product_id, variant_id)]['quantity'], conn=conn, sale_id=self.id)
-
-            for p, details in self.items.items():
-                if p not in old_products: # New product
-                    cursor.execute("INSERT INTO sale_detail (sale_id, product_id, variant_id, quantity, unit_price) VALUES (?, ?, ?, ?, ?)", (self.id, p[0], p[1], details["quantity"], details["unit_price"]))
-                    # Actualizar stock del producto
-                    save_transaction(product_id=p[0], variant_id=p[1], type="out", quantity=details["quantity"],conn=conn, sale_id=self.id)
-                elif p in old_products: # Product was already on the sale
-                    old = old_products.get(p, {}).get("quantity", 0)
-                    if details["quantity"] != old: # If the quantity has changed
-                        # Update existing products
-                        cursor.execute("UPDATE sale_detail SET variant_id = ?, quantity = ?, unit_price = ? WHERE sale_id = ? AND product_id = ?", (p[1], details["quantity"], details['unit_price'], self.id, p[0]))
-                        update_transaction(product_id=p[0], variant_id=p[1], type="out", new_q=details["quantity"], conn=conn, sale_id=self.id)
+        stock.save_details("sale", self.id, self.items, self.date, conn=conn)
 
     @staticmethod
     def get_by_id(sale_id):
@@ -114,52 +96,167 @@ class Sale:
         }
 
     @staticmethod
-    def get_all(start_date, end_date):
+    def get_all(start_date, end_date, with_items=True):
         """
         Get all sales within a date range or all sales if no date range is provided.
+        Headers and details are read with two ordered queries and merged in a single pass.
         :param start_date: Date to start filtering sales from. If None, all sales are returned.
         :param end_date: Date to end filtering sales at. If None, all sales are returned.
-        :return: List of dictionaries, each containing sale information and items sold.
+        :param with_items: If False, the details are not loaded and the sales have no "items" key.
+        :return: List of dictionaries, each containing sale information, the client name (None without client) and items sold.
+        """
+        if start_date is None or end_date is None:
+            where, params = "", ()
+        else:
+            where, params = "WHERE s.date BETWEEN ? AND ?", (start_date, end_date)
+
+        with read_transaction() as conn:  # Headers and details from the same snapshot
+            headers = conn.cursor()
+            headers.execute(f"""
+                SELECT s.id, s.date, s.client_id, s.total, c.name || ' ' || c.surname
+                FROM sale s
+                LEFT JOIN client c ON c.id = s.client_id
+                {where}
+                ORDER BY s.date DESC, s.id DESC
+            """, params)
+            sales = [{
+                "id": row[0],
+                "date": datetime.strptime(row[1], "%Y-%m-%d").strftime("%d-%m-%Y"),
+                "client_id": row[2] if row[2] else None,
+                "total": row[3],
+                "client_name": row[4],
+            } for row in headers]
+            if not with_items:
+                return sales
+
+            # Details come in the same order as the headers, so each sale takes the rows until the sale_id changes
+            details = conn.cursor()
+            details.execute(f"""
+                SELECT sd.sale_id, sd.product_id, sd.variant_id, sd.quantity, sd.unit_price, product.active
+                FROM sale s
+                JOIN sale_detail sd ON sd.sale_id = s.id
+                JOIN product ON product.id = sd.product_id
+                {where}
+                ORDER BY s.date DESC, s.id DESC, sd.product_id, sd.variant_id
+            """, params)
+            item = details.fetchone()
+            for sale in sales:
+                sale_items = {}
+                while item is not None and item[0] == sale["id"]:
+                    key = (item[1], item[2])  # (product_id, variant_id)
+                    sale_items[key] = {"quantity": item[3], "unit_price": item[4], "active": item[5]}
+                    item = details.fetchone()
+                sale["items"] = sale_items
+        return sales
+
+    SORT_COLUMNS = {"date": "s.date", "total": "s.total", "id": "s.id"}
+
+    @staticmethod
+    def _filters(start_date=None, end_date=None, min_total=None, max_total=None, client_id=None):
+        """Builds the WHERE conditions and parameters for the sales filters. Dates in ISO format."""
+        conditions, params = [], []
+        if start_date is not None:
+            conditions.append("s.date >= ?")
+            params.append(start_date)
+        if end_date is not None:
+            conditions.append("s.date <= ?")
+            params.append(end_date)
+        if min_total is not None:
+            conditions.append("s.total >= ?")
+            params.append(min_total)
+        if max_total is not None:
+            conditions.append("s.total <= ?")
+            params.append(max_total)
+        if client_id is not None:
+            conditions.append("s.client_id = ?")
+            params.append(client_id)
+        return conditions, params
+
+    @staticmethod
+    def query(start_date=None, end_date=None, min_total=None, max_total=None, client_id=None,
+              sort="date", descending=True, after=None, limit=100, with_items=True):
+        """
+        Get one page of sales matching the filters, using keyset pagination.
+        :param start_date: Minimum date in ISO format. If None, it is not filtered.
+        :param end_date: Maximum date in ISO format. If None, it is not filtered.
+        :param min_total: Minimum total amount. If None, it is not filtered.
+        :param max_total: Maximum total amount. If None, it is not filtered.
+        :param client_id: ID of the client. If None, sales of every client are returned.
+        :param sort: Column to sort by: "date", "total" or "id".
+        :param descending: True to sort from the highest value to the lowest.
+        :param after: Cursor returned with the previous page. If None, the first page is returned.
+        :param limit: Maximum number of sales in the page.
+        :param with_items: If False, the details are not loaded and the sales have no "items" key.
+        :return: Tuple (list of sales with their client name, cursor for the next page or None if this was the last one).
+        """
+        if sort not in Sale.SORT_COLUMNS:
+            raise ValueError(f"Orden inválido: {sort}")
+        column = Sale.SORT_COLUMNS[sort]
+        conditions, params = Sale._filters(start_date, end_date, min_total, max_total, client_id)
+        if after is not None:
+            # Continue right after the last row of the previous page. The id breaks ties between equal values
+            conditions.append(f"({column}, s.id) {'<' if descending else '>'} (?, ?)")
+            params.extend(after)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        order = "DESC" if descending else "ASC"
+
+        with read_transaction() as conn:  # The page and its details from the same snapshot
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT s.id, s.date, s.client_id, s.total, {column}, c.name || ' ' || c.surname
+                FROM sale s
+                LEFT JOIN client c ON c.id = s.client_id
+                {where}
+                ORDER BY {column} {order}, s.id {order}
+                LIMIT ?
+            """, (*params, limit + 1))
+            rows = cursor.fetchall()
+
+            # The extra row tells if there is a next page
+            next_cursor = None
+            if len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = (rows[-1][4], rows[-1][0])
+
+            sales = [{
+                "id": row[0],
+                "date": datetime.strptime(row[1], "%Y-%m-%d").strftime("%d-%m-%Y"),
+                "client_id": row[2] if row[2] else None,
+                "total": row[3],
+                "client_name": row[5],
+            } for row in rows]
+
+            if with_items and sales:
+                # Details only for the sales of this page
+                items_by_id = {}
+                for sale in sales:
+                    sale["items"] = {}
+                    items_by_id[sale["id"]] = sale["items"]
+                placeholders = ", ".join("?" * len(items_by_id))
+                cursor.execute(f"""
+                    SELECT sd.sale_id, sd.product_id, sd.variant_id, sd.quantity, sd.unit_price, product.active
+                    FROM sale_detail sd
+                    JOIN product ON product.id = sd.product_id
+                    WHERE sd.sale_id IN ({placeholders})
+                    ORDER BY sd.product_id, sd.variant_id
+                """, tuple(items_by_id))
+                for item in cursor:
+                    items_by_id[item[0]][(item[1], item[2])] = {"quantity": item[3], "unit_price": item[4], "active": item[5]}
+
+        return sales, next_cursor
+
+    @staticmethod
+    def count(start_date=None, end_date=None, min_total=None, max_total=None, client_id=None):
+        """
+        Count the sales matching the filters.
+        :return: Tuple (number of sales, sum of their totals).
         """
+        conditions, params = Sale._filters(start_date, end_date, min_total, max_total, client_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
         with get_connection() as conn:
             cursor = conn.cursor()
-            if start_date is None or end_date is None:
-                cursor.execute("""
-                    SELECT sale.id, sale.date, sale.client_id, sale.total
-                    FROM sale
-                    ORDER BY sale.date DESC
-                """)
-            else:
-                cursor.execute("""
-                    SELECT sale.id, sale.date, sale.client_id, sale.total
-                    FROM sale
-                    WHERE sale.date BETWEEN ? AND ?
-                    ORDER BY sale.date DESC
-                """, (start_date, end_date))
-            sales = cursor.fetchall()
-        items = []
-        for row in sales:
-            sale = {
-            "id": row[0],
-            "date": datetime.strptime(row[1], "%Y-%m-%d").strftime("%d-%m-%Y"),
-            "client_id": row[2] if row[2] else None,
-            "total": row[3],
-            }
-            cursor.execute("""
-                SELECT sd.product_id, sd.variant_id, sd.quantity, sd.unit_price, product.active
-                FROM sale_detail sd
-                JOIN product ON product.id = sd.product_id
-                WHERE sd.sale_id = ?
-                ORDER BY sd.product_id, sd.variant_id
-            """, (sale["id"],))
-            details = cursor.fetchall()
-            sale_items = {}
-            for item in details:
-                key = (item[0], item[1])  # (product_id, variant_id)
-                sale_items[key] = {"quantity": item[2], "unit_price": item[3], "active": item[4]}
-            sale["items"] = sale_items
-            items.append(sale)
-        return items
+            cursor.execute(f"SELECT COUNT(*), COALESCE(SUM(s.total), 0) FROM sale s {where}", params)
+            return cursor.fetchone()
 
     @staticmethod
     def delete(sale_id):
@@ -168,34 +265,35 @@ class Sale:
         :param sale_id: ID of the sale to delete.
         :return: None
         """
-        with get_connection() as conn:
+        # One transaction for the stock, the rollups and the rows, so the stock savepoint doesn't commit on its own
+        with transaction(immediate=True) as conn:
             cursor = conn.cursor()
 
-            # Get items
-            cursor.execute("SELECT product_id, variant_id, quantity FROM sale_detail WHERE sale_id = ?", (sale_id,))
-            items = cursor.fetchall()
-            for item in items:
-                product_id, variant_id, quantity = item
-                # Update stock of products
-                Product.edit_stock(product_id=product_id, variant_id=variant_id, type="in", quantity=quantity, conn=conn)
+            # Give back the stock of the items in one batch
+            cursor.execute("SELECT product_id, variant_id, SUM(quantity) FROM sale_detail WHERE sale_id = ? GROUP BY product_id, variant_id", (sale_id,))
+            stock.apply_stock_deltas({(row[0], row[1]): row[2] for row in cursor.fetchall()}, conn=conn)
+
+            rollup.remove(conn, "sale", sale_id)
 
-            # Detele sale. The details and transaction erases automatically due to cascading
+            # Delete the sale with its details and stock transactions
+            cursor.execute("DELETE FROM transaction_stock WHERE sale_id = ?", (sale_id,))
+            cursor.execute("DELETE FROM sale_detail WHERE sale_id = ?", (sale_id,))
             cursor.execute("DELETE FROM sale WHERE id = ?", (sale_id,))
 
     @staticmethod
     def get_total(start_date, end_date):
         """
         Get the total sales amount within a date range or all sales if no date range is provided.
+        Reads the daily rollups.
         :param start_date: Date to start filtering sales from. If None, all sales are considered.
         :param end_date: Date to end filtering sales at. If None, all sales are considered.
         :return: Total sales amount as a float.
         """
+        conditions, params = rollup.date_filter(start_date, end_date)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
         with get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("""
-                SELECT SUM(total) FROM sale
-                WHERE date BETWEEN ? AND ?
-            """, (start_date, end_date))
+            cursor.execute(f"SELECT SUM(total) FROM sale_daily_total {where}", params)
             result = cursor.fetchone()
             return result[0] if result[0] else 0
 
@@ -203,37 +301,25 @@ class Sale:
     def get_top5_products(start_date, end_date):
         """
         Get the top 5 products sold by quantity within a date range or all products if no date range is provided.
+        Reads the daily rollups.
         :param start_date: Date to start filtering sales from. If None, all products are considered.
         :param end_date: Date to end filtering sales at. If None, all products are considered.
         :return: List of tuples containing product name, variant name, and total quantity sold.
         """
+        conditions, params = rollup.date_filter(start_date, end_date, column="r.day")
+        conditions.append("product.active = 1")
         with get_connection() as conn:
             cursor = conn.cursor()
-            if start_date is None or end_date is None:
-                cursor.execute("""
-                    SELECT product.name, product_variant.variant_name, SUM(sd.quantity) as total_quantity
-                    FROM sale_detail sd
-                    JOIN sale ON sale.id = sd.sale_id
-                    JOIN product ON product.id = sd.product_id
-                    LEFT JOIN product_variant ON product_variant.id = sd.variant_id
-                    WHERE product.active = 1
-                    GROUP BY sd.product_id, sd.variant_id
-                    ORDER BY total_quantity DESC
-                    LIMIT 5
-                """)
-            else:
-                cursor.execute("""
-                    SELECT product.name, product_variant.variant_name, SUM(sd.quantity) as total_quantity
-                    FROM sale_detail sd
-                    JOIN sale s ON s.id = sd.sale_id
-                    JOIN product ON product.id = sd.product_id
-                    LEFT JOIN product_variant ON product_variant.id = sd.variant_id
-                    WHERE s.date BETWEEN ? AND ?
-                    AND product.active = 1
-                    GROUP BY sd.product_id, sd.variant_id
-                    ORDER BY total_quantity DESC
-                    LIMIT 5
-                """, (start_date, end_date))
+            cursor.execute(f"""
+                SELECT product.name, product_variant.variant_name, SUM(r.quantity) as total_quantity
+                FROM sale_daily r
+                JOIN product ON product.id = r.product_id
+                LEFT JOIN product_variant ON product_variant.id = r.variant_id
+                WHERE {' AND '.join(conditions)}
+                GROUP BY r.product_id, r.variant_id
+                ORDER BY total_quantity DESC
+                LIMIT 5
+            """, params)
             top_products = cursor.fetchall()
 
         return [(row[0], row[1], row[2]) for row in top_products] # product_name, variant_name, quantity
@@ -242,34 +328,28 @@ class Sale:
     def get_sales_by_categories(start_date, end_date):
         """
         Get the total sales amount by category within a date range or all categories if no date range is provided.
+        Reads the daily rollups.
         :param start_date: Date to start filtering sales from. If None, all categories are considered.
         :param end_date: Date to end filtering sales at. If None, all categories are considered.
         :return: Dictionary with category ID as key and a dictionary with category name and total sales amount as value.
         """
+        conditions, params = rollup.date_filter(start_date, end_date, column="r.day")
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
         with get_connection() as conn:
             cursor = conn.cursor()
-
-            if start_date is None or end_date is None:
-                cursor.exceute("SELECT c.id AS category_id, c.name AS category_name, SUM(sd.quantity * sd.unit_price) AS total "
-                       "FROM sale_detail sd "
-                       "JOIN product p ON sd.product_id = p.id "
-                       "JOIN category c ON p.category_id = c.id "
-                       "GROUP BY c.name ORDER BY total DESC")
-            else:
-                cursor.execute("""
-                    SELECT c.id AS category_id, c.name AS category_name, SUM(sd.quantity * sd.unit_price) AS total
-                    FROM sale_detail sd
-                    JOIN product p ON sd.product_id = p.id
-                    JOIN category c ON p.category_id = c.id
-                    JOIN sale s ON s.id = sd.sale_id
-                    WHERE s.date BETWEEN ? AND ?
-                    GROUP BY c.name ORDER BY total DESC, c.name
-                """, (start_date, end_date))
+            cursor.execute(f"""
+                SELECT c.id AS category_id, c.name AS category_name, SUM(r.amount) AS total
+                FROM sale_daily r
+                JOIN product p ON r.product_id = p.id
+                JOIN category c ON p.category_id = c.id
+                {where}
+                GROUP BY c.id ORDER BY total DESC, c.name
+            """, params)
 
             results = cursor.fetchall()
             categories = {}
             for row in results:
-                category_id = row[0],
+                category_id = row[0]
                 category_name = row[1]
                 total = row[2]
                 categories[category_id] = ({
@@ -0,0 +1,19 @@
+"""
+Helpers for the full-text search tables (product_fts, client_fts, supplier_fts, see migration 6).
+"""
+import re
+
+# Words of the text typed by the user. Everything else (quotes, operators of FTS5) is dropped
+_WORDS = re.compile(r"\w+", re.UNICODE)
+
+
+def match_query(text):
+    """
+    Turns the text typed by the user into an FTS5 query where every word must appear, as a prefix of a word:
+    "yerba sua" finds "Yerba Suave". Accents and case are ignored by the tokenizer of the tables.
+    :return: The query, or None if the text has no words.
+    """
+    words = _WORDS.findall(text or "")
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
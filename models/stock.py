@@ -2,105 +2,111 @@ from db.db import get_connection
 from datetime import datetime
 
 from models.product import Product
+from models.product_variant import InsufficientStockError
 
-def save_transaction(product_id, quantity, type, variant_id=None,date = datetime.now().strftime('%d-%m-%Y'), sale_id=None, purchase_id=None, conn=None):
-    """
-    Registers a stock transaction in the database and updates the stock of the product.
-    :param product_id: The ID of the product.
-    :param quantity: Amount of stock to add or remove.
-    :param type: "in" for adding stock, "out" for removing stock.
-    :param variant_id: The ID of the product variant. Can be None if the product does not have variants.
-    :param date: Date of the transaction in "dd-mm-yyyy" format.
-    :param sale_id: ID of the sale associated with the transaction. If None, the transaction is not linked to a sale.
-    :param purchase_id: ID of the purchase associated with the transaction. If None, the transaction is not linked to a purchase.
-    :param conn: Connection to the database. If None, a new connection will be created.
-    :return: None
-    """
-    if type not in ["in", "out"]:
-        raise ValueError("Tipo de movimiento debe ser 'in' o 'out'")
-
-    # Update stock of the product
-    if type == "in":
-        Product.edit_stock(product_id=product_id, variant_id=variant_id, quantity=quantity, type="in", conn=conn)
-    else:
-        Product.edit_stock(product_id=product_id, variant_id=variant_id, quantity=quantity, type="out", conn=conn)
-
-    # Register the transaction in the database
-    if conn is None:
-        conn = get_connection()
-        conn.isolation_level = 'EXCLUSIVE'
-    with conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO transaction_stock (product_id, variant_id, date, type, quantity, sale_id, purchase_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (product_id, variant_id, datetime.strptime(date, "%d-%m-%Y").strftime("%Y-%m-%d"), type, quantity, sale_id, purchase_id))
+# Stock movement and foreign key of the transactions of each kind of document
+DETAIL_KINDS = {"sale": ("out", "sale_id"), "purchase": ("in", "purchase_id")}
 
 
-def update_transaction(product_id, variant_id, new_q, type, sale_id=None, purchase_id=None, conn=None):
+def apply_stock_deltas(deltas, conn):
     """
-    Updates a stock transaction in the database and adjusts the stock of the product accordingly.
-    :param product_id: ID of the product.
-    :param variant_id: ID of the product variant. Can be None if the product does not have variants.
-    :param new_q: New quantity to set for the transaction.
-    :param type: "in" for adding stock, "out" for removing stock.
-    :param sale_id: ID of the sale associated with the transaction. If None, the transaction is not linked to a sale.
-    :param purchase_id:  ID of the purchase associated with the transaction. If None, the transaction is not linked to a purchase.
-    :param conn: Connection to the database. If None, a new connection will be created.
-    :return: None
+    Applies many stock changes with one batched UPDATE per table. A product or variant can't go below 0:
+    if any line doesn't have enough stock, nothing is changed and InsufficientStockError is raised with every
+    insufficient line in its shortages.
+    The stock of a product with variants moves by the sum of the changes of its variants.
+    :param deltas: Dictionary with (product_id, variant_id) as key and the change of stock as value (negative to take out).
+    :param conn: Connection with the transaction of the change.
     """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    variant_rows = [(delta, variant_id, delta, delta) for (product_id, variant_id), delta in deltas.items() if variant_id]
+    product_rows = [(delta, product_id, delta, delta) for (product_id, variant_id), delta in deltas.items() if not variant_id]
+    parents = {}
+    for (product_id, variant_id), delta in deltas.items():
+        if variant_id:
+            parents[product_id] = parents.get(product_id, 0) + delta
+
     with conn:
         cursor = conn.cursor()
-        # Get the old amount
-        cursor.execute("SELECT quantity FROM transaction_stock "
-                       "WHERE product_id = ? "
-                       "AND (variant_id = ? OR variant_id IS NULL)"
-                       "AND (sale_id = ? OR sale_id IS NULL) "
-                       "AND (purchase_id = ? OR purchase_id IS NULL) "
-                       "AND type = ?", (product_id, variant_id, sale_id, purchase_id, type))
-        old_amount = cursor.fetchone()
-
-        # Update the transaction
-        cursor.execute("UPDATE transaction_stock SET quantity = ? "
-                       "WHERE product_id = ? "
-                       "AND (variant_id = ? OR variant_id IS NULL) "
-                       "AND (sale_id = ? OR sale_id IS NULL)"
-                       "AND (purchase_id = ? OR purchase_id IS NULL)"
-                       "AND type = ?", (new_q, product_id, variant_id, sale_id, purchase_id, type))
-
-        # If it was a sale
-        if sale_id:
-            if old_amount[0] > new_q: # Somebody returned
-                Product.edit_stock(product_id=product_id, variant_id=variant_id, quantity=old_amount[0] - new_q, type="int", conn=conn)
-            else: # Sold more
-                Product.edit_stock(product_id=product_id, variant_id=variant_id, quantity=new_q - old_amount[0], type="out", conn=conn)
-        # If it was a purchase
-        elif purchase_id:
-            if old_amount[0] > new_q: # I returned some, I got less
-                Product.edit_stock(product_id=product_id, variant_id=variant_id, quantity=old_amount[0] - new_q, type="out", conn=conn)
-            else: # I bought more of the same
-                Product.edit_stock(product_id=product_id, variant_id=variant_id, quantity=new_q - old_amount[0], type="in", conn=conn)
-
-
-def delete_transaction(product_id, variant_id, quantity, type, sale_id=None, purchase_id=None, conn=None):
+        cursor.execute("SAVEPOINT stock_deltas")
+        # Increases always apply, decreases only if there is enough stock
+        cursor.executemany("UPDATE product_variant SET stock = stock + ? WHERE id = ? AND (? >= 0 OR stock + ? >= 0)", variant_rows)
+        changed = cursor.rowcount
+        cursor.executemany("UPDATE product SET stock = stock + ? WHERE id = ? AND (? >= 0 OR stock + ? >= 0)", product_rows)
+        changed += cursor.rowcount
+
+        if changed < len(variant_rows) + len(product_rows):
+            # Some line wasn't applied: undo the others and report every line without enough stock
+            cursor.execute("ROLLBACK TO stock_deltas")
+            cursor.execute("RELEASE stock_deltas")
+            shortages = Product.find_shortages({key: max(-delta, 0) for key, delta in deltas.items()}, conn=conn)
+            for shortage in shortages:
+                if shortage["stock"] is None:
+                    raise ValueError("Variante no encontrada" if shortage["variant_id"] else "Producto no encontrado")
+            first = shortages[0]
+            raise InsufficientStockError(f"No hay suficiente stock. Stock actual: {first['stock']}, cantidad requerida: {first['quantity']}.",
+                                         product_id=first["product_id"], variant_id=first["variant_id"],
+                                         quantity=first["quantity"], shortages=shortages)
+
+        cursor.executemany("UPDATE product SET stock = stock + ? WHERE id = ?", [(delta, product_id) for product_id, delta in parents.items()])
+        cursor.execute("RELEASE stock_deltas")
+
+
+def save_details(kind, record_id, items, date, conn):
     """
-    Deletes a stock transaction from the database and adjusts the stock of the product accordingly.
-    :param product_id: ID of the product.
-    :param variant_id: ID of the product variant. Can be None if the product does not have variants.
-    :param quantity: Amount of the transaction to delete.
-    :param type: "in" if it was a purchase, "out" if it was a sale.
-    :param sale_id: ID of the sale associated with the transaction. If None, the transaction is not linked to a sale.
-    :param purchase_id: ID of the purchase associated with the transaction. If None, the transaction is not linked to a purchase.
-    :param conn: Connection to the database. If None, a new connection will be created.
-    :return: None
+    Saves the details of a sale or purchase in bulk: compares them once with the saved ones, writes the detail and
+    stock transaction rows with executemany and applies every stock change with apply_stock_deltas.
+    :param kind: "sale" or "purchase".
+    :param record_id: ID of the sale/purchase.
+    :param items: Dictionary with (product_id, variant_id) as key and a dictionary with quantity and unit_price as value.
+    :param date: Date of the sale/purchase in ISO format, used for the stock transactions.
+    :param conn: Connection with the transaction of the sale/purchase.
     """
+    if kind not in DETAIL_KINDS:
+        raise ValueError("Tipo debe ser 'sale' o 'purchase'")
+    type, fk = DETAIL_KINDS[kind]
+    sign = -1 if type == "out" else 1  # Direction of the stock change when the quantity grows
+
     with conn:
         cursor = conn.cursor()
-        if type == "in": # Deleted a purchase, stock decreases
-            Product.edit_stock(product_id=product_id, variant_id=variant_id, quantity=quantity, type="out", conn=conn)
-        else: # Deleted a sale, stock increases
-            Product.edit_stock(product_id=product_id, variant_id=variant_id, quantity=quantity, type="in", conn=conn)
-        cursor.execute("DELETE FROM transaction_stock WHERE product_id = ? AND variant_id = ? AND sale_id = ? AND purchase_id = ?", (product_id, variant_id, sale_id, purchase_id))
+
+        # Get old details
+        cursor.execute(f"SELECT product_id, variant_id, quantity, unit_price FROM {kind}_detail WHERE {fk} = ?", (record_id,))
+        old = {(row[0], row[1]): (row[2], row[3]) for row in cursor.fetchall()}
+
+        removed = [key for key in old if key not in items]
+        added = [key for key in items if key not in old]
+        changed = [key for key in items if key in old
+                   and (items[key]["quantity"], items[key]["unit_price"]) != old[key]]
+
+        deltas = {}
+        for key in removed:
+            deltas[key] = -sign * old[key][0]
+        for key in added:
+            deltas[key] = sign * items[key]["quantity"]
+        for key in changed:
+            deltas[key] = sign * (items[key]["quantity"] - old[key][0])
+
+        # Details. variant_id is NULL for products without variants, so compare it with IS
+        cursor.executemany(f"DELETE FROM {kind}_detail WHERE {fk} = ? AND product_id = ? AND variant_id IS ?",
+                           [(record_id, p, v) for p, v in removed])
+        cursor.executemany(f"INSERT INTO {kind}_detail ({fk}, product_id, variant_id, quantity, unit_price) VALUES (?, ?, ?, ?, ?)",
+                           [(record_id, p, v, items[(p, v)]["quantity"], items[(p, v)]["unit_price"]) for p, v in added])
+        cursor.executemany(f"UPDATE {kind}_detail SET quantity = ?, unit_price = ? WHERE {fk} = ? AND product_id = ? AND variant_id IS ?",
+                           [(items[(p, v)]["quantity"], items[(p, v)]["unit_price"], record_id, p, v) for p, v in changed])
+
+        # Stock transactions
+        cursor.executemany(f"DELETE FROM transaction_stock WHERE {fk} = ? AND product_id = ? AND variant_id IS ?",
+                           [(record_id, p, v) for p, v in removed])
+        cursor.executemany(f"INSERT INTO transaction_stock (product_id, variant_id, date, type, quantity, {fk}) VALUES (?, ?, ?, ?, ?, ?)",
+                           [(p, v, date, type, items[(p, v)]["quantity"], record_id) for p, v in added])
+        cursor.executemany(f"UPDATE transaction_stock SET quantity = ? WHERE {fk} = ? AND product_id = ? AND variant_id IS ?",
+                           [(items[(p, v)]["quantity"], record_id, p, v) for p, v in changed if items[(p, v)]["quantity"] != old[(p, v)][0]])
+
+        apply_stock_deltas(deltas, conn)
+
 
 def get_all(start_date, end_date, type='all'):
     """
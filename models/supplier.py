@@ -1,4 +1,5 @@
 from db.db import get_connection
+from models.search import match_query
 
 class Supplier:
     def __init__(self, name, surname, phone=None, mail=None, id=None):
@@ -48,6 +49,8 @@ class Supplier:
         Delete a supplier from the database by its id.
         """
         with get_connection() as conn:
+            # Keep the supplier's purchases, detached from the deleted supplier
+            conn.execute("UPDATE purchase SET supplier_id=NULL WHERE supplier_id=?", (supplier_id,))
             conn.execute("DELETE FROM supplier WHERE id=?", (supplier_id,))
 
     @staticmethod
@@ -61,4 +64,27 @@ class Supplier:
             fila = cur.fetchone()
             if fila:
                 return {'id': fila[0], 'name': fila[1], 'surname': fila[2], 'phone': fila[3], 'mail': fila[4]}
-            return None
\ No newline at end of file
+            return None
+
+    @staticmethod
+    def search(text, limit=50):
+        """
+        Full-text search of suppliers by name, surname, phone and mail, ignoring accents. Every word of the text
+        must start a word of the supplier. The best matches come first.
+        :param text: Text typed by the user.
+        :param limit: Maximum number of suppliers to return.
+        :return: List of dictionaries like get_all.
+        """
+        query = match_query(text)
+        if query is None:
+            return []
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT supplier.id, supplier.name, supplier.surname, supplier.phone, supplier.mail
+                FROM supplier_fts JOIN supplier ON supplier.id = supplier_fts.rowid
+                WHERE supplier_fts MATCH ?
+                ORDER BY bm25(supplier_fts, 10.0, 8.0, 2.0, 2.0)
+                LIMIT ?
+            """, (query, limit))
+            return [{"name": fila[1], "surname": fila[2], "phone": fila[3], "mail": fila[4], "id": fila[0]} for fila in cur.fetchall()]
@@ -1,5 +1,6 @@
 from models.client import Client
 from models.supplier import Supplier
+from services.cache import cached, invalidates
 
 class AgendaService:
     # ----------- CLIENTS -----------
@@ -8,6 +9,7 @@ class AgendaService:
         return Client.get_all()
 
     @staticmethod
+    @invalidates("clients")
     def add_client(name, surname="", phone="", mail=""):
         if not name.strip():
             raise ValueError("Client name cannot be empty.")
@@ -16,6 +18,7 @@ class AgendaService:
         return client
 
     @staticmethod
+    @invalidates("clients")
     def update_client(id, name, surname="", phone="", mail=""):
         if not name.strip():
             raise ValueError("Client name cannot be empty.")
@@ -24,6 +27,7 @@ class AgendaService:
         return client
 
     @staticmethod
+    @invalidates("clients")
     def delete_client(client_id):
         Client.delete(client_id)
 
@@ -31,7 +35,12 @@ class AgendaService:
     def get_client_by_id(client_id):
         if not client_id or client_id < 0:
             return None
-        return Client.get_by_id(client_id)
+        return cached("clients", client_id, lambda: Client.get_by_id(client_id))
+
+    @staticmethod
+    def search_clients(text, limit=50):
+        """Returns the clients that best match the text (name, surname, phone or mail)."""
+        return Client.search(text, limit=limit)
 
     # ----------- SUPPLIERS -----------
     @staticmethod
@@ -39,6 +48,7 @@ class AgendaService:
         return Supplier.get_all()
 
     @staticmethod
+    @invalidates("suppliers")
     def add_supplier(name, surname="", phone="", mail=""):
         if not name.strip():
             raise ValueError("Supplier name cannot be empty.")
@@ -47,6 +57,7 @@ class AgendaService:
         return supplier
 
     @staticmethod
+    @invalidates("suppliers")
     def update_supplier(id, name, surname="", phone="", mail=""):
         if not name.strip():
             raise ValueError("Supplier name cannot be empty.")
@@ -55,6 +66,7 @@ class AgendaService:
         return supplier
 
     @staticmethod
+    @invalidates("suppliers")
     def delete_supplier(supplier_id):
         Supplier.delete(supplier_id)
 
@@ -62,5 +74,9 @@ class AgendaService:
     def get_supplier_by_id(id):
         if not id or id < 0:
             return None
-        return Supplier.get_by_id(id)
+        return cached("suppliers", id, lambda: Supplier.get_by_id(id))
 
+    @staticmethod
+    def search_suppliers(text, limit=50):
+        """Returns the suppliers that best match the text (name, surname, phone or mail)."""
+        return Supplier.search(text, limit=limit)
@@ -0,0 +1,123 @@
+"""
+In-memory cache of the entities the UI looks up one by one (products, variants, categories, clients, suppliers).
+Each group of entities has a generation counter. Every service that writes to a group bumps its generation
+(see invalidates), which drops what was cached, so a lookup never returns data older than the last write made
+through the services. Restoring a backup clears every group.
+Lookups return copies, because the dialogs change the dictionaries they receive.
+"""
+import copy
+import functools
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class EntityCache:
+    """
+    LRU cache of one group of entities, safe to use from the loader threads.
+    :param name: Name of the group, used in the statistics.
+    :param maxsize: Maximum number of entries. The least recently used one is dropped first.
+    """
+    def __init__(self, name, maxsize=512):
+        self.name = name
+        self.maxsize = maxsize
+        self.generation = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, load):
+        """
+        Returns a copy of the cached value of key, calling load() to read it from the database if it isn't cached.
+        A value read while a write bumped the generation is returned but not kept, since it may be stale.
+        """
+        with self.lock:
+            value = self.entries.get(key, _MISSING)
+            if value is not _MISSING:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(value)
+            self.misses += 1
+            generation = self.generation
+
+        value = load()  # Outside the lock, so other threads are not blocked by the query
+
+        with self.lock:
+            if generation == self.generation:
+                self.entries[key] = value
+                self.entries.move_to_end(key)
+                if len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+                    self.evictions += 1
+        return copy.deepcopy(value)
+
+    def bump(self):
+        """Marks every cached value as stale. Call it after writing to the entities of this group."""
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"size": len(self.entries), "maxsize": self.maxsize, "generation": self.generation,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "hit_rate": self.hits / lookups if lookups else 0.0}
+
+    def reset_stats(self):
+        with self.lock:
+            self.hits = self.misses = self.evictions = 0
+
+
+# Products, variants and categories are one group: a sale changes the stock of products and variants,
+# and renaming a category changes the products that show it
+CACHES = {
+    "catalog": EntityCache("catalog", maxsize=1024),
+    "clients": EntityCache("clients", maxsize=512),
+    "suppliers": EntityCache("suppliers", maxsize=512),
+}
+
+
+def cached(group, key, load):
+    """Returns a copy of the entity with key in the group, reading it with load() if it is not cached."""
+    return CACHES[group].get(key, load)
+
+
+def bump(*groups):
+    """Invalidates the given groups."""
+    for group in groups:
+        CACHES[group].bump()
+
+
+def clear_all():
+    """Invalidates every group. Call it when the database file is replaced, for example after restoring a backup."""
+    bump(*CACHES)
+
+
+def invalidates(*groups):
+    """
+    Decorator for the service methods that write: bumps the groups once the method ends, even if it fails
+    halfway, since part of the write may have been done.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            try:
+                return function(*args, **kwargs)
+            finally:
+                bump(*groups)
+        return wrapper
+    return decorator
+
+
+def get_stats():
+    """Returns the hits, misses, evictions, size and generation of each group."""
+    return {name: cache.stats() for name, cache in CACHES.items()}
+
+
+def reset_stats():
+    for cache in CACHES.values():
+        cache.reset_stats()
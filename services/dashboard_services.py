@@ -0,0 +1,17 @@
+from datetime import datetime
+
+from models.dashboard import Dashboard
+
+
+class DashboardService:
+    @staticmethod
+    def get_dashboard(start_date=None, end_date=None, latest=5, low_stock_limit=5):
+        """
+        Get every number and list of the home page in one call.
+        Dates in "dd-mm-yyyy" format. If no dates are provided, all the history is considered.
+        :return: Dictionary with sales_total, sales_count, purchases_total, purchases_count, latest_sales,
+        latest_purchases, top5, sales_by_category, low_stock_count and low_stock.
+        """
+        if start_date: start_date = datetime.strptime(start_date, "%d-%m-%Y").strftime("%Y-%m-%d")
+        if end_date: end_date = datetime.strptime(end_date, "%d-%m-%Y").strftime("%Y-%m-%d")
+        return Dashboard.get(start_date, end_date, latest=latest, low_stock_limit=low_stock_limit)
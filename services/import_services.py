@@ -0,0 +1,226 @@
+import csv
+import os
+import re
+import time
+import unicodedata
+
+from db.db import transaction
+from models.catalog_import import CatalogWriter
+from models.units import UNITS
+from services.cache import invalidates
+from services.stock_alerts import dispatches_alerts
+
+# Product fields and the column headers accepted for each one (compared without accents, case or spaces)
+COLUMN_ALIASES = {
+    "name": ["nombre", "producto", "name", "product"],
+    "variant_name": ["variante", "variant", "variant_name"],
+    "category": ["categoria", "category", "rubro"],
+    "unit": ["unidad", "unit"],
+    "price": ["precio", "price"],
+    "stock": ["stock", "cantidad"],
+    "stock_low": ["stockminimo", "stockbajo", "stock_low", "minimo"],
+}
+
+THOUSANDS = re.compile(r"-?\d{1,3}(\.\d{3})+")  # 12.000 or 1.500.000, dots as thousands separators
+
+
+def _normalize(text):
+    """Lowercase, without accents and spaces, to compare column headers."""
+    text = unicodedata.normalize("NFKD", str(text)).encode("ascii", "ignore").decode("ascii")
+    return text.lower().replace(" ", "").replace("_", "").replace("-", "")
+
+
+def _parse_number(value, integer=False):
+    """
+    Parses numbers written as 1234.5, 1234,5, 1.234,50, $ 1.500 or $ 1,234.50. Empty cells return None.
+    A dot followed by groups of three digits, as in 12.000, is a thousands separator, not a decimal one.
+    :raises ValueError: If the value is not a number.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value) if integer else float(value)
+    text = str(value).strip().replace("$", "").replace(" ", "")
+    if not text:
+        return None
+    if "," in text and "." in text:
+        # The last separator is the decimal one
+        if text.rfind(",") > text.rfind("."):
+            text = text.replace(".", "").replace(",", ".")
+        else:
+            text = text.replace(",", "")
+    elif "," in text:
+        text = text.replace(",", ".")
+    elif THOUSANDS.fullmatch(text):
+        text = text.replace(".", "")
+    number = float(text)
+    if integer:
+        if not number.is_integer():
+            raise ValueError(f"'{value}' no es un número entero")
+        return int(number)
+    return number
+
+
+def _read_csv(path):
+    """Yields the rows of a CSV file one by one. Detects ',' or ';' as separator."""
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        yield from csv.reader(f, dialect)
+
+
+def _read_xlsx(path):
+    """Yields the rows of the first sheet of an XLSX file one by one. Needs openpyxl."""
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError("Para importar archivos XLSX hay que instalar openpyxl. También se puede guardar el archivo como CSV.")
+    workbook = load_workbook(path, read_only=True, data_only=True)  # read_only streams the rows
+    try:
+        yield from workbook.worksheets[0].iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+class CatalogImportService:
+    BATCH_SIZE = 500
+
+    @staticmethod
+    def read_rows(path):
+        """Yields the rows of a CSV or XLSX file as lists of cells, without loading the whole file."""
+        extension = os.path.splitext(path)[1].lower()
+        if extension in (".xlsx", ".xlsm"):
+            return _read_xlsx(path)
+        if extension in (".csv", ".txt"):
+            return _read_csv(path)
+        raise ValueError(f"Formato no soportado: {extension}. Use CSV o XLSX.")
+
+    @staticmethod
+    def map_columns(header, columns=None):
+        """
+        Finds the position of each product field in the header row.
+        :param header: List with the cells of the header row.
+        :param columns: Optional dictionary field -> header text, for headers not in COLUMN_ALIASES.
+        :return: Dictionary field -> index of the column.
+        :raises ValueError: If there is no column for the name or the category.
+        """
+        positions = {_normalize(cell): i for i, cell in enumerate(header) if cell is not None}
+        mapping = {}
+        for field, aliases in COLUMN_ALIASES.items():
+            names = [columns[field]] if columns and field in columns else aliases
+            for name in names:
+                if _normalize(name) in positions:
+                    mapping[field] = positions[_normalize(name)]
+                    break
+        missing = [field for field in ("name", "category") if field not in mapping]
+        if missing:
+            raise ValueError(f"Faltan columnas obligatorias: {', '.join(missing)}")
+        return mapping
+
+    @staticmethod
+    def parse_row(cells, mapping):
+        """
+        Turns the cells of a row into a product row.
+        :raises ValueError: With the message of the first invalid value.
+        """
+        def cell(field):
+            index = mapping.get(field)
+            if index is None or index >= len(cells):
+                return None
+            value = cells[index]
+            if isinstance(value, str):
+                value = value.strip()
+                return value or None
+            return value
+
+        name = cell("name")
+        category = cell("category")
+        if not name:
+            raise ValueError("Falta el nombre del producto")
+        if not category:
+            raise ValueError("Falta la categoría")
+
+        unit = cell("unit")
+        if unit is not None:
+            unit = str(unit).lower()
+            if unit not in UNITS:
+                raise ValueError(f"Unidad desconocida: {unit}")
+
+        row = {"name": str(name), "variant_name": cell("variant_name"), "category": str(category), "unit": unit}
+        if row["variant_name"] is not None:
+            row["variant_name"] = str(row["variant_name"])
+        for field, integer in (("price", False), ("stock", True), ("stock_low", True)):
+            try:
+                row[field] = _parse_number(cell(field), integer=integer)
+            except ValueError:
+                raise ValueError(f"Valor inválido en {field}: {cell(field)}")
+            if row[field] is not None and row[field] < 0:
+                raise ValueError(f"{field} no puede ser negativo")
+        return row
+
+    @staticmethod
+    @invalidates("catalog")
+    @dispatches_alerts
+    def import_file(path, columns=None, batch_size=None, progress=None):
+        """
+        Imports a catalog from a CSV or XLSX file. The first row must have the column headers.
+        Products are matched by name and variants by product and variant name: existing ones are updated and the
+        rest are created, as well as the missing categories. Rows are read and written in batches inside one
+        transaction, so the file is never fully in memory and a failure leaves the catalog as it was.
+        Invalid rows are skipped and reported.
+        :param path: Path of the file.
+        :param columns: Optional dictionary field -> header text (see COLUMN_ALIASES for the fields).
+        :param batch_size: Rows written per batch. At most 500.
+        :param progress: Optional function that receives the number of rows read after each batch.
+        :return: Dictionary with rows, imported, the counts of created/updated products and variants,
+        created_categories, errors (list of (line of the file, message)), seconds and rows_per_second.
+        """
+        batch_size = min(batch_size or CatalogImportService.BATCH_SIZE, CatalogImportService.BATCH_SIZE)
+        start = time.perf_counter()
+        rows = iter(CatalogImportService.read_rows(path))
+        header = next(rows, None)
+        if header is None:
+            raise ValueError("El archivo está vacío")
+        mapping = CatalogImportService.map_columns(header, columns)
+
+        errors = []
+        total = 0
+        imported = 0
+        with transaction(immediate=True) as conn:
+            writer = CatalogWriter(conn)
+
+            def flush(batch, lines):
+                nonlocal imported
+                failed = writer.write(batch)
+                errors.extend((lines[index], message) for index, message in failed)
+                imported += len(batch) - len(failed)
+                if progress:
+                    progress(total)
+
+            batch, lines = [], []
+            for line, cells in enumerate(rows, start=2):  # Line 1 is the header
+                if not any(c not in (None, "") for c in cells):
+                    continue  # Empty row
+                total += 1
+                try:
+                    batch.append(CatalogImportService.parse_row(cells, mapping))
+                    lines.append(line)
+                except ValueError as e:
+                    errors.append((line, str(e)))
+                if len(batch) >= batch_size:
+                    flush(batch, lines)
+                    batch, lines = [], []
+            if batch:
+                flush(batch, lines)
+
+        elapsed = time.perf_counter() - start
+        errors.sort()
+        result = dict(writer.stats, rows=total, imported=imported, errors=errors, seconds=elapsed,
+                      rows_per_second=total / elapsed if elapsed else 0)
+        print(f"Import of {os.path.basename(path)}: {imported}/{total} rows in {elapsed:.2f} s "
+              f"({result['rows_per_second']:.0f} rows/s), {len(errors)} errors")
+        return result
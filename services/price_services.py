@@ -0,0 +1,38 @@
+from datetime import datetime
+
+from models.price import Price
+from services.cache import invalidates
+
+
+class PriceService:
+    @staticmethod
+    def preview_update(mode, value, category_id=None, unit=None, name=None, round_to=None):
+        """
+        Returns the prices that update_prices would change, with the old and new price of each one.
+        See Price.preview for the parameters.
+        """
+        return Price.preview(mode, value, category_id=category_id, unit=unit, name=name or None, round_to=round_to)
+
+    @staticmethod
+    @invalidates("catalog")
+    def update_prices(mode, value, category_id=None, unit=None, name=None, round_to=None):
+        """
+        Changes by a percentage ("percent") or a fixed amount ("amount") the price of every active product and
+        variant that matches the filters, in one transaction.
+        :return: Dictionary with the number of products and variants changed.
+        """
+        return Price.bulk_update(mode, value, category_id=category_id, unit=unit, name=name or None, round_to=round_to)
+
+    @staticmethod
+    def get_price_history(product_id, variant_id=None):
+        """Returns the price changes of a product or variant, newest first."""
+        return Price.get_history(product_id, variant_id)
+
+    @staticmethod
+    def get_price_at(product_id, variant_id, date):
+        """
+        Returns the price a product or variant had at a date.
+        :param date: Date in dd-mm-yyyy format.
+        """
+        date = datetime.strptime(date, "%d-%m-%Y").strftime("%Y-%m-%d") # Convert the date to ISO format
+        return Price.get_price_at(product_id, variant_id, date)
@@ -1,10 +1,14 @@
 from models.category import Category
 from models.product import Product
 from models.product_variant import ProductVariant
+from services.cache import cached, invalidates
+from services.stock_alerts import dispatches_alerts
 
 
 class ProductService:
     @staticmethod
+    @invalidates("catalog")
+    @dispatches_alerts
     def create_product(data):
         """
         Creates a Product object and saves it to the database.
@@ -22,6 +26,8 @@ class ProductService:
         return product
 
     @staticmethod
+    @invalidates("catalog")
+    @dispatches_alerts
     def update_product(data):
         """
         Updates an existing Product using its id.
@@ -46,14 +52,30 @@ class ProductService:
         """
         return Product.get_all(active)
 
+    @staticmethod
+    def search_products(text, limit=50, active=1):
+        """
+        Returns the products that best match the text (name, variants or category), each with its variants.
+        """
+        return Product.search(text, limit=limit, active=active)
+
+    @staticmethod
+    def get_catalog_generation():
+        """
+        Returns the generation of the catalog, which changes on every write to products, variants or categories.
+        """
+        return Product.get_catalog_generation()
+
     @staticmethod
     def get_product_by_id(product_id):
         """
         Returns a single product by ID, including its variants.
         """
-        return Product.get_by_id(product_id)
+        return cached("catalog", ("product", product_id), lambda: Product.get_by_id(product_id))
 
     @staticmethod
+    @invalidates("catalog")
+    @dispatches_alerts
     def delete_product(product_id):
         """
         Deletes a product by ID (and its variants if needed).
@@ -73,8 +95,10 @@ class ProductService:
     @staticmethod
     def check_stock(items):
         """
-        Checks if the stock is sufficient for a list of items.
-        Expects a list of tuples (product_id, variant_id, quantity).
+        Checks if the stock is sufficient for every item, with one query per table.
+        Expects a dictionary with (product_id, variant_id) as keys and a dictionary with 'quantity' as value.
+        Returns (True if all have enough stock, list of every insufficient line). Saving a sale checks again
+        inside its transaction, this is for validating before saving.
         """
         return Product.check_stock(items)
 
@@ -85,7 +109,7 @@ class ProductService:
         """
         Returns a variant by its ID.
         """
-        return ProductVariant.get_variant_by_id(product_id, variant_id)
+        return cached("catalog", ("variant", product_id, variant_id), lambda: ProductVariant.get_variant_by_id(product_id, variant_id))
 
     # ----------- CATEGORY -----------
     @staticmethod
@@ -93,25 +117,29 @@ class ProductService:
         return Category.get_all()
 
     @staticmethod
+    @invalidates("catalog")
     def add_category(name):
         if not name.strip():
             raise ValueError("Category name cannot be empty.")
         return Category.add_category(name)
 
     @staticmethod
+    @invalidates("catalog")
     def delete_category_by_id(id):
         return Category.delete_by_id(id)
 
     @staticmethod
+    @invalidates("catalog")
     def rename_category(id, new_name):
         return Category.rename_category(id, new_name)
 
     @staticmethod
     def get_category_id_by_name(name):
-        return Category.get_id_by_name(name)
+        return cached("catalog", ("category", name), lambda: Category.get_id_by_name(name))
 
     @staticmethod
     def get_low_stock(q=0):
+        """Returns the products and variants with low stock, at most q of them (all if q is 0)."""
         return Product.get_low_stock(q)
 
 
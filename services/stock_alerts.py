@@ -0,0 +1,48 @@
+"""
+Low stock notifications. The database records when a product or variant goes down to its minimum stock (or back
+above it) in low_stock_event; the services that change stock call dispatch once they finish, which drains those
+events and hands them to the listeners registered by the UI.
+"""
+import functools
+
+from models import low_stock
+
+_listeners = []
+
+
+def add_listener(listener):
+    """
+    Registers a function that receives the list of new events (see models.low_stock.take_events).
+    It is called in the thread that made the change.
+    """
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+def remove_listener(listener):
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def dispatch():
+    """Drains the pending events and notifies the listeners. Returns the events."""
+    if not low_stock.has_events():
+        return []  # Most stock changes don't cross a minimum, so skip the write lock of take_events
+    events = low_stock.take_events()
+    if events:
+        for listener in list(_listeners):
+            try:
+                listener(events)
+            except Exception as e:
+                print(f"Error in low stock listener: {e}")
+    return events
+
+
+def dispatches_alerts(function):
+    """Decorator for the service methods that change stock: dispatches the low stock events after them."""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        result = function(*args, **kwargs)
+        dispatch()
+        return result
+    return wrapper
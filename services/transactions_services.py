@@ -2,14 +2,39 @@ from datetime import datetime
 
 from models.sale import Sale
 from models.purchase import Purchase
+from services.cache import invalidates
+from services.stock_alerts import dispatches_alerts
 
 class TransactionsService:
     # --------- SALES ----------
     @staticmethod
-    def get_all_sales(start_date=None, end_date=None):
+    def get_all_sales(start_date=None, end_date=None, with_items=True):
         if start_date: start_date = datetime.strptime(start_date, "%d-%m-%Y").strftime("%Y-%m-%d") # Convert the date to ISO format
         if end_date: end_date = datetime.strptime(end_date, "%d-%m-%Y").strftime("%Y-%m-%d")
-        return Sale.get_all(start_date, end_date)
+        return Sale.get_all(start_date, end_date, with_items)
+
+    @staticmethod
+    def query_sales(start_date=None, end_date=None, min_total=None, max_total=None, client_id=None,
+                    sort="date", descending=True, after=None, limit=100):
+        """
+        Get one page of sales filtered and sorted by the database.
+        Dates in "dd-mm-yyyy" format. Pass the returned cursor as `after` to get the next page.
+        :return: Tuple (list of sales, cursor for the next page or None).
+        """
+        if start_date: start_date = datetime.strptime(start_date, "%d-%m-%Y").strftime("%Y-%m-%d")
+        if end_date: end_date = datetime.strptime(end_date, "%d-%m-%Y").strftime("%Y-%m-%d")
+        return Sale.query(start_date=start_date, end_date=end_date, min_total=min_total, max_total=max_total,
+                          client_id=client_id, sort=sort, descending=descending, after=after, limit=limit)
+
+    @staticmethod
+    def count_sales(start_date=None, end_date=None, min_total=None, max_total=None, client_id=None):
+        """
+        Count the sales matching the filters. Dates in "dd-mm-yyyy" format.
+        :return: Tuple (number of sales, sum of their totals).
+        """
+        if start_date: start_date = datetime.strptime(start_date, "%d-%m-%Y").strftime("%Y-%m-%d")
+        if end_date: end_date = datetime.strptime(end_date, "%d-%m-%Y").strftime("%Y-%m-%d")
+        return Sale.count(start_date=start_date, end_date=end_date, min_total=min_total, max_total=max_total, client_id=client_id)
 
     @staticmethod
     def get_sale_by_id(sale_id):
@@ -18,12 +43,16 @@ class TransactionsService:
         return Sale.get_by_id(sale_id)
 
     @staticmethod
+    @invalidates("catalog")
+    @dispatches_alerts
     def save_sale(sale_id, items, client_id, date):
         date = datetime.strptime(date, "%d-%m-%Y").strftime("%Y-%m-%d") # Convert the date to ISO format
         sale = Sale(id=sale_id, items=items, client_id=client_id, date=date)
         return sale.save()
 
     @staticmethod
+    @invalidates("catalog")
+    @dispatches_alerts
     def delete_sale(sale_id):
         if not sale_id or sale_id < 0:
             raise ValueError("Invalid sale ID")
@@ -51,10 +80,33 @@ class TransactionsService:
 
     # --------- PURCHASES ----------
     @staticmethod
-    def get_all_purchases(start_date=None, end_date=None):
+    def get_all_purchases(start_date=None, end_date=None, with_items=True):
+        if start_date: start_date = datetime.strptime(start_date, "%d-%m-%Y").strftime("%Y-%m-%d")
+        if end_date: end_date = datetime.strptime(end_date, "%d-%m-%Y").strftime("%Y-%m-%d")
+        return Purchase.get_all(start_date, end_date, with_items)
+
+    @staticmethod
+    def query_purchases(start_date=None, end_date=None, min_total=None, max_total=None, supplier_id=None,
+                        sort="date", descending=True, after=None, limit=100):
+        """
+        Get one page of purchases filtered and sorted by the database.
+        Dates in "dd-mm-yyyy" format. Pass the returned cursor as `after` to get the next page.
+        :return: Tuple (list of purchases, cursor for the next page or None).
+        """
+        if start_date: start_date = datetime.strptime(start_date, "%d-%m-%Y").strftime("%Y-%m-%d")
+        if end_date: end_date = datetime.strptime(end_date, "%d-%m-%Y").strftime("%Y-%m-%d")
+        return Purchase.query(start_date=start_date, end_date=end_date, min_total=min_total, max_total=max_total,
+                              supplier_id=supplier_id, sort=sort, descending=descending, after=after, limit=limit)
+
+    @staticmethod
+    def count_purchases(start_date=None, end_date=None, min_total=None, max_total=None, supplier_id=None):
+        """
+        Count the purchases matching the filters. Dates in "dd-mm-yyyy" format.
+        :return: Tuple (number of purchases, sum of their totals).
+        """
         if start_date: start_date = datetime.strptime(start_date, "%d-%m-%Y").strftime("%Y-%m-%d")
         if end_date: end_date = datetime.strptime(end_date, "%d-%m-%Y").strftime("%Y-%m-%d")
-        return Purchase.get_all(start_date, end_date)
+        return Purchase.count(start_date=start_date, end_date=end_date, min_total=min_total, max_total=max_total, supplier_id=supplier_id)
 
     @staticmethod
     def get_purchase_by_id(purchase_id):
@@ -63,12 +115,16 @@ class TransactionsService:
         return Purchase.get_by_id(purchase_id)
 
     @staticmethod
+    @invalidates("catalog")
+    @dispatches_alerts
     def save_purchase(purchase_id, items, supplier_id, date):
         date = datetime.strptime(date, "%d-%m-%Y").strftime("%Y-%m-%d") # Convert the date to ISO format
         purchase = Purchase(id=purchase_id, items=items, supplier_id=supplier_id, date=date)
         return purchase.save()
 
     @staticmethod
+    @invalidates("catalog")
+    @dispatches_alerts
     def delete_purchase(purchase_id):
         if not purchase_id or purchase_id < 0:
             raise ValueError("Invalid sale ID")
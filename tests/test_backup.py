@@ -0,0 +1,120 @@
+"""Checks a backup has to pass before it replaces the database (see utils.backup.verify_backup)."""
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from db.db import checkpoint, close_all, get_connection, initialize_db
+from db.migrations import LATEST_VERSION
+
+try:
+    from utils import backup
+    from utils.chunk_store import file_sha256
+except ImportError:  # PyDrive, see requirements.txt
+    backup = None
+
+
+@unittest.skipIf(backup is None, "utils.backup needs PyDrive")
+class VerifyBackupTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.appdata = os.environ.get("APPDATA")
+        os.environ["APPDATA"] = self.folder
+        close_all()
+        initialize_db()
+        with get_connection() as conn:
+            conn.execute("INSERT INTO client (name, surname) VALUES ('Ana', 'López')")
+        checkpoint()
+        self.copy = os.path.join(self.folder, "copy.db")
+        shutil.copyfile(backup.get_writable_db_path(), self.copy)
+
+    def tearDown(self):
+        close_all()
+        if self.appdata is None:
+            os.environ.pop("APPDATA", None)
+        else:
+            os.environ["APPDATA"] = self.appdata
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def database(self, sql, version=0):
+        path = os.path.join(self.folder, "other.db")
+        conn = sqlite3.connect(path)
+        conn.executescript(sql)
+        conn.execute(f"PRAGMA user_version = {version}")
+        conn.commit()
+        conn.close()
+        return path
+
+    def test_valid_backup_passes(self):
+        self.assertEqual(backup.verify_backup(self.copy, file_sha256(self.copy), LATEST_VERSION), LATEST_VERSION)
+
+    def test_checksum_mismatch_is_rejected(self):
+        with self.assertRaisesRegex(ValueError, "checksum"):
+            backup.verify_backup(self.copy, "0" * 64)
+
+    def test_garbage_is_rejected(self):
+        with open(self.copy, "wb") as file:
+            file.write(os.urandom(8192))
+        with self.assertRaises(ValueError):
+            backup.verify_backup(self.copy)
+
+    def test_truncated_file_is_rejected(self):
+        with open(self.copy, "r+b") as file:
+            file.truncate(os.path.getsize(self.copy) // 2)
+        with self.assertRaises(ValueError):
+            backup.verify_backup(self.copy)
+
+    def test_schema_version_must_match_the_recorded_one(self):
+        with self.assertRaisesRegex(ValueError, "schema version"):
+            backup.verify_backup(self.copy, expected_version=LATEST_VERSION - 1)
+
+    def test_newer_schema_is_rejected(self):
+        path = self.database("CREATE TABLE category (id INTEGER)", version=LATEST_VERSION + 1)
+        with self.assertRaisesRegex(ValueError, "newer version"):
+            backup.verify_backup(path)
+
+    def test_foreign_database_is_rejected(self):
+        path = self.database("CREATE TABLE notes (text TEXT)")
+        with self.assertRaisesRegex(ValueError, "not a LaChapita database"):
+            backup.verify_backup(path)
+
+    def test_old_backup_is_migrated(self):
+        path = os.path.join(self.folder, "old.db")
+        conn = sqlite3.connect(path)
+        with open(os.path.join(os.path.dirname(os.path.dirname(__file__)), "db", "schema.sql"), encoding="utf-8") as f:
+            conn.executescript(f.read())
+        conn.close()
+
+        self.assertEqual(backup.verify_backup(path), 0)
+        conn = sqlite3.connect(path)
+        self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0], LATEST_VERSION)
+        conn.close()
+
+    def test_rejected_restore_keeps_the_database(self):
+        def fetch(path):
+            with open(path, "wb") as file:
+                file.write(b"not a database" * 100)
+
+        ok, message = backup.restore_file("broken", fetch)
+
+        self.assertFalse(ok)
+        self.assertEqual(get_connection().execute("SELECT COUNT(*) FROM client").fetchone()[0], 1)
+        self.assertFalse(os.path.exists(backup.get_writable_db_path() + backup.PART_SUFFIX))
+
+    def test_restore_replaces_the_database(self):
+        with get_connection() as conn:
+            conn.execute("INSERT INTO client (name, surname) VALUES ('Juan', 'Pérez')")
+
+        def fetch(path):
+            shutil.copyfile(self.copy, path)
+            return {"sha256": file_sha256(self.copy), "schema_version": LATEST_VERSION}
+
+        ok, message = backup.restore_file("copy", fetch)
+
+        self.assertTrue(ok, message)
+        self.assertEqual(get_connection().execute("SELECT COUNT(*) FROM client").fetchone()[0], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+"""Content-addressed backup store: deduplication, garbage collection and checks on restore."""
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from utils.chunk_store import CHUNK_SIZE, ChunkStore, file_sha256
+
+
+class ChunkStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.store = ChunkStore(os.path.join(self.folder, "store"))
+        self.source = os.path.join(self.folder, "source.db")
+        self.target = os.path.join(self.folder, "restored.db")
+        self.data = os.urandom(4 * CHUNK_SIZE + 123)
+        self.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def write(self, data):
+        with open(self.source, "wb") as file:
+            file.write(data)
+
+    def read(self, path):
+        with open(path, "rb") as file:
+            return file.read()
+
+    def test_restore_gives_back_the_same_file(self):
+        stats = self.store.put(self.source, "a")
+        self.assertEqual((stats["chunks"], stats["new_chunks"], stats["size"]), (5, 5, len(self.data)))
+
+        manifest = self.store.restore("a", self.target)
+        self.assertEqual(self.read(self.target), self.data)
+        self.assertEqual(manifest["sha256"], file_sha256(self.source))
+
+    def test_unchanged_chunks_are_stored_once(self):
+        self.store.put(self.source, "a")
+        changed = bytearray(self.data)
+        changed[CHUNK_SIZE + 10] ^= 0xFF  # Only the second chunk changes
+        self.write(bytes(changed))
+
+        stats = self.store.put(self.source, "b")
+
+        self.assertEqual(stats["new_chunks"], 1)
+        self.assertEqual(self.store.get_stats()["chunks"], 6)
+        self.assertEqual(self.store.list(), ["b", "a"])
+        self.store.restore("b", self.target)
+        self.assertEqual(self.read(self.target), bytes(changed))
+
+    def test_collect_garbage_keeps_only_referenced_chunks(self):
+        self.store.put(self.source, "a")
+        self.write(os.urandom(2 * CHUNK_SIZE))
+        self.store.put(self.source, "b")
+
+        self.store.delete("a")
+        deleted, freed = self.store.collect_garbage()
+
+        self.assertEqual(deleted, 5)
+        self.assertGreater(freed, 0)
+        self.assertEqual(self.store.get_stats()["chunks"], 2)
+        self.store.restore("b", self.target)  # Still complete
+
+    def test_missing_chunk_is_rejected(self):
+        self.store.put(self.source, "a")
+        os.remove(self.store.chunk_path(self.store.get_manifest("a")["chunks"][2]))
+
+        with self.assertRaisesRegex(ValueError, "missing chunk"):
+            self.store.restore("a", self.target)
+
+    def test_corrupt_chunk_is_rejected(self):
+        self.store.put(self.source, "a")
+        path = self.store.chunk_path(self.store.get_manifest("a")["chunks"][1])
+        with open(path, "r+b") as file:
+            file.seek(5)
+            file.write(b"garbage")
+
+        with self.assertRaisesRegex(ValueError, "corrupt chunk"):
+            self.store.restore("a", self.target)
+
+    def test_chunk_with_other_content_is_rejected(self):
+        self.store.put(self.source, "a")
+        chunks = self.store.get_manifest("a")["chunks"]
+        shutil.copyfile(self.store.chunk_path(chunks[0]), self.store.chunk_path(chunks[1]))
+
+        with self.assertRaisesRegex(ValueError, "corrupt chunk"):
+            self.store.restore("a", self.target)
+
+    def test_manifest_records_the_schema_version(self):
+        conn = sqlite3.connect(os.path.join(self.folder, "versioned.db"))
+        conn.execute("CREATE TABLE t (x)")
+        conn.execute("PRAGMA user_version = 7")
+        conn.commit()
+        conn.close()
+
+        self.store.put(os.path.join(self.folder, "versioned.db"), "a")
+        self.assertEqual(self.store.get_manifest("a")["schema_version"], 7)
+
+
+if __name__ == "__main__":
+    unittest.main()
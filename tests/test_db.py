@@ -0,0 +1,74 @@
+"""Migrations and transactions of the pooled connections."""
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from db.db import close_all, get_connection, initialize_db, read_transaction, transaction
+from db.migrations import LATEST_VERSION, NewerSchemaError, get_version, migrate
+from models.client import Client
+
+
+class ReadTransactionTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.appdata = os.environ.get("APPDATA")
+        os.environ["APPDATA"] = self.folder
+        close_all()
+        initialize_db()
+        with get_connection() as conn:
+            conn.execute("INSERT INTO client (name, surname) VALUES ('Ana', 'López')")
+
+    def tearDown(self):
+        close_all()
+        if self.appdata is None:
+            os.environ.pop("APPDATA", None)
+        else:
+            os.environ["APPDATA"] = self.appdata
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_model_calls_inside_keep_the_snapshot(self):
+        with read_transaction() as conn:
+            Client.get_by_id(1)
+            self.assertTrue(conn.in_transaction)
+            Client.get_all()
+            self.assertTrue(conn.in_transaction)
+        self.assertFalse(conn.in_transaction)
+
+    def test_inside_a_write_transaction_it_doesnt_commit(self):
+        with transaction(immediate=True) as conn:
+            conn.execute("INSERT INTO client (name, surname) VALUES ('Juan', 'Pérez')")
+            with read_transaction():
+                Client.get_by_id(1)
+            self.assertTrue(conn.in_transaction)
+            conn.execute("INSERT INTO client (name, surname) VALUES ('Sofía', 'Díaz')")
+        self.assertFalse(conn.in_transaction)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM client").fetchone()[0], 3)
+
+    def test_error_ends_the_transaction(self):
+        with self.assertRaises(RuntimeError):
+            with read_transaction() as conn:
+                Client.get_by_id(1)
+                raise RuntimeError("boom")
+        self.assertFalse(conn.in_transaction)
+        self.assertEqual(conn.depth, 0)
+
+
+class MigrateTest(unittest.TestCase):
+    def test_fresh_database_gets_every_migration(self):
+        conn = sqlite3.connect(":memory:")
+        self.assertEqual(migrate(conn), list(range(1, LATEST_VERSION + 1)))
+        self.assertEqual(migrate(conn), [])
+
+    def test_newer_database_is_refused(self):
+        conn = sqlite3.connect(":memory:")
+        conn.execute(f"PRAGMA user_version = {LATEST_VERSION + 1}")
+        with self.assertRaises(NewerSchemaError):
+            migrate(conn)
+        self.assertEqual(get_version(conn), LATEST_VERSION + 1)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+"""
+Deleting categories and variants must not take the sale and purchase history with them, and deleting a sale
+takes only its own rows.
+Each test runs on a fresh database in a temporary APPDATA folder.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from db.db import close_all, get_connection, initialize_db
+from models.category import Category
+from models.product import Product
+from models.sale import Sale
+
+
+class DeleteWithHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.appdata = os.environ.get("APPDATA")
+        os.environ["APPDATA"] = self.folder
+        close_all()
+        initialize_db()
+
+        Category.add_category("Bebidas")
+        self.category_id = Category.get_id_by_name("Bebidas")
+        self.product = Product("Gaseosa", self.category_id, "botella", -1, stock=20, stock_low=-1, variants=[
+            {"id": None, "variant_name": "Naranja", "stock": 10, "stock_low": 1, "price": 100},
+            {"id": None, "variant_name": "Limón", "stock": 10, "stock_low": 1, "price": 100},
+        ])
+        self.product.save()
+        self.variants = {row[1]: row[0] for row in get_connection().execute(
+            "SELECT id, variant_name FROM product_variant WHERE product_id = ?", (self.product.id,))}
+
+    def tearDown(self):
+        close_all()
+        if self.appdata is None:
+            os.environ.pop("APPDATA", None)
+        else:
+            os.environ["APPDATA"] = self.appdata
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def sell(self, variant_name, quantity=2):
+        key = (self.product.id, self.variants[variant_name])
+        sale = Sale(items={key: {"quantity": quantity, "unit_price": 100}}, client_id=None, date="2026-01-10")
+        sale.save()
+        return sale
+
+    def count(self, sql, params=()):
+        return get_connection().execute(sql, params).fetchone()[0]
+
+    def test_deleted_category_keeps_the_sales(self):
+        self.sell("Naranja")
+
+        Category.delete_by_id(self.category_id)
+
+        self.assertEqual(self.count("SELECT COUNT(*) FROM category WHERE id = ?", (self.category_id,)), 0)
+        sales = Sale.get_all(None, None)
+        self.assertEqual(len(sales), 1)
+        self.assertEqual(sales[0]["items"][(self.product.id, self.variants["Naranja"])]["quantity"], 2)
+        self.assertEqual(self.count("SELECT COUNT(*) FROM transaction_stock"), 1)
+
+    def test_deleting_a_missing_category_fails(self):
+        with self.assertRaises(ValueError):
+            Category.delete_by_id(self.category_id + 1)
+
+    def test_deleted_variant_keeps_its_sales(self):
+        self.sell("Naranja")
+        kept = [{"id": self.variants["Limón"], "variant_name": "Limón", "stock": 10, "stock_low": 1, "price": 100}]
+
+        Product(self.product.name, self.category_id, "botella", -1, stock=10, stock_low=-1,
+                id=self.product.id, variants=kept).save()
+
+        self.assertEqual(self.count("SELECT COUNT(*) FROM product_variant WHERE product_id = ?", (self.product.id,)), 1)
+        self.assertEqual(self.count("SELECT COUNT(*) FROM sale_detail WHERE variant_id = ?", (self.variants["Naranja"],)), 1)
+        self.assertEqual(self.count("SELECT COUNT(*) FROM transaction_stock"), 1)
+
+    def test_deleted_sale_takes_its_lines_and_gives_back_the_stock(self):
+        sale = self.sell("Naranja", quantity=3)
+
+        Sale.delete(sale.id)
+
+        self.assertEqual(self.count("SELECT COUNT(*) FROM sale"), 0)
+        self.assertEqual(self.count("SELECT COUNT(*) FROM sale_detail"), 0)
+        self.assertEqual(self.count("SELECT COUNT(*) FROM transaction_stock"), 0)
+        self.assertEqual(self.count("SELECT stock FROM product_variant WHERE id = ?", (self.variants["Naranja"],)), 10)
+
+    def test_failed_sale_delete_keeps_the_stock(self):
+        sale = self.sell("Naranja", quantity=3)
+
+        with mock.patch("models.rollup.remove", side_effect=RuntimeError("boom")):
+            with self.assertRaises(RuntimeError):
+                Sale.delete(sale.id)
+
+        self.assertEqual(self.count("SELECT COUNT(*) FROM sale_detail"), 1)
+        self.assertEqual(self.count("SELECT stock FROM product_variant WHERE id = ?", (self.variants["Naranja"],)), 7)
+
+
+if __name__ == "__main__":
+    unittest.main()
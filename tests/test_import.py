@@ -0,0 +1,33 @@
+"""Parsing of the numbers of the imported spreadsheets."""
+import unittest
+
+from services.import_services import _parse_number
+
+
+class ParseNumberTest(unittest.TestCase):
+    def test_thousands_separators(self):
+        self.assertEqual(_parse_number("12.000"), 12000.0)
+        self.assertEqual(_parse_number("$ 1.500"), 1500.0)
+        self.assertEqual(_parse_number("1.500.000"), 1500000.0)
+        self.assertEqual(_parse_number("1.500", integer=True), 1500)
+
+    def test_decimal_separators(self):
+        self.assertEqual(_parse_number("1234.5"), 1234.5)
+        self.assertEqual(_parse_number("1234,5"), 1234.5)
+        self.assertEqual(_parse_number("1.5"), 1.5)
+        self.assertEqual(_parse_number("12.50"), 12.5)
+        self.assertEqual(_parse_number("1.234,50"), 1234.5)
+        self.assertEqual(_parse_number("$ 1,234.50"), 1234.5)
+
+    def test_empty_and_invalid(self):
+        self.assertIsNone(_parse_number(""))
+        self.assertIsNone(_parse_number(None))
+        self.assertEqual(_parse_number(7, integer=True), 7)
+        with self.assertRaises(ValueError):
+            _parse_number("abc")
+        with self.assertRaises(ValueError):
+            _parse_number("1,5", integer=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,197 @@
+"""Storage backends of the backups: the local folder, the Drive lookups and the cached listing."""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from utils import storage
+from utils.storage import CachedBackend, DriveStorageBackend, LocalStorageBackend, StorageBackend
+
+
+class Interrupted(Exception):
+    pass
+
+
+class RecordingBackend(LocalStorageBackend):
+    """Local backend that counts its listings and records the ids it receives."""
+    def __init__(self, root):
+        super().__init__(root)
+        self.listings = 0
+        self.ids = []
+
+    def list(self):
+        self.listings += 1
+        return super().list()
+
+    def get(self, name, file_path, file_id=None):
+        self.ids.append(("get", file_id))
+        super().get(name, file_path, file_id)
+
+    def delete(self, name, file_id=None):
+        self.ids.append(("delete", file_id))
+        super().delete(name, file_id)
+
+
+class StorageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.root = os.path.join(self.folder, "remote")
+        self.source = os.path.join(self.folder, "backup.db")
+        self.data = os.urandom(10 * 1024 + 100)
+        with open(self.source, "wb") as file:
+            file.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def read(self, path):
+        with open(path, "rb") as file:
+            return file.read()
+
+
+class LocalStorageBackendTest(StorageTestCase):
+    def test_interface_is_abstract(self):
+        with self.assertRaises(TypeError):
+            StorageBackend()
+
+    def test_put_get_delete(self):
+        backend = LocalStorageBackend(self.root)
+        stored = backend.put("a.db", self.source, {"sha256": "abc"})
+
+        self.assertEqual(stored["name"], "a.db")
+        self.assertEqual(stored["size"], len(self.data))
+        self.assertEqual([file["metadata"] for file in backend.list()], [{"sha256": "abc"}])
+
+        target = os.path.join(self.folder, "restored.db")
+        backend.get("a.db", target)
+        self.assertEqual(self.read(target), self.data)
+
+        backend.delete("a.db")
+        self.assertEqual(backend.list(), [])
+        self.assertEqual(os.listdir(self.root), [])
+        with self.assertRaises(FileNotFoundError):
+            backend.get("a.db", target)
+        backend.delete("a.db")  # Deleting a missing file does nothing
+
+    def test_interrupted_put_resumes_from_the_last_chunk(self):
+        backend = LocalStorageBackend(self.root)
+        offsets = []
+
+        def stop_after_two_chunks(offset, size):
+            offsets.append(offset)
+            if len(offsets) == 2:
+                raise Interrupted()
+
+        with mock.patch.object(storage, "UPLOAD_CHUNK_SIZE", 1024):
+            with self.assertRaises(Interrupted):
+                backend.put("a.db", self.source, progress=stop_after_two_chunks)
+            self.assertEqual(backend.list(), [])  # The partial file is not listed
+
+            offsets.clear()
+            backend.put("a.db", self.source, progress=lambda offset, size: offsets.append(offset))
+
+        self.assertEqual(offsets[0], 3 * 1024)  # Continued after the two chunks already written
+        self.assertEqual(offsets[-1], len(self.data))
+        self.assertEqual(self.read(os.path.join(self.root, "a.db")), self.data)
+        self.assertEqual(sorted(os.listdir(self.root)), ["a.db", "a.db" + storage.META_SUFFIX])
+
+    def test_changed_source_starts_over(self):
+        backend = LocalStorageBackend(self.root)
+        with mock.patch.object(storage, "UPLOAD_CHUNK_SIZE", 1024):
+            with self.assertRaises(Interrupted):
+                backend.put("a.db", self.source, progress=mock.Mock(side_effect=Interrupted()))
+
+            self.data = os.urandom(5000)
+            with open(self.source, "wb") as file:
+                file.write(self.data)
+            offsets = []
+            backend.put("a.db", self.source, progress=lambda offset, size: offsets.append(offset))
+
+        self.assertEqual(offsets[0], 1024)
+        self.assertEqual(self.read(os.path.join(self.root, "a.db")), self.data)
+
+
+class CachedBackendTest(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.inner = RecordingBackend(self.root)
+        self.inner.put("old.db", self.source)
+        self.backend = CachedBackend(self.inner, ttl=60)
+
+    def test_listing_is_reused_until_it_expires(self):
+        now = 1000.0
+        with mock.patch.object(storage.time, "monotonic", lambda: now):
+            self.assertEqual([file["name"] for file in self.backend.list()], ["old.db"])
+            self.backend.list()
+            self.backend.find("old.db")
+            self.assertEqual(self.inner.listings, 1)
+
+            now += 61
+            self.backend.list()
+            self.assertEqual(self.inner.listings, 2)
+
+            self.backend.invalidate()
+            self.backend.list()
+            self.assertEqual(self.inner.listings, 3)
+
+    def test_puts_and_deletes_update_the_listing(self):
+        self.backend.list()
+        self.backend.put("new.db", self.source)
+        self.assertEqual(sorted(file["name"] for file in self.backend.list()), ["new.db", "old.db"])
+        self.backend.delete("old.db")
+        self.assertEqual([file["name"] for file in self.backend.list()], ["new.db"])
+        self.assertEqual(self.inner.listings, 1)
+
+    def test_get_and_delete_pass_the_cached_id(self):
+        self.backend.list()
+        self.backend.get("old.db", os.path.join(self.folder, "restored.db"))
+        self.backend.delete("old.db")
+        self.assertEqual(self.inner.ids, [("get", "old.db"), ("delete", "old.db")])
+        self.assertEqual(self.inner.listings, 1)
+
+
+class FakeDrive:
+    """Stand-in for pydrive's GoogleDrive that records the queries and the files it is asked for."""
+    def __init__(self, files):
+        self.files = files  # List of Drive file dictionaries
+        self.queries = []
+        self.calls = []
+
+    def ListFile(self, params):
+        self.queries.append(params["q"])
+        if "mimeType='application/vnd.google-apps.folder'" in params["q"]:
+            result = [{"id": "folder"}]
+        else:
+            result = [file for file in self.files if f"title='{file['title']}'" in params["q"]]
+        return mock.Mock(GetList=lambda: result)
+
+    def CreateFile(self, params):
+        return mock.Mock(GetContentFile=lambda path: self.calls.append(("get", params["id"])),
+                         Delete=lambda: self.calls.append(("delete", params["id"])))
+
+
+class DriveStorageBackendTest(unittest.TestCase):
+    def setUp(self):
+        self.drive = FakeDrive([{"id": "1", "title": "a.db", "fileSize": "10", "modifiedDate": "2026-01-10T10:00:00.000Z"}])
+        self.backend = DriveStorageBackend(self.drive, "backups", state_path=None)
+        self.backend.folder_id()
+        self.drive.queries.clear()
+
+    def test_known_id_is_used_without_queries(self):
+        self.backend.get("a.db", "target.db", file_id="1")
+        self.backend.delete("a.db", file_id="1")
+        self.assertEqual(self.drive.queries, [])
+        self.assertEqual(self.drive.calls, [("get", "1"), ("delete", "1")])
+
+    def test_unknown_id_is_looked_up_by_title(self):
+        self.backend.get("a.db", "target.db")
+        self.backend.delete("a.db")
+        self.assertEqual(self.drive.calls, [("get", "1"), ("delete", "1")])
+        self.assertTrue(all("title='a.db'" in query for query in self.drive.queries))
+        with self.assertRaises(FileNotFoundError):
+            self.backend.get("missing.db", "target.db")
+
+
+if __name__ == "__main__":
+    unittest.main()
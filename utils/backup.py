@@ -1,21 +1,70 @@
 import os
 import shutil
+import sqlite3
+import threading
+import time
 import datetime
 from pathlib import Path
 
 from pydrive.auth import GoogleAuth
 from pydrive.drive import GoogleDrive
 
-from db.db import get_writable_db_path
+from db.db import get_writable_db_path, close_all
+from db.migrations import LATEST_VERSION, migrate
+from services import cache
+from utils.chunk_store import ChunkStore, MANIFEST_SUFFIX, file_sha256, schema_version
 from utils.path_utils import get_writable_path
+from utils.storage import CachedBackend, DriveStorageBackend, LocalStorageBackend
 from utils import config
 
 gauth = None
+_remote = None  # Backend of the Drive backups, see get_remote_backend
 BACK_UP_FOLDER = "LaChapitaManager_backups"
+BACKUP_PAGES = 256  # Pages copied per step of the backup API, so a step never holds the database for long
+PART_SUFFIX = ".part"  # Backups being written, renamed to their final name once complete
+MAX_BACKUPS = 30
+REQUIRED_TABLES = {"category", "product", "product_variant", "client", "supplier", "sale", "sale_detail",
+                   "purchase", "purchase_detail", "transaction_stock"}
 
-def make_backup():
+_backup_thread = None
+
+def copy_database(db_path, backup_file_path, progress=None):
+    """
+    Copy a live database with the SQLite online backup API, a few pages at a time.
+    The copy is read inside one read transaction, so it is a consistent snapshot even if the app writes meanwhile
+    (with WAL, writers are not blocked). It is written to a .part file that is renamed when complete, so a copy
+    interrupted halfway never looks like a backup.
+    :param db_path: Path to the database to copy.
+    :param backup_file_path: Path of the copy.
+    :param progress: Function called with (pages copied, total pages) after each step.
+    """
+    part_path = backup_file_path + PART_SUFFIX
+    source = sqlite3.connect(db_path, timeout=30)
+    try:
+        source.execute("BEGIN")
+        source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()  # Starts the snapshot the copy reads
+        target = sqlite3.connect(part_path)
+        try:
+            def on_step(status, remaining, total):
+                if progress: progress(total - remaining, total)
+            source.backup(target, pages=BACKUP_PAGES, progress=on_step)
+            target.execute("PRAGMA journal_mode=DELETE").fetchall()  # The backup is a single self-contained file
+        finally:
+            target.close()
+    finally:
+        source.close()
+    os.replace(part_path, backup_file_path)
+
+def remove_partial_backups(folder):
+    """Remove the .part files left by backups interrupted when the app closed."""
+    for name in os.listdir(folder):
+        if name.startswith("lachapita_backup_") and name.endswith(PART_SUFFIX):
+            os.remove(os.path.join(folder, name))
+
+def make_backup(progress=None):
     """
     Create a backup of the current database and upload it to Google Drive if configured.
+    :param progress: Function called with (pages copied, total pages) while the database is copied.
     :return: True if backup was successful, False otherwise.
     """
     now = datetime.datetime.now()
@@ -27,7 +76,13 @@ def make_backup():
         # Name of the file with timestamp
         backup_file_path = os.path.join(get_writable_path(), backup_filename)
         try:
-            shutil.copy(db_path, backup_file_path)
+            remove_partial_backups(get_writable_path())
+            resume_pending_uploads()
+            if not is_drive_backup_due():
+                print("Last backup is less than a week old. Skipping Drive backup.")
+                return True
+            copy_database(db_path, backup_file_path, progress)
+            # The copy stays in the app folder until uploaded, so an interrupted upload can be resumed
             upload_backup_to_drive(backup_file_path)
             Path.unlink(Path(backup_file_path))  # Remove the local backup file after uploading
         except Exception as e:
@@ -36,12 +91,49 @@ def make_backup():
     else:
         # If not using Google Drive, just copy the database to the backup file
         try:
-            make_local_backup(db_path, backup_filename)
+            if not make_local_backup(db_path, backup_filename, progress):
+                return False
         except Exception as e:
             print(f"Error creating local backup: {e}")
             return False
     return True
 
+def start_backup(progress=None, finished=None):
+    """
+    Run make_backup in a background thread, so the window doesn't freeze while the database is copied.
+    Does nothing if a backup is already running.
+    :param progress: Function called with (pages copied, total pages), from the backup thread.
+    :param finished: Function called with the result of make_backup, from the backup thread.
+    :return: False if a backup was already running, True otherwise.
+    """
+    global _backup_thread
+    if is_backup_running():
+        return False
+
+    def run():
+        ok = False
+        try:
+            ok = make_backup(progress)
+        finally:
+            if finished: finished(ok)
+
+    # Daemon, so the app can still exit if the backup doesn't finish in time: the .part file is left behind
+    _backup_thread = threading.Thread(target=run, name="backup", daemon=True)
+    _backup_thread.start()
+    return True
+
+def is_backup_running():
+    return _backup_thread is not None and _backup_thread.is_alive()
+
+def wait_for_backup(timeout=None):
+    """
+    Wait for the running backup, at most timeout seconds.
+    :return: True if no backup is running anymore, False if it is still running.
+    """
+    if _backup_thread is not None:
+        _backup_thread.join(timeout)
+    return not is_backup_running()
+
 def format_files(files):
     """
     Format the list of files to include only the necessary information.
@@ -49,8 +141,10 @@ def format_files(files):
     """
     formatted_files = []
     for file in files:
-        if file['title'].startswith("lachapita_backup_") and file['title'].endswith(".db"):
-            timestamp_str = file['title'].replace("lachapita_backup_", "").replace(".db", "")
+        title = file['title']
+        # Full copies (.db) or manifests of chunked backups (.json)
+        if title.startswith("lachapita_backup_") and title.endswith((".db", MANIFEST_SUFFIX)):
+            timestamp_str = os.path.splitext(title)[0].replace("lachapita_backup_", "")
             try:
                 file_datetime = datetime.datetime.strptime(timestamp_str, "%Y-%m-%d_%H-%M-%S")
                 formatted_files.append({
@@ -63,28 +157,117 @@ def format_files(files):
                 continue  # Skip files with invalid timestamps
     return formatted_files
 
+def remove_wal_files(db_path):
+    """
+    Remove the WAL files left next to the database. Must be called with every connection closed,
+    otherwise SQLite would replay the old WAL on top of a restored file.
+    """
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+
+# ---------- RESTORE ----------
+
+def verify_backup(path, sha256=None, expected_version=None):
+    """
+    Check a backup file before it replaces the database, and bring its schema up to date.
+    :param path: Path to the backup file. It is migrated in place, so it must be a copy.
+    :param sha256: Checksum the file must have, if known.
+    :param expected_version: Schema version the file must have (the one recorded when the backup was made), if known.
+    :raises ValueError: If the backup is corrupt, isn't a LaChapita database or is from a newer version of the app.
+    :return: The schema version of the backup, before migrating it.
+    """
+    if sha256 and file_sha256(path) != sha256:
+        raise ValueError("The backup doesn't match its checksum")
+    try:
+        conn = sqlite3.connect(path)
+        try:
+            result = conn.execute("PRAGMA quick_check(1)").fetchall()  # Stops at the first problem
+            if result != [("ok",)]:
+                raise ValueError(f"The backup is corrupt: {' '.join(result[0][0].split())}")
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if expected_version is not None and version != expected_version:
+                raise ValueError(f"The backup has schema version {version}, but was made with version {expected_version}")
+            if version > LATEST_VERSION:
+                raise ValueError(f"The backup is from a newer version of the app (schema {version}, this one supports up to {LATEST_VERSION})")
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            missing = REQUIRED_TABLES - tables
+            if missing:
+                raise ValueError(f"The backup is not a LaChapita database, it has no {', '.join(sorted(missing))} table")
+            migrate(conn)  # The database the app opens after the swap is already up to date
+            conn.execute("PRAGMA journal_mode=DELETE").fetchall()  # Leave no WAL next to the copy
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError as e:
+        raise ValueError(f"The backup is not a valid database: {e}")
+    return version
+
+def restore_file(backup_filename, fetch):
+    """
+    Restore a backup without risking the current database: the backup is written to a temporary file and checked
+    (see verify_backup), and only then it replaces the database file in one step. The pooled connections are closed,
+    so every thread opens the restored database, and the cached entities are dropped.
+    No other thread may use the database while it runs (the backup dialog pauses the page loads).
+    :param backup_filename: Name of the backup, for the messages.
+    :param fetch: Function that writes the backup to the path it receives and returns a dictionary with the
+    sha256 and schema_version to check, if known.
+    :return: Tuple (bool, str) indicating success and a message for the user.
+    """
+    if is_backup_running():
+        return False, "A backup is being made, try again when it finishes."
+
+    start = time.perf_counter()
+    db_path = get_writable_db_path()
+    part_path = db_path + PART_SUFFIX
+    try:
+        expected = fetch(part_path) or {}
+        verify_backup(part_path, expected.get("sha256"), expected.get("schema_version"))
+        checked = time.perf_counter()
+
+        close_all()
+        remove_wal_files(db_path)
+        os.replace(part_path, db_path)
+        cache.clear_all()  # The cached entities are from the replaced database
+    except Exception as e:
+        print(f"Error restoring backup {backup_filename}: {e}")
+        return False, str(e)
+    finally:
+        for path in (part_path, part_path + "-wal", part_path + "-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    end = time.perf_counter()
+    print(f"Backup {backup_filename} restored in {end - start:.2f} s "
+          f"(fetch and checks {checked - start:.2f} s, swap {end - checked:.3f} s)")
+    return True, f"Backup restored in {end - start:.2f} s."
+
 # ---------- LOCAL BACKUPS ----------
 
-def make_local_backup(db_path, backup_filename):
+def get_local_store():
+    """Returns the chunk store of the local backups folder."""
+    return ChunkStore(os.path.join(get_writable_path(), BACK_UP_FOLDER))
+
+def make_local_backup(db_path, backup_filename, progress=None):
     """
     Create a local backup of the database only if the last backup is older than a week.
+    The backup is stored in the chunk store of the backups folder: only the chunks that changed since the
+    previous backups take space.
     :param db_path: Path to the current database file.
-    :param backup_file_path: Path where the backup will be saved.
-    :param timestamp: Timestamp for the backup file name.
-    :return: True if backup was successful, False otherwise.
+    :param backup_filename: Name of the backup file.
+    :param progress: Function called with (pages copied, total pages) while the database is copied.
+    :return: True if the backup was created or the last one is recent enough, False if it failed.
     """
 
     try:
         folder_backups = os.path.join(get_writable_path(), BACK_UP_FOLDER)
         os.makedirs(folder_backups, exist_ok=True)
-        backup_file_path = os.path.join(folder_backups, backup_filename)
+        remove_partial_backups(folder_backups)
     except Exception as e:
         print(f"Error creating backup folder: {e}")
         return False
 
-    # Check if the last backup is older than a week
-    existing_files = [{'title': f} for f in os.listdir(folder_backups) if f.startswith("lachapita_backup_") and f.endswith(".db")]
-    formatted_files = format_files(existing_files)
+    store = get_local_store()
+    formatted_files = get_backups_local()
 
     if formatted_files:
         # check the last backup date
@@ -92,101 +275,149 @@ def make_local_backup(db_path, backup_filename):
         last_backup_date = datetime.datetime.combine(last_file['date'], last_file['time'])
         if (datetime.datetime.now() - last_backup_date) < datetime.timedelta(days=7):
             print("Last backup is less than a week old. Skipping local backup.")
-            return False
-        # Delete if more than 30 files
-        if len(formatted_files) >= 29:
-            for file in formatted_files[29:]:
-                file_path = os.path.join(folder_backups, file['title'])
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                    print(f"Deleted old backup: {file['title']}")
-
+            return True
+        # Delete the oldest ones, keeping MAX_BACKUPS with the new one
+        for file in formatted_files[MAX_BACKUPS - 1:]:
+            if file['title'].endswith(MANIFEST_SUFFIX):
+                store.delete(os.path.splitext(file['title'])[0])
+            else:
+                os.remove(os.path.join(folder_backups, file['title']))
+            print(f"Deleted old backup: {file['title']}")
+
+    # Snapshot of the database, chunked into the store and then removed
+    name = os.path.splitext(backup_filename)[0]
+    snapshot_path = os.path.join(folder_backups, backup_filename + PART_SUFFIX)
     try:
-        shutil.copy(db_path, backup_file_path)
-        print(f"Backup created successfully at {backup_file_path}")
+        copy_database(db_path, snapshot_path, progress)
+        stats = store.put(snapshot_path, name)
+        deleted, freed = store.collect_garbage()
+        print(f"Backup {name} created successfully: {stats['new_chunks']} of {stats['chunks']} chunks new, "
+              f"{stats['stored'] / 1024:.0f} KB written for {stats['size'] / 1024:.0f} KB "
+              f"({deleted} unused chunks deleted, {freed / 1024:.0f} KB freed)")
         return True
     except Exception as e:
         print(f"Error creating local backup: {e}")
         return False
+    finally:
+        if os.path.exists(snapshot_path):
+            os.remove(snapshot_path)
 
 def get_backups_local():
     """
-    Get a list of local backups from the backups folder.
-    :return: List of dictionaries with date, time, title, and path.
+    Get a list of local backups from the backups folder: the chunked backups and the full copies made
+    by earlier versions.
+    :return: List of dictionaries with date, time, title, and id, the newest first.
     """
     folder_backups = os.path.join(get_writable_path(), BACK_UP_FOLDER)
     if not os.path.exists(folder_backups):
         return []
 
     existing_files = [{'title': f} for f in os.listdir(folder_backups) if f.startswith("lachapita_backup_") and f.endswith(".db")]
+    existing_files += [{'title': name + MANIFEST_SUFFIX} for name in get_local_store().list()]
     formatted_files = format_files(existing_files)
+    formatted_files.sort(key=lambda f: (f['date'], f['time']), reverse=True)
 
     return formatted_files
 
 def restore_backup_local(backup_filename):
     """
-    Restore a local backup by copying it to the writable database path.
-    :param backup_filename: Name of the backup file to restore.
-    :return: True if restoration was successful, False otherwise.
+    Restore a local backup, reassembling it from its chunks or copying it if it is a full copy.
+    :param backup_filename: Name of the backup file (manifest or full copy) to restore.
+    :return: Tuple (bool, str) indicating success and a message for the user.
     """
     folder_backups = os.path.join(get_writable_path(), BACK_UP_FOLDER)
+    store = get_local_store()
+    name = os.path.splitext(backup_filename)[0]
+    chunked = backup_filename.endswith(MANIFEST_SUFFIX)
     backup_file_path = os.path.join(folder_backups, backup_filename)
 
-    if not os.path.exists(backup_file_path):
+    if not (store.exists(name) if chunked else os.path.exists(backup_file_path)):
         print(f"Backup file {backup_filename} does not exist.")
-        return False
+        return False, f"Backup {backup_filename} does not exist."
 
-    db_path = get_writable_db_path()
-    try:
-        shutil.copy(backup_file_path, db_path)
-        print(f"Backup {backup_filename} restored successfully.")
-        return True
-    except Exception as e:
-        print(f"Error restoring backup: {e}")
-        return False
+    def fetch(part_path):
+        if chunked:
+            manifest = store.restore(name, part_path)  # Checks each chunk and the whole file against their hashes
+            return {"schema_version": manifest.get("schema_version")}
+        shutil.copyfile(backup_file_path, part_path)  # Full copies made by earlier versions have no checksum
+        return None
+
+    return restore_file(backup_filename, fetch)
 
 # ---------- GOOGLE DRIVE BACKUPS ----------
 
-def upload_backup_to_drive(back_up_path):
+def get_remote_backend():
+    """
+    Returns the storage backend of the Drive backups, with a cached listing.
+    If the LACHAPITA_REMOTE_BACKUP_DIR environment variable is set, a folder at that path stands in for Drive.
+    """
+    global _remote
+    if _remote is None:
+        stand_in = os.getenv("LACHAPITA_REMOTE_BACKUP_DIR")
+        if stand_in:
+            backend = LocalStorageBackend(stand_in)
+        else:
+            if gauth is None:
+                authenticate_drive()
+            backend = DriveStorageBackend(GoogleDrive(gauth), BACK_UP_FOLDER,
+                                          os.path.join(get_writable_path(), "upload_state.json"))
+        _remote = CachedBackend(backend)
+    return _remote
+
+def is_drive_backup_due():
+    """Returns True if the last backup in Drive is older than a week, or there is none."""
+    existing_files = get_backups_drive()
+    if not existing_files:
+        return True
+    last_backup_date = datetime.datetime.combine(existing_files[0]['date'], existing_files[0]['time'])
+    return (datetime.datetime.now() - last_backup_date) >= datetime.timedelta(days=7)
+
+def upload_backup_to_drive(back_up_path, progress=None):
     """
     Upload a backup file to Google Drive only if the last backup is older than a week.
+    The upload is resumable: if it is interrupted, uploading the same file again continues where it stopped.
     :param back_up_path: Path to the backup file to upload.
+    :param progress: Function called with (bytes uploaded, total bytes) after each chunk.
     :return: Tuple (bool, str) indicating success and the name of the uploaded file.
     """
-    existing_files, folder_id, drive = get_backups_drive()
-
-    if existing_files: last_file = existing_files[0]
-    else: last_file = None
+    if not is_drive_backup_due():
+        return False, None
 
-    if last_file:
-        # Check if the last backup is from the last week
-        date = last_file['date']
-        time = last_file['time']
-        last_backup_date = datetime.datetime.combine(date, time)
-        if (datetime.datetime.now() - last_backup_date) < datetime.timedelta(days=7):
-            return False, None
+    backend = get_remote_backend()
+    existing_files = get_backups_drive()
 
-    # Upload the new backup file
+    # Upload the new backup file, with what restoring it needs to check it
     file_name = os.path.basename(back_up_path)
-    file_drive = drive.CreateFile({'title': file_name, 'parents': [{'id': folder_id}]})
-    file_drive.SetContentFile(back_up_path)
-    file_drive.Upload()
+    metadata = {"sha256": file_sha256(back_up_path), "schema_version": schema_version(back_up_path)}
+    backend.put(file_name, back_up_path, metadata, progress)
 
-    # Delete if more than 30 files
-    if len(existing_files) >= 29:
-        for file in existing_files[29:]:
-            file.Delete()
-            print(f"Deleted old backup from Drive: {file['title']}")
+    # Delete the oldest ones, keeping MAX_BACKUPS with the new one
+    for file in existing_files[MAX_BACKUPS - 1:]:
+        backend.delete(file['title'])
+        print(f"Deleted old backup from Drive: {file['title']}")
 
     return True, file_name
 
+def resume_pending_uploads():
+    """
+    Upload the backups left in the app folder by uploads that didn't finish (the app closed halfway), so they
+    continue from their last chunk. Each file is deleted once uploaded, or if a newer backup made it unnecessary.
+    """
+    folder = get_writable_path()
+    for name in sorted(os.listdir(folder)):
+        if name.startswith("lachapita_backup_") and name.endswith(".db"):
+            path = os.path.join(folder, name)
+            print(f"Resuming the upload of {name}")
+            upload_backup_to_drive(path)
+            os.remove(path)
+
 def authenticate_drive():
     """
     Authenticate with Google Drive and return the authenticated drive instance.
     Sets backup_drive to False if the client secrets file is not found.
     :return: True if authentication was successful, False otherwise.
     """
-    global gauth
+    global gauth, _remote
     print("Authenticating Google Drive...")
     client_secrets_path = os.path.join(get_writable_path(), "client_secrets.json")
     credentials_path = os.path.join(get_writable_path(), "mycredential.txt")
@@ -209,56 +440,32 @@ def authenticate_drive():
             gauth.Authorize()
 
         gauth.SaveCredentialsFile(credentials_path)
+        _remote = None  # Built again with the new credentials
         return True, None
     except Exception as e:
         return False, f"Error authenticating with Google Drive: {e}"
 
 def get_backups_drive():
     """
-    Get a list of backups from the local backups folder.
-    :return: Tuple (list of backups, folder_id, drive instance)
+    Get the list of backups in the Drive backups folder. The listing is cached for a few minutes.
+    :return: List of dictionaries with date, time, title, and id, the newest first.
     """
-    global gauth
-    if gauth is None:
-        authenticate_drive()
-
-    drive = GoogleDrive(gauth)
-
-    # Look for the backup folder in Google Drive
-    folder_id = None
-
-    file_list = drive.ListFile(
-        {'q': f"title='{BACK_UP_FOLDER}' and mimeType='application/vnd.google-apps.folder'"}).GetList()
-
-    if file_list:
-        folder_id = file_list[0]['id']
-    else:
-        # Create the folder if it doesn't exist
-        folder_drive = drive.CreateFile({'title': BACK_UP_FOLDER, 'mimeType': 'application/vnd.google-apps.folder'})
-        folder_drive.Upload()
-        folder_id = folder_drive['id']
-
-    # Get list of backups in the folder
-    query = f"'{folder_id}' in parents and trashed=false and title contains 'lachapita_backup_'"
-    existing_files = drive.ListFile({'q': query}).GetList()
-
-    existing_files.sort(key=lambda f: f['createdDate'], reverse=True)
-    existing_files = format_files(existing_files)
-
-    return existing_files, folder_id, drive
+    existing_files = [{'title': file['name'], 'id': file['id']} for file in get_remote_backend().list()]
+    formatted_files = format_files(existing_files)
+    formatted_files.sort(key=lambda f: (f['date'], f['time']), reverse=True)
+    return formatted_files
 
-def restore_backup_drive(file_id):
+def restore_backup_drive(backup_filename):
     """
     Restore a backup from the google drive backups folder.
+    :param backup_filename: Name of the backup file in Drive.
+    :return: Tuple (bool, str) indicating success and a message for the user.
     """
+    backend = get_remote_backend()
 
-    global gauth
-    if gauth is None:
-        authenticate_drive()
-
-    drive = GoogleDrive(gauth)
-
-    file = drive.CreateFile({'id': file_id})
-    db_path = get_writable_db_path()
+    def fetch(part_path):
+        backend.get(backup_filename, part_path)
+        file = backend.find(backup_filename)
+        return file["metadata"] if file else None
 
-    file.GetContentFile(db_path)
+    return restore_file(backup_filename, fetch)
@@ -0,0 +1,199 @@
+"""
+Content-addressed store of database backups.
+A backup is split into fixed-size chunks, aligned with the database pages. Each chunk is stored once, compressed
+with zlib, in a file named after the SHA-256 of its content, and each backup is a small JSON manifest with the list
+of its chunks. Backups of a database that barely changed share almost all their chunks, so they take little space.
+Layout of the store folder:
+    chunks/ab/abcdef...    compressed chunk, named after the hash of its uncompressed content
+    manifests/<name>.json  one manifest per backup
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import zlib
+from datetime import datetime
+
+CHUNK_SIZE = 64 * 1024  # 16 pages of 4 KB, so a page written between backups only changes its own chunk
+COMPRESSION_LEVEL = 6
+MANIFEST_SUFFIX = ".json"
+MANIFEST_VERSION = 1
+
+
+def _write_atomic(path, data):
+    """Writes data to a temporary file and renames it, so an interrupted write never leaves a partial file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(data)
+    os.replace(tmp_path, path)
+
+
+def file_sha256(path):
+    """Returns the SHA-256 of the file at path, in hex."""
+    file_hash = hashlib.sha256()
+    with open(path, "rb") as file:
+        for data in iter(lambda: file.read(CHUNK_SIZE), b""):
+            file_hash.update(data)
+    return file_hash.hexdigest()
+
+
+def schema_version(path):
+    """Returns the user_version of the database file at path, or None if it can't be read."""
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            return conn.execute("PRAGMA user_version").fetchone()[0]
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+
+
+class ChunkStore:
+    """
+    Chunks and manifests of the backups in one folder.
+    :param root: Folder of the store. Created on the first write.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.chunks_folder = os.path.join(root, "chunks")
+        self.manifests_folder = os.path.join(root, "manifests")
+
+    def chunk_path(self, digest):
+        return os.path.join(self.chunks_folder, digest[:2], digest)
+
+    def manifest_path(self, name):
+        return os.path.join(self.manifests_folder, name + MANIFEST_SUFFIX)
+
+    # ---------- WRITE ----------
+
+    def put(self, file_path, name):
+        """
+        Stores the file as a backup: writes the chunks that are not in the store yet and then the manifest,
+        so a backup never references a missing chunk.
+        :param file_path: Path to the database file to store. It must not change while it is read.
+        :param name: Name of the backup, without extension.
+        :return: Dictionary with chunks (total), new_chunks, size (bytes of the file) and stored (compressed bytes
+        written).
+        """
+        chunks = []
+        new_chunks = 0
+        stored = 0
+        size = 0
+        file_hash = hashlib.sha256()
+        with open(file_path, "rb") as file:
+            while True:
+                data = file.read(CHUNK_SIZE)
+                if not data:
+                    break
+                size += len(data)
+                file_hash.update(data)
+                digest = hashlib.sha256(data).hexdigest()
+                chunks.append(digest)
+                path = self.chunk_path(digest)
+                if not os.path.exists(path):
+                    compressed = zlib.compress(data, COMPRESSION_LEVEL)
+                    _write_atomic(path, compressed)
+                    new_chunks += 1
+                    stored += len(compressed)
+
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "name": name,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "size": size,
+            "sha256": file_hash.hexdigest(),
+            "schema_version": schema_version(file_path),
+            "chunk_size": CHUNK_SIZE,
+            "chunks": chunks,
+        }
+        _write_atomic(self.manifest_path(name), json.dumps(manifest).encode("utf-8"))
+        return {"chunks": len(chunks), "new_chunks": new_chunks, "size": size, "stored": stored}
+
+    # ---------- READ ----------
+
+    def list(self):
+        """Returns the names of the stored backups, sorted from the newest name to the oldest."""
+        if not os.path.isdir(self.manifests_folder):
+            return []
+        names = [f[:-len(MANIFEST_SUFFIX)] for f in os.listdir(self.manifests_folder) if f.endswith(MANIFEST_SUFFIX)]
+        return sorted(names, reverse=True)
+
+    def exists(self, name):
+        return os.path.exists(self.manifest_path(name))
+
+    def get_manifest(self, name):
+        with open(self.manifest_path(name), "rb") as file:
+            return json.loads(file.read().decode("utf-8"))
+
+    def restore(self, name, target_path):
+        """
+        Reassembles a backup into target_path, checking every chunk and the whole file against their hashes.
+        :raises ValueError: If a chunk is missing or corrupt. target_path may be left partially written.
+        :return: The manifest of the backup.
+        """
+        manifest = self.get_manifest(name)
+        file_hash = hashlib.sha256()
+        with open(target_path, "wb") as target:
+            for digest in manifest["chunks"]:
+                try:
+                    with open(self.chunk_path(digest), "rb") as file:
+                        data = zlib.decompress(file.read())
+                except FileNotFoundError:
+                    raise ValueError(f"Backup {name} is missing chunk {digest}")
+                except zlib.error:
+                    raise ValueError(f"Backup {name} has a corrupt chunk {digest}")
+                if hashlib.sha256(data).hexdigest() != digest:
+                    raise ValueError(f"Backup {name} has a corrupt chunk {digest}")
+                file_hash.update(data)
+                target.write(data)
+        if file_hash.hexdigest() != manifest["sha256"]:
+            raise ValueError(f"Backup {name} doesn't match its checksum")
+        return manifest
+
+    # ---------- RETENTION ----------
+
+    def delete(self, name):
+        """Deletes the manifest of a backup. Its chunks are freed by collect_garbage if no other backup uses them."""
+        path = self.manifest_path(name)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def collect_garbage(self):
+        """
+        Deletes the chunks that no manifest references. Must not run while a backup is being stored, since its
+        chunks are written before its manifest.
+        :return: Tuple (chunks deleted, bytes freed).
+        """
+        referenced = set()
+        for name in self.list():
+            referenced.update(self.get_manifest(name)["chunks"])
+
+        deleted = 0
+        freed = 0
+        if not os.path.isdir(self.chunks_folder):
+            return deleted, freed
+        for prefix in os.listdir(self.chunks_folder):
+            folder = os.path.join(self.chunks_folder, prefix)
+            for digest in os.listdir(folder):
+                if digest not in referenced:  # Also removes the .tmp files of interrupted writes
+                    path = os.path.join(folder, digest)
+                    freed += os.path.getsize(path)
+                    os.remove(path)
+                    deleted += 1
+        return deleted, freed
+
+    def get_stats(self):
+        """Returns the number of backups and chunks, the bytes they take and the bytes the backups represent."""
+        names = self.list()
+        logical = sum(self.get_manifest(name)["size"] for name in names)
+        chunks = 0
+        stored = 0
+        if os.path.isdir(self.chunks_folder):
+            for prefix in os.listdir(self.chunks_folder):
+                folder = os.path.join(self.chunks_folder, prefix)
+                for digest in os.listdir(folder):
+                    chunks += 1
+                    stored += os.path.getsize(os.path.join(folder, digest))
+        return {"backups": len(names), "chunks": chunks, "stored": stored, "logical": logical}
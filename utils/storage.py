@@ -0,0 +1,321 @@
+"""
+Storage backends for the backups: where the backup files are listed, uploaded, downloaded and deleted.
+Every backend stores files by name with a small dictionary of metadata (for example the checksum of a backup).
+- LocalStorageBackend keeps them in a folder. It can stand in for Drive, to try the backups without an account.
+- DriveStorageBackend keeps them in a Google Drive folder.
+- CachedBackend wraps another backend and keeps its listing for a while, so the backup dialog doesn't list the
+  remote folder every time it opens.
+Uploads are done in chunks that are retried on their own, and can be resumed from the last chunk written.
+"""
+import json
+import os
+import shutil
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024  # Drive requires multiples of 256 KB
+RETRIES = 5  # Attempts of each chunk before giving up
+RETRY_DELAY = 1.0  # Seconds before the first retry, doubled on each one
+LISTING_TTL = 300  # Seconds the cached listing is trusted
+
+PART_SUFFIX = ".part"
+META_SUFFIX = ".meta.json"
+
+
+def with_retries(function, retriable, retries=RETRIES, delay=RETRY_DELAY):
+    """
+    Calls function() until it doesn't raise, at most `retries` times, waiting longer before each new attempt.
+    :param retriable: Function that receives the exception and returns True if it is worth retrying.
+    """
+    for attempt in range(retries):
+        try:
+            return function()
+        except Exception as e:
+            if attempt == retries - 1 or not retriable(e):
+                raise
+            print(f"Retrying after error ({attempt + 1}/{retries - 1}): {e}")
+            time.sleep(delay * 2 ** attempt)
+
+
+class StorageBackend(ABC):
+    """
+    Interface of the backends. Files are identified by name, unique inside the backend.
+    list returns dictionaries with name, id, size, modified (datetime) and metadata (dictionary).
+    get and delete accept the id of the file, if the caller already knows it, to avoid looking it up.
+    """
+    @abstractmethod
+    def list(self):
+        """Returns the stored files."""
+
+    @abstractmethod
+    def put(self, name, file_path, metadata=None, progress=None):
+        """
+        Stores the file at file_path with the given name, replacing the one with that name if any.
+        If a previous upload of the same file was interrupted, it continues from where it stopped.
+        :param metadata: Dictionary of JSON values stored with the file.
+        :param progress: Function called with (bytes uploaded, total bytes) after each chunk.
+        :return: The dictionary that describes the stored file, as in list.
+        """
+
+    @abstractmethod
+    def get(self, name, file_path, file_id=None):
+        """Downloads the file with that name into file_path. Raises FileNotFoundError if it doesn't exist."""
+
+    @abstractmethod
+    def delete(self, name, file_id=None):
+        """Deletes the file with that name. Does nothing if it doesn't exist."""
+
+    def find(self, name):
+        """Returns the dictionary of the file with that name, or None."""
+        return next((file for file in self.list() if file["name"] == name), None)
+
+
+class LocalStorageBackend(StorageBackend):
+    """
+    Files in a folder, with their metadata in a .meta.json file next to each one.
+    :param root: Folder of the files. Created on the first write.
+    """
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, name):
+        return os.path.join(self.root, name)
+
+    def _describe(self, name):
+        path = self._path(name)
+        metadata = {}
+        if os.path.exists(path + META_SUFFIX):
+            with open(path + META_SUFFIX, encoding="utf-8") as file:
+                metadata = json.load(file)
+        return {"name": name, "id": name, "size": os.path.getsize(path),
+                "modified": datetime.fromtimestamp(os.path.getmtime(path)), "metadata": metadata}
+
+    def list(self):
+        if not os.path.isdir(self.root):
+            return []
+        return [self._describe(name) for name in sorted(os.listdir(self.root))
+                if not name.endswith((PART_SUFFIX, PART_SUFFIX + ".json", META_SUFFIX))]
+
+    def put(self, name, file_path, metadata=None, progress=None):
+        os.makedirs(self.root, exist_ok=True)
+        path = self._path(name)
+        part_path = path + PART_SUFFIX
+        state_path = part_path + ".json"
+        size = os.path.getsize(file_path)
+        source = {"size": size, "mtime": os.path.getmtime(file_path)}
+
+        # Continue an interrupted copy of the same file, otherwise start over
+        offset = 0
+        if os.path.exists(part_path) and os.path.exists(state_path):
+            with open(state_path, encoding="utf-8") as file:
+                if json.load(file) == source:
+                    offset = min(os.path.getsize(part_path), size)
+        with open(state_path, "w", encoding="utf-8") as file:
+            json.dump(source, file)
+
+        with open(file_path, "rb") as src, open(part_path, "r+b" if offset else "wb") as dst:
+            while offset < size:
+                def write_chunk():
+                    src.seek(offset)
+                    dst.seek(offset)
+                    data = src.read(UPLOAD_CHUNK_SIZE)
+                    dst.write(data)
+                    dst.flush()
+                    return len(data)
+                offset += with_retries(write_chunk, lambda e: isinstance(e, OSError))
+                if progress: progress(offset, size)
+
+        with open(path + META_SUFFIX, "w", encoding="utf-8") as file:
+            json.dump(metadata or {}, file)
+        os.replace(part_path, path)
+        os.remove(state_path)
+        return self._describe(name)
+
+    def get(self, name, file_path, file_id=None):
+        path = self._path(name)
+        if not os.path.exists(path):
+            raise FileNotFoundError(name)
+        shutil.copyfile(path, file_path)
+
+    def delete(self, name, file_id=None):
+        path = self._path(name)
+        for file in (path, path + META_SUFFIX):
+            if os.path.exists(file):
+                os.remove(file)
+
+
+class DriveStorageBackend(StorageBackend):
+    """
+    Files in a Google Drive folder (Drive API v2 through PyDrive), with their metadata as JSON in the description.
+    Uploads are resumable: the session of an upload in progress is saved after each chunk in state_path, so if the
+    app closes halfway, the next upload of the same file continues from the last chunk.
+    :param drive: Authenticated pydrive.drive.GoogleDrive.
+    :param folder_name: Name of the folder, created if it doesn't exist.
+    :param state_path: JSON file with the sessions of the unfinished uploads.
+    """
+    MIME_TYPE = "application/octet-stream"
+
+    def __init__(self, drive, folder_name, state_path):
+        self.drive = drive
+        self.folder_name = folder_name
+        self.state_path = state_path
+        self._folder_id = None
+
+    def folder_id(self):
+        if self._folder_id is None:
+            file_list = self.drive.ListFile(
+                {'q': f"title='{self.folder_name}' and mimeType='application/vnd.google-apps.folder' and trashed=false"}).GetList()
+            if file_list:
+                self._folder_id = file_list[0]['id']
+            else:
+                folder = self.drive.CreateFile({'title': self.folder_name, 'mimeType': 'application/vnd.google-apps.folder'})
+                folder.Upload()
+                self._folder_id = folder['id']
+        return self._folder_id
+
+    @staticmethod
+    def _describe(file):
+        try:
+            metadata = json.loads(file.get('description') or "{}")
+        except ValueError:
+            metadata = {}
+        return {"name": file['title'], "id": file['id'], "size": int(file.get('fileSize', 0)),
+                "modified": datetime.strptime(file['modifiedDate'][:19], "%Y-%m-%dT%H:%M:%S"), "metadata": metadata}
+
+    def list(self):
+        query = f"'{self.folder_id()}' in parents and trashed=false"
+        return [self._describe(file) for file in self.drive.ListFile({'q': query}).GetList()]
+
+    def _named(self, name):
+        """Returns the files with that name, with a query by title instead of listing the whole folder."""
+        title = name.replace("\\", "\\\\").replace("'", "\\'")
+        query = f"title='{title}' and '{self.folder_id()}' in parents and trashed=false"
+        return [self._describe(file) for file in self.drive.ListFile({'q': query}).GetList()]
+
+    # ---------- RESUMABLE UPLOADS ----------
+
+    def _load_states(self):
+        if not os.path.exists(self.state_path):
+            return {}
+        try:
+            with open(self.state_path, encoding="utf-8") as file:
+                return json.load(file)
+        except ValueError:
+            return {}
+
+    def _save_state(self, name, state):
+        states = self._load_states()
+        if state is None:
+            states.pop(name, None)
+        else:
+            states[name] = state
+        with open(self.state_path, "w", encoding="utf-8") as file:
+            json.dump(states, file)
+
+    @staticmethod
+    def _retriable(error):
+        from googleapiclient.errors import HttpError
+        if isinstance(error, HttpError):
+            return error.resp.status in (429, 500, 502, 503, 504)
+        return isinstance(error, (OSError, TimeoutError))
+
+    def put(self, name, file_path, metadata=None, progress=None):
+        from googleapiclient.errors import HttpError
+        from googleapiclient.http import MediaFileUpload
+
+        size = os.path.getsize(file_path)
+        source = {"size": size, "mtime": os.path.getmtime(file_path)}
+        body = {'title': name, 'parents': [{'id': self.folder_id()}], 'description': json.dumps(metadata or {})}
+        media = MediaFileUpload(file_path, mimetype=self.MIME_TYPE, chunksize=UPLOAD_CHUNK_SIZE, resumable=True)
+        request = self.drive.auth.service.files().insert(body=body, media_body=media)
+
+        state = self._load_states().get(name)
+        if state and state["source"] == source:
+            # Continue the session of the interrupted upload from its last chunk
+            request.resumable_uri = state["uri"]
+            request.resumable_progress = state["progress"]
+            print(f"Resuming upload of {name} at {state['progress']} of {size} bytes")
+
+        response = None
+        while response is None:
+            try:
+                status, response = with_retries(request.next_chunk, self._retriable)
+            except HttpError as e:
+                if e.resp.status in (404, 410) and request.resumable_uri:
+                    # The session expired, start the upload again
+                    self._save_state(name, None)
+                    return self.put(name, file_path, metadata, progress)
+                raise
+            if response is None:
+                self._save_state(name, {"source": source, "uri": request.resumable_uri,
+                                        "progress": request.resumable_progress})
+                if progress: progress(status.resumable_progress, size)
+        self._save_state(name, None)
+        if progress: progress(size, size)
+
+        # Replace the older file with the same name, Drive allows duplicated titles
+        for file in self._named(name):
+            if file["id"] != response['id']:
+                self.drive.CreateFile({'id': file["id"]}).Delete()
+        return self._describe(response)
+
+    def find(self, name):
+        files = self._named(name)
+        return files[0] if files else None
+
+    def get(self, name, file_path, file_id=None):
+        if file_id is None:
+            file = self.find(name)
+            if file is None:
+                raise FileNotFoundError(name)
+            file_id = file["id"]
+        self.drive.CreateFile({'id': file_id}).GetContentFile(file_path)
+
+    def delete(self, name, file_id=None):
+        file_ids = [file_id] if file_id is not None else [file["id"] for file in self._named(name)]
+        for file_id in file_ids:
+            self.drive.CreateFile({'id': file_id}).Delete()
+
+
+class CachedBackend(StorageBackend):
+    """
+    Backend that keeps the listing of another one for ttl seconds, and updates it on its own puts and deletes.
+    get and delete pass the id of the file from the cached listing, so the wrapped backend doesn't look it up.
+    :param backend: The backend to wrap.
+    :param ttl: Seconds the listing is trusted. Changes made by other computers show up after it expires.
+    """
+    def __init__(self, backend, ttl=LISTING_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self._listing = None
+        self._listed_at = 0.0
+
+    def invalidate(self):
+        self._listing = None
+
+    def list(self):
+        if self._listing is None or time.monotonic() - self._listed_at > self.ttl:
+            self._listing = self.backend.list()
+            self._listed_at = time.monotonic()
+        return [dict(file) for file in self._listing]
+
+    def put(self, name, file_path, metadata=None, progress=None):
+        stored = self.backend.put(name, file_path, metadata, progress)
+        if self._listing is not None:
+            self._listing = [file for file in self._listing if file["name"] != name] + [stored]
+        return stored
+
+    def _cached_id(self, name):
+        """Returns the id of the file with that name if the cached listing has it, without listing."""
+        if self._listing is None or time.monotonic() - self._listed_at > self.ttl:
+            return None
+        return next((file["id"] for file in self._listing if file["name"] == name), None)
+
+    def get(self, name, file_path, file_id=None):
+        self.backend.get(name, file_path, file_id if file_id is not None else self._cached_id(name))
+
+    def delete(self, name, file_id=None):
+        self.backend.delete(name, file_id if file_id is not None else self._cached_id(name))
+        if self._listing is not None:
+            self._listing = [file for file in self._listing if file["name"] != name]